@@ -1,16 +1,55 @@
-from flask_sqlalchemy import SQLAlchemy
-
 from flask import Flask
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from api.features import wrap_views
 from api.instance.config import app_config
+from api.passwords import passwords
+from api.routing import RoutingSQLAlchemy, replicas
+from api.serializers import json_backend
+from api.sessions import session_cache
+
+db = RoutingSQLAlchemy()
 
-db = SQLAlchemy()
+def create_app(config_name, **settings):
+    """Configure and creates the app.
 
-def create_app(config_name):
-    """Configure and creates the app."""
+    This is the only place an app is built; run.py and manage.py each
+    call it once per process. settings override the configuration, as
+    tests do to switch optional subsystems on. Those are only imported
+    when enabled, so a worker starts without loading what it won't use.
+    """
     app = Flask(__name__, instance_relative_config=True)
     CORS(app)
     app.config.from_object(app_config[config_name])
+    app.config.update(settings)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    return app
\ No newline at end of file
+    hops = app.config.get('PROXY_HOPS')
+    if hops:
+        # remote_addr becomes the client the proxies saw, not the proxy
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+    db.init_app(app)
+    session_cache.init_app(app)
+    replicas.init_app(app, db)
+    json_backend.init_app(app)
+    passwords.init_app(app)
+    if app.config.get('RESPONSE_CACHE_TTL'):
+        from api.cache import response_cache
+        response_cache.init_app(app)
+    if app.config.get('RATELIMIT_ENABLED'):
+        from api.ratelimit import rate_limiter
+        rate_limiter.init_app(app)
+    if app.config.get('METRICS_ENABLED'):
+        # it also hooks every engine's cursor events
+        from api.metrics import metrics
+        metrics.init_app(app)
+        if 'rate_limiter' in app.extensions:
+            metrics.add_source(app.extensions['rate_limiter'].prometheus)
+    if app.config.get('PROFILER_ENABLED'):
+        from api.profiler import profiler
+        profiler.init_app(app)
+
+    from api.routes import register_blueprints
+    register_blueprints(app)
+    wrap_views(app)
+    return app
@@ -0,0 +1,243 @@
+"""Response cache with ETags for the public read endpoints."""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, current_app, request
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import import_string
+
+# the version of a tag that was never invalidated
+INITIAL_VERSION = '0'
+
+
+class CacheBackend(object):
+    """What a cache store must provide to back the response cache.
+
+    LocalCache keeps entries in the worker; a shared store (memcached,
+    redis) only needs these methods to take its place.
+    """
+
+    def get(self, key):
+        """Return the value stored under key, or None."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Return the values stored under keys, None for misses."""
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None, size=0):
+        """Store value under key for ttl seconds, or until evicted."""
+        raise NotImplementedError
+
+    def set_many(self, mapping, ttl=None):
+        """Store each value of mapping under its key."""
+        for key, value in mapping.items():
+            self.set(key, value, ttl)
+
+    def clear(self):
+        """Drop every entry."""
+        raise NotImplementedError
+
+
+class LocalCache(CacheBackend):
+    """In-process LRU cache bounded by entry TTL and total bytes."""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None, size=0):
+        # the key and bookkeeping cost roughly a hundred bytes more
+        size += len(key) + 100
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _drop(self, key):
+        """Remove an entry; the lock must be held."""
+        self.size -= self._entries.pop(key)[1]
+
+
+class DatabaseTags(object):
+    """Tag versions kept in the cache_tag table of the primary database.
+
+    Each worker may keep its own cached responses as long as the tag
+    versions mixed into their keys are shared: a tag invalidated by any
+    worker, or by a manage.py command, then misses everywhere. Only
+    invalidations write to the table. A worker reuses the versions it
+    read for ttl seconds, so most requests, 304s included, run no query
+    and an invalidation elsewhere reaches it within ttl.
+    """
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._versions = LocalCache(1024 * 1024)
+
+    @staticmethod
+    def _table_and_engine():
+        # imported late, as api.models needs the app package built first
+        from api.models import CacheTag, db
+        return CacheTag.__table__, db.get_engine(current_app)
+
+    def get_many(self, keys):
+        if self.ttl:
+            versions = self._versions.get_many(keys)
+        else:
+            versions = [None] * len(keys)
+        missing = [key for key, version in zip(keys, versions)
+                   if version is None]
+        if missing:
+            table, engine = self._table_and_engine()
+            with engine.connect() as connection:
+                found = dict(connection.execute(
+                    select([table.c.tag, table.c.version]).where(
+                        table.c.tag.in_(missing))).fetchall())
+            # tags never invalidated are remembered as ''
+            found = {key: found.get(key, '') for key in missing}
+            if self.ttl:
+                self._versions.set_many(found, self.ttl)
+            versions = [found[key] if version is None else version
+                        for key, version in zip(keys, versions)]
+        return versions
+
+    def set_many(self, mapping, ttl=None):
+        table, engine = self._table_and_engine()
+        rows = [{'tag': key, 'version': value}
+                for key, value in mapping.items()]
+        delete = table.delete().where(table.c.tag.in_(list(mapping)))
+
+        def replace():
+            with engine.begin() as connection:
+                connection.execute(delete)
+                connection.execute(table.insert(), rows)
+        try:
+            replace()
+        except IntegrityError:
+            # another invalidation of one of the tags committed first
+            replace()
+        if self.ttl:
+            self._versions.set_many(mapping, self.ttl)
+
+
+class ResponseCache(object):
+    """Cache successful GET responses per path and normalized query args.
+
+    Entries are tagged ('businesses', 'business:<id>'). Every tag has a
+    version mixed into the cache keys, so invalidating a tag just gives
+    it a new version and the old entries become unreachable. The
+    versions live in a shared backend when one is configured, and in
+    the database otherwise, so every worker sees each invalidation.
+    Tags never invalidated have no stored version and share the
+    initial one. Reading a version never writes one.
+    """
+
+    def __init__(self, backend=None, tags=None):
+        self.backend = backend or LocalCache()
+        self.tags = tags or self.backend
+        self.ttl = 60
+
+    def init_app(self, app):
+        """Set up the backend and TTL from the app config."""
+        app.extensions['response_cache'] = self
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        backend = app.config.get('RESPONSE_CACHE_BACKEND')
+        if backend:
+            self.backend = self.tags = import_string(backend)()
+        else:
+            self.backend = LocalCache(app.config.get(
+                'RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+            self.tags = DatabaseTags(app.config.get(
+                'RESPONSE_CACHE_TAG_TTL', 1.0))
+
+    def cached(self, *tags):
+        """Decorate a view to cache its 200 responses under tags.
+
+        Tags are formatted with the view arguments, so
+        'business:{business_id}' names the business in the URL.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self.ttl or request.method != 'GET':
+                    return f(*args, **kwargs)
+                key = self._key([tag.format(**kwargs) for tag in tags])
+                entry = self.backend.get(key)
+                if entry is not None:
+                    etag, body, status, mimetype = entry
+                    response = Response(body, status=status,
+                                        mimetype=mimetype)
+                else:
+                    response = current_app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    etag = hashlib.sha1(body).hexdigest()
+                    self.backend.set(key, (etag, body, response.status_code,
+                                           response.mimetype),
+                                     ttl=self.ttl, size=len(body))
+                response.set_etag(etag)
+                return response.make_conditional(request)
+            return decorated
+        return decorator
+
+    def invalidate(self, *tags):
+        """Make every response cached under any of tags stale.
+
+        The tags are given one fresh version, in a single write however
+        many there are.
+        """
+        if tags:
+            version = uuid.uuid4().hex
+            self.tags.set_many({self._tag_key(tag): version for tag in tags})
+
+    def clear(self):
+        """Drop every cached response."""
+        self.backend.clear()
+
+    def _key(self, tags):
+        """Return the cache key of the current request."""
+        versions = self.tags.get_many([self._tag_key(tag) for tag in tags])
+        raw = '{}?{}#{}'.format(
+            request.path,
+            urlencode(sorted(request.args.items(multi=True))),
+            ','.join(version or INITIAL_VERSION for version in versions))
+        return 'response:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _tag_key(tag):
+        return 'tag:' + tag
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,129 @@
+"""Stream the business catalogue as NDJSON or CSV."""
+import csv
+import io
+import itertools
+import json
+import zlib
+from operator import attrgetter
+
+from api import db
+from api.models import Business, Review
+
+BUSINESS_COLUMNS = [
+    Business.id, Business.name, Business.category, Business.description,
+    Business.location, Business.business_owner, Business.date_created,
+    Business.review_count, Business.rating_average, Business.rating_1,
+    Business.rating_2, Business.rating_3, Business.rating_4,
+    Business.rating_5]
+CSV_FIELDS = ['id', 'name', 'category', 'description', 'location', 'owner',
+              'date_created', 'review_count', 'rating_average',
+              'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _iso(value):
+    """Return a datetime as ISO 8601 text, keeping None."""
+    return value.isoformat() if value else None
+
+
+def _streamed(query, batch_size):
+    """Run a query on a server-side cursor, batch_size rows at a time."""
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+
+def _review_groups(batch_size):
+    """Yield (business_id, reviews) for every reviewed business by id."""
+    reviews = _streamed(db.session.query(
+        Review.business_id, Review.rating, Review.body, Review.review_owner,
+        Review.date_created).order_by(Review.business_id, Review.id),
+        batch_size)
+    return itertools.groupby(reviews, key=attrgetter('business_id'))
+
+
+def export_businesses(with_reviews=False, batch_size=1000):
+    """Yield every business as a flat dict, lowest id first.
+
+    Reviews are merged in from a second cursor ordered by business id,
+    so embedding them costs one extra query rather than one per business.
+    """
+    businesses = _streamed(
+        db.session.query(*BUSINESS_COLUMNS).order_by(Business.id),
+        batch_size)
+    groups = _review_groups(batch_size) if with_reviews else iter(())
+    group = next(groups, None)
+    for row in businesses:
+        record = dict(zip(CSV_FIELDS, row))
+        record['date_created'] = _iso(row.date_created)
+        if with_reviews:
+            while group is not None and group[0] < row.id:
+                group = next(groups, None)
+            record['reviews'] = []
+            if group is not None and group[0] == row.id:
+                record['reviews'] = [
+                    {'rating': review.rating, 'body': review.body,
+                     'review_by': review.review_owner,
+                     'date_created': _iso(review.date_created)}
+                    for review in group[1]]
+        yield record
+
+
+def as_ndjson(records):
+    """Yield records as NDJSON lines."""
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def as_csv(records, with_reviews=False):
+    """Yield records as CSV lines under a header row.
+
+    Embedded reviews go in a last column holding their JSON.
+    """
+    fields = CSV_FIELDS + (['reviews'] if with_reviews else [])
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for record in records:
+        if with_reviews:
+            record['reviews'] = json.dumps(record['reviews'])
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def buffered(chunks, size=64 * 1024):
+    """Join small text chunks into blocks of about size bytes."""
+    block = []
+    length = 0
+    for chunk in chunks:
+        block.append(chunk.encode('utf-8'))
+        length += len(block[-1])
+        if length >= size:
+            yield b''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield b''.join(block)
+
+
+def gzipped(blocks):
+    """Compress a stream of byte blocks into one gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(fmt='ndjson', with_reviews=False, gzip=False,
+                  batch_size=1000):
+    """Yield the encoded export as byte blocks."""
+    records = export_businesses(with_reviews, batch_size)
+    if fmt == 'csv':
+        lines = as_csv(records, with_reviews)
+    else:
+        lines = as_ndjson(records)
+    blocks = buffered(lines)
+    return gzipped(blocks) if gzip else blocks
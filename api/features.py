@@ -0,0 +1,47 @@
+"""Let routes use the subsystems that create_app loads only when enabled.
+
+The routes are decorated when imported, before any config is read, so
+they only mark what they need. create_app then wraps the marked views
+in the rate limiter and the response cache if it loaded them, and
+modules for those subsystems are never imported when they are off.
+"""
+from flask import current_app
+
+
+def rate_limited(route_class):
+    """Mark a view to count its requests against route_class."""
+    def decorator(f):
+        f.rate_limit = (route_class,)
+        return f
+    return decorator
+
+
+def cached(*tags):
+    """Mark a view to cache its 200 responses under tags."""
+    def decorator(f):
+        f.cache_tags = tags
+        return f
+    return decorator
+
+
+def invalidate(*tags):
+    """Make responses cached under any of tags stale, if caching is on."""
+    cache = current_app.extensions.get('response_cache')
+    if cache is not None:
+        cache.invalidate(*tags)
+
+
+def wrap_views(app):
+    """Wrap the marked views of app in the subsystems it loaded.
+
+    The cache goes inside the rate limit, so cache hits still count.
+    """
+    cache = app.extensions.get('response_cache')
+    limiter = app.extensions.get('rate_limiter')
+    for endpoint, view in list(app.view_functions.items()):
+        wrapped = view
+        if cache is not None and getattr(view, 'cache_tags', None):
+            wrapped = cache.cached(*view.cache_tags)(wrapped)
+        if limiter is not None and getattr(view, 'rate_limit', None):
+            wrapped = limiter.limit(*view.rate_limit)(wrapped)
+        app.view_functions[endpoint] = wrapped
@@ -0,0 +1,177 @@
+"""Grid cells and great-circle distances for the nearby search.
+
+A point's cell id interleaves the bits of its latitude and longitude
+quantized to LEVEL bits each (a Z-order curve, the integer form of a
+geohash). Every coarser cell is then one contiguous range of ids, so
+the cells covering a circle become a few range scans of one ordinary
+B-tree index on any database.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+# bits per axis; the finest cells are about 0.6 m across
+LEVEL = 26
+# the most cells a circle is covered with before a coarser level is used
+MAX_CELLS = 16
+
+_numpy = None
+
+
+def _spread(value):
+    """Spread the 26 low bits of value over the even bits of 52."""
+    result = 0
+    for bit in range(LEVEL):
+        result |= ((value >> bit) & 1) << (2 * bit)
+    return result
+
+
+# the spread of every byte, so a cell id takes four lookups
+_SPREAD_BYTES = [_spread(byte) for byte in range(256)]
+
+
+def _interleave(row, column):
+    """Return the Z-order id of grid cell (row, column)."""
+    result = 0
+    for shift in (0, 8, 16, 24):
+        result |= (_SPREAD_BYTES[(row >> shift) & 0xff] << (2 * shift + 1) |
+                   _SPREAD_BYTES[(column >> shift) & 0xff] << (2 * shift))
+    return result
+
+
+def _row(latitude, level=LEVEL):
+    scale = 1 << level
+    return min(scale - 1, int((latitude + 90.0) / 180.0 * scale))
+
+
+def _column(longitude, level=LEVEL):
+    scale = 1 << level
+    return min(scale - 1, int((longitude + 180.0) / 360.0 * scale))
+
+
+def valid(latitude, longitude):
+    """Return whether a latitude and longitude name a point on Earth."""
+    return -90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0
+
+
+def cell(latitude, longitude):
+    """Return the cell id of a point, or None without both coordinates."""
+    if latitude is None or longitude is None:
+        return None
+    return _interleave(_row(latitude), _column(longitude))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return the latitude span and longitude spans around a circle.
+
+    Returns ((south, north), [(west, east), ...]); a circle crossing the
+    antimeridian gets two longitude spans, and one reaching a pole
+    spans every longitude.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    south = max(-90.0, latitude - math.degrees(angle))
+    north = min(90.0, latitude + math.degrees(angle))
+    if south == -90.0 or north == 90.0 or angle >= math.pi / 2:
+        return (south, north), [(-180.0, 180.0)]
+    width = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(
+        math.radians(latitude)))))
+    west, east = longitude - width, longitude + width
+    if west < -180.0:
+        return (south, north), [(west + 360.0, 180.0), (-180.0, east)]
+    if east > 180.0:
+        return (south, north), [(west, 180.0), (-180.0, east - 360.0)]
+    return (south, north), [(west, east)]
+
+
+def cell_ranges(latitude, longitude, radius_km):
+    """Return inclusive (low, high) cell id ranges covering a circle.
+
+    The finest level covering the circle's bounding box with at most
+    MAX_CELLS cells is used, and neighbouring cells are merged.
+    """
+    (south, north), spans = bounding_box(latitude, longitude, radius_km)
+    for level in range(LEVEL, -1, -1):
+        rows = range(_row(south, level), _row(north, level) + 1)
+        columns = [range(_column(west, level), _column(east, level) + 1)
+                   for west, east in spans]
+        if len(rows) * sum(map(len, columns)) <= MAX_CELLS:
+            break
+    shift = 2 * (LEVEL - level)
+    cells = sorted({_interleave(row, column) << shift for row in rows
+                    for span in columns for column in span})
+    ranges = []
+    for low in cells:
+        high = low + (1 << shift) - 1
+        if ranges and ranges[-1][1] + 1 >= low:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], high))
+        else:
+            ranges.append((low, high))
+    return ranges
+
+
+def _get_numpy():
+    # imported on first use, as it is optional and slow to import
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def distances(latitude, longitude, latitudes, longitudes):
+    """Return the haversine distances in km from a point to many points.
+
+    Computed as arrays with numpy when it is installed, else in Python.
+    """
+    np = _get_numpy()
+    if np is not None:
+        lat1, lng1 = math.radians(latitude), math.radians(longitude)
+        lat2 = np.radians(np.asarray(latitudes, dtype=float))
+        lng2 = np.radians(np.asarray(longitudes, dtype=float))
+        a = (np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) *
+             np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    lat1, lng1 = math.radians(latitude), math.radians(longitude)
+    cos_lat1 = math.cos(lat1)
+    result = []
+    for lat2, lng2 in zip(latitudes, longitudes):
+        lat2, lng2 = math.radians(lat2), math.radians(lng2)
+        a = (math.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * math.cos(lat2) *
+             math.sin((lng2 - lng1) / 2) ** 2)
+        result.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return result
+
+
+def nearest(latitude, longitude, radius_km, points, limit):
+    """Return (distance km, id) of the closest points within radius_km.
+
+    points holds (id, latitude, longitude) rows. At most limit results
+    come back, nearest first.
+    """
+    if not points:
+        return []
+    ids, latitudes, longitudes = zip(*points)
+    found = distances(latitude, longitude, latitudes, longitudes)
+    np = _get_numpy()
+    if np is not None:
+        inside = np.flatnonzero(found <= radius_km)
+        if len(inside) > limit:
+            inside = inside[np.argpartition(found[inside], limit)[:limit]]
+        inside = inside[np.argsort(found[inside], kind='stable')]
+        return [(float(found[i]), ids[i]) for i in inside]
+    return heapq.nsmallest(limit, ((distance, id_) for distance, id_ in
+                                   zip(found, ids) if distance <= radius_km))
+
+
+def search_radii(radius_km, smallest=0.5):
+    """Return the growing radii a nearest-first search tries in turn.
+
+    The nearest n points within a small circle are the nearest n within
+    any larger one, so a search can stop at the first circle holding
+    enough points and dense areas never load the whole radius.
+    """
+    return [radius for radius in (radius_km / 16, radius_km / 4)
+            if radius >= smallest] + [radius_km]
@@ -0,0 +1,127 @@
+"""Bulk review ingestion for the batch endpoint and manage.py."""
+import csv
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+
+from api import db
+from api.features import invalidate
+from api.models import Business, Review, User
+from api.validators import Validator
+
+validator = Validator()
+
+
+class IngestReport(object):
+    """Counts and the first errors of an ingestion run."""
+
+    def __init__(self, max_errors=100):
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+        self.max_errors = max_errors
+        self.started = time.monotonic()
+
+    def reject(self, index, errors):
+        """Record a row that was not inserted."""
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'index': index, 'errors': errors})
+
+    def as_dict(self):
+        """Return the report, including throughput in rows per second."""
+        seconds = time.monotonic() - self.started
+        rows = self.inserted + self.rejected
+        return {'inserted': self.inserted,
+                'rejected': self.rejected,
+                'seconds': round(seconds, 3),
+                'rows_per_second': round(rows / seconds, 1) if seconds else 0,
+                'errors': self.errors}
+
+
+def read_reviews(path):
+    """Yield review rows from a CSV (with a header) or NDJSON file."""
+    with open(path, newline='') as source:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(source):
+                yield row
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def ingest_reviews(rows, reviewer=None, chunk_size=1000, max_errors=100):
+    """Insert reviews from an iterable of dicts, a chunk at a time.
+
+    Rows hold business_id, rating, body and, unless reviewer is given,
+    review_owner. Each chunk resolves its businesses and users with one
+    query apiece, enforces the no-reviewing-own-business rule, inserts
+    the valid rows with one executemany, folds them into the rating
+    aggregates with another, commits and invalidates the cached
+    responses of the businesses, so memory stays bounded by chunk_size.
+    """
+    report = IngestReport(max_errors)
+    numbered = enumerate(rows)
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            break
+        _ingest_chunk(chunk, reviewer, report)
+    return report
+
+
+def _ingest_chunk(chunk, reviewer, report):
+    """Validate and insert one chunk of (index, row) pairs."""
+    candidates = []
+    all_errors = validator.validate_many([row for _, row in chunk],
+                                         'review_reg')
+    for (index, row), errors in zip(chunk, all_errors):
+        if errors is None:
+            errors = {}
+        elif 'item error' in errors:
+            report.reject(index, errors)
+            continue
+        try:
+            business_id = int(row.get('business_id'))
+        except (TypeError, ValueError):
+            errors['business_id error'] = 'Business id is incorrect'
+        owner = reviewer or str(row.get('review_owner') or '').strip()
+        if not owner:
+            errors['review_owner error'] = 'Please provide review_owner'
+        if errors:
+            report.reject(index, errors)
+            continue
+        candidates.append((index, business_id, owner, row))
+
+    business_owners = dict(db.session.query(
+        Business.id, Business.business_owner).filter(Business.id.in_(
+            {business_id for _, business_id, _, _ in candidates})))
+    users = {reviewer} if reviewer else {
+        username for username, in db.session.query(User.username).filter(
+            User.username.in_({owner for _, _, owner, _ in candidates}))}
+
+    reviews = []
+    ratings = defaultdict(Counter)
+    for index, business_id, owner, row in candidates:
+        if business_id not in business_owners:
+            report.reject(index, {'msg': 'Business id is incorrect'})
+        elif owner not in users:
+            report.reject(index, {'msg': 'Review owner does not exist'})
+        elif business_owners[business_id] == owner:
+            report.reject(index, {'msg': 'Reviewing own business not allowed'})
+        else:
+            rating = int(str(row['rating']).strip())
+            reviews.append({'name': owner, 'rating': rating,
+                            'body': str(row['body']).strip(),
+                            'review_owner': owner,
+                            'business_id': business_id})
+            ratings[business_id][rating] += 1
+    if reviews:
+        db.session.execute(Review.__table__.insert(), reviews)
+        db.session.execute(*Business.add_ratings_many(ratings))
+        db.session.commit()
+        invalidate('businesses', *[
+            'business:{}'.format(business_id) for business_id in ratings])
+    report.inserted += len(reviews)
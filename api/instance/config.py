@@ -2,6 +2,45 @@
 import os
 
 
+def engine_options(uri, pool_size=5, max_overflow=10, pool_recycle=1800,
+                   pool_timeout=30, statement_timeout=0):
+    """Return the SQLAlchemy engine options for a database URI.
+
+    The arguments are per-environment defaults; the DB_POOL_SIZE,
+    DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT and
+    DB_STATEMENT_TIMEOUT (milliseconds) env vars override them.
+    """
+    options = {'pool_pre_ping': True}
+    if not uri or uri.startswith('sqlite'):
+        # SQLite pools one connection per thread and takes no sizing
+        return options
+    options.update(
+        pool_size=int(os.getenv('DB_POOL_SIZE', pool_size)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', max_overflow)),
+        pool_recycle=int(os.getenv('DB_POOL_RECYCLE', pool_recycle)),
+        pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', pool_timeout)))
+    if uri.startswith('postgres'):
+        # psycopg2 sends an executemany as pages of statements rather
+        # than one round trip per row
+        options['executemany_mode'] = 'batch'
+    statement_timeout = int(os.getenv('DB_STATEMENT_TIMEOUT',
+                                      statement_timeout))
+    if statement_timeout and uri.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(statement_timeout)}
+    return options
+
+
+def replica_binds():
+    """Return binds replica_0, replica_1... for DATABASE_REPLICA_URL.
+
+    The env var holds one URI or several separated by commas.
+    """
+    uris = os.getenv('DATABASE_REPLICA_URL', '').split(',')
+    replicas = [uri.strip() for uri in uris if uri.strip()]
+    return {'replica_{}'.format(i): uri for i, uri in enumerate(replicas)}
+
+
 class Config(object):
     """Parent configuration class."""
 
@@ -9,24 +48,115 @@ class Config(object):
     CSRF_ENABLED = True
     SECRET_KEY = os.getenv('APP_SECRET')
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_BINDS = replica_binds()
+    # replicas serve GET requests unless lagging by REPLICA_MAX_LAG seconds
+    REPLICA_MAX_LAG = int(os.getenv('REPLICA_MAX_LAG', 5))
+    REPLICA_RETRY_AFTER = 30
+    REPLICA_CHECK_INTERVAL = 10
+    REPLICA_STICKY_SECONDS = 5
+    # sent as x-admin-token to reach the diagnostics endpoints
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+    BATCH_MAX_ITEMS = 500
+    # bounds of /api/v2/businesses/nearby, in km and businesses
+    NEARBY_MAX_RADIUS = 50
+    NEARBY_MAX_RESULTS = 100
+    # seconds a worker trusts its cached view of a login session
+    SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', 30))
+    SESSION_CACHE_MAX_ENTRIES = 10000
+    # public GET responses; 0 disables, a dotted path swaps the backend
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES',
+                                             16 * 1024 * 1024))
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND')
+    # seconds a worker reuses the tag versions it read from the database
+    RESPONSE_CACHE_TAG_TTL = float(os.getenv('RESPONSE_CACHE_TAG_TTL', 1))
+    # orjson or ujson when installed, else the standard library
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+    # hashes made with other settings are upgraded at the next login
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD',
+                                     'pbkdf2:sha256:150000')
+    PASSWORD_SALT_LENGTH = 8
+    # processes hashing off the request thread; 0 hashes inline
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    # hashes running or waiting before sign ins are turned away with 503
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 32))
+    PASSWORD_HASH_TIMEOUT = 10
+    # per user or client IP; RATELIMITS overrides the (rate per second,
+    # burst) of the route classes in api.ratelimit.DEFAULT_LIMITS
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', '1') != '0'
+    RATELIMITS = {}
+    RATELIMIT_BACKEND = os.getenv('RATELIMIT_BACKEND')
+    # proxies in front of the app whose X-Forwarded-For is trusted for the
+    # client IP; one for the Heroku router
+    PROXY_HOPS = int(os.getenv('PROXY_HOPS', 1))
+    # latency, status and SQL figures per route served at /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+    # requests running more queries than this are logged as likely N+1
+    METRICS_QUERY_THRESHOLD = int(os.getenv('METRICS_QUERY_THRESHOLD', 20))
+    METRICS_SLOW_REQUEST = float(os.getenv('METRICS_SLOW_REQUEST', 1.0))
+    # directory where the workers of a server share their figures, so that
+    # /metrics serves their sum; unset keeps them per worker
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    # stack samples of a PROFILER_SAMPLE_RATE share of requests and of
+    # those slower than PROFILER_SLOW_THRESHOLD seconds
+    PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0') == '1'
+    PROFILER_INTERVAL = 0.005
+    PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', 0.01))
+    PROFILER_SLOW_THRESHOLD = float(os.getenv('PROFILER_SLOW_THRESHOLD', 0.5))
+    PROFILER_KEEP = 50
+    # read by gunicorn_config.py; each thread may hold a pooled connection
+    # so SERVER_THREADS stays within the engine's pool_size
+    SERVER_WORKERS = int(os.getenv('WEB_CONCURRENCY', 2))
+    SERVER_WORKER_CLASS = 'gthread'
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 4))
+    SERVER_TIMEOUT = 30
+    # load the app once in the master and fork it into the workers
+    SERVER_PRELOAD = os.getenv('SERVER_PRELOAD', '1') != '0'
+    # fetched by each worker before it accepts traffic
+    WARMUP_PATHS = ['/api/v2/businesses/?limit=20']
 
 
 class DevelopmentConfig(Config):
     """Configurations for Development."""
 
     DEBUG = True
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        Config.SQLALCHEMY_DATABASE_URI, pool_size=2, max_overflow=2)
+    PASSWORD_HASH_WORKERS = 0
+    PROXY_HOPS = 0
+    SERVER_WORKERS = 1
+    SERVER_WORKER_CLASS = 'sync'
+    SERVER_THREADS = 1
+    SERVER_PRELOAD = False
+    WARMUP_PATHS = []
 
 class TestingConfig(Config):
     """Configurations for Testing, with a separate test database."""
 
     TESTING = True
     DEBUG = True
+    # tables are dropped between tests, which no write invalidates
+    RESPONSE_CACHE_TTL = 0
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        Config.SQLALCHEMY_DATABASE_URI, pool_size=1, max_overflow=2)
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+    PASSWORD_HASH_WORKERS = 0
+    RATELIMIT_ENABLED = False
+    PROXY_HOPS = 0
+    SERVER_WORKERS = 1
+    SERVER_WORKER_CLASS = 'sync'
+    SERVER_THREADS = 1
+    WARMUP_PATHS = []
 
 
 class StagingConfig(Config):
     """Configurations for Staging."""
 
     DEBUG = True
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        Config.SQLALCHEMY_DATABASE_URI, pool_size=5, max_overflow=5,
+        statement_timeout=10000)
 
 
 class ProductionConfig(Config):
@@ -34,6 +164,12 @@ class ProductionConfig(Config):
 
     DEBUG = False
     TESTING = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        Config.SQLALCHEMY_DATABASE_URI, pool_size=10, max_overflow=20,
+        pool_recycle=300, statement_timeout=5000)
+    SERVER_WORKERS = int(os.getenv('WEB_CONCURRENCY', 4))
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 8))
+    METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/weconnect-metrics')
 
 app_config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,291 @@
+"""Request and SQL instrumentation exposed in Prometheus text format."""
+import bisect
+import glob
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, current_app, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+_local = threading.local()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if getattr(_local, 'sql', None) is not None:
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    sql = getattr(_local, 'sql', None)
+    if sql is not None and conn.info.get('metrics_started'):
+        sql[0] += 1
+        sql[1] += time.perf_counter() - conn.info['metrics_started'].pop()
+
+
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    sql = getattr(_local, 'sql', None)
+    conn = context.connection
+    if conn is not None and conn.info.get('metrics_started'):
+        started = conn.info['metrics_started'].pop()
+        if sql is not None:
+            sql[0] += 1
+            sql[1] += time.perf_counter() - started
+
+
+def merge(texts):
+    """Sum several Prometheus text expositions series by series.
+
+    Every metric here is a counter or a histogram, so the figures of
+    several workers add up. Each family keeps its comments once and
+    its samples together, in the order first seen.
+    """
+    families = OrderedDict()
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# '):
+                name = line.split()[2]
+                family = families.setdefault(name, (OrderedDict(),
+                                                    OrderedDict()))
+                family[0][line] = None
+            elif line.strip() and family is not None:
+                series, value = line.rsplit(' ', 1)
+                samples = family[1]
+                samples[series] = samples.get(series, 0) + float(value)
+    lines = []
+    for comments, samples in families.values():
+        lines.extend(comments)
+        lines.extend('{} {}'.format(series, int(value) if value.is_integer()
+                                    else repr(value))
+                     for series, value in samples.items())
+    return '\n'.join(lines) + '\n'
+
+
+def clear_snapshots(directory):
+    """Remove the snapshots of a previous server run from directory."""
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'metrics-*.prom')):
+        os.remove(path)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + sorted(extra.items())
+    return '{' + ','.join('{}="{}"'.format(name, _label(value))
+                          for name, value in pairs) + '}'
+
+
+class Metrics(object):
+    """Request latencies, status counts and SQL usage.
+
+    Every statement run on any engine during a request is counted and
+    timed through SQLAlchemy cursor events. Requests issuing more than
+    query_threshold statements are logged and counted as likely N+1
+    patterns.
+
+    Figures are kept per process. With a directory, each process also
+    writes them there at most every snapshot_interval seconds, and
+    /metrics serves the sum over every process of the server, however
+    the scrape is balanced between them.
+    """
+
+    def __init__(self, query_threshold=20, slow_request=1.0, directory=None,
+                 snapshot_interval=1.0):
+        self.enabled = True
+        self.query_threshold = query_threshold
+        self.slow_request = slow_request
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.sources = []
+        self._lock = threading.Lock()
+        self._snapshot_at = 0
+        self.reset()
+
+    def init_app(self, app):
+        """Hook the request and engine events and serve /metrics."""
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.query_threshold = app.config.get('METRICS_QUERY_THRESHOLD',
+                                              self.query_threshold)
+        self.slow_request = app.config.get('METRICS_SLOW_REQUEST',
+                                           self.slow_request)
+        self.directory = app.config.get('METRICS_DIR', self.directory)
+        if not self.enabled:
+            return
+        app.extensions['metrics'] = self
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+        app.before_request(self._start)
+        app.after_request(self.record_status)
+        app.teardown_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.render_response)
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            # (route, method): [bucket counts..., sum, count]
+            self.latency = {}
+            self.statuses = {}
+            self.queries = {}
+            self.query_storms = {}
+        if self.directory:
+            self.write_snapshot()
+
+    def add_source(self, render):
+        """Register a function returning more metrics lines to expose."""
+        if render not in self.sources:
+            self.sources.append(render)
+
+    def _start(self):
+        _local.started = time.perf_counter()
+        _local.sql = [0, 0.0]
+        _local.status = None
+
+    def record_status(self, response):
+        """Note the status of the response being sent."""
+        _local.status = response.status_code
+        return response
+
+    def _finish(self, error=None):
+        started = getattr(_local, 'started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        count, seconds = _local.sql
+        _local.started = _local.sql = None
+        status = 500 if error is not None else _local.status or 500
+        rule = request.url_rule
+        key = (rule.rule if rule is not None else 'unmatched', request.method)
+        index = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = [0] * (
+                    len(LATENCY_BUCKETS) + 3)
+            histogram[index] += 1
+            histogram[-2] += elapsed
+            histogram[-1] += 1
+            self.statuses[key + (status,)] = self.statuses.get(
+                key + (status,), 0) + 1
+            totals = self.queries.setdefault(key, [0, 0.0])
+            totals[0] += count
+            totals[1] += seconds
+            if count > self.query_threshold:
+                self.query_storms[key] = self.query_storms.get(key, 0) + 1
+        if count > self.query_threshold:
+            logger.warning('%s %s ran %d queries (%.1f ms of SQL), '
+                           'possibly N+1', key[1], request.path, count,
+                           seconds * 1000)
+        if elapsed > self.slow_request:
+            logger.warning('%s %s took %.0f ms', key[1], request.path,
+                           elapsed * 1000)
+        if self.directory and time.monotonic() >= self._snapshot_at:
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        """Write this process's figures where the others can read them."""
+        self._snapshot_at = time.monotonic() + self.snapshot_interval
+        path = os.path.join(self.directory,
+                            'metrics-{}.prom'.format(os.getpid()))
+        partial = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(partial, 'w') as snapshot:
+            snapshot.write(self.render())
+        os.replace(partial, path)
+
+    def render_all(self):
+        """Return the figures of every process sharing the directory."""
+        if not self.directory:
+            return self.render()
+        self.write_snapshot()
+        texts = []
+        for path in sorted(glob.glob(os.path.join(self.directory,
+                                                  'metrics-*.prom'))):
+            try:
+                with open(path) as snapshot:
+                    texts.append(snapshot.read())
+            except OSError:
+                continue  # cleared since it was listed
+        return merge(texts)
+
+    def render(self):
+        """Return every metric in Prometheus text exposition format."""
+        names = ('route', 'method')
+        with self._lock:
+            latency = {key: list(value) for key, value in self.latency.items()}
+            statuses = dict(self.statuses)
+            queries = {key: list(value) for key, value in self.queries.items()}
+            storms = dict(self.query_storms)
+        lines = ['# HELP http_request_duration_seconds Request latency.',
+                 '# TYPE http_request_duration_seconds histogram']
+        for key, histogram in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram):
+                cumulative += count
+                lines.append('http_request_duration_seconds_bucket{} {}'
+                             .format(_labels(names, key, le=bound),
+                                     cumulative))
+            lines.append('http_request_duration_seconds_sum{} {}'.format(
+                _labels(names, key), histogram[-2]))
+            lines.append('http_request_duration_seconds_count{} {}'.format(
+                _labels(names, key), histogram[-1]))
+        lines += ['# HELP http_requests_total Responses by status.',
+                  '# TYPE http_requests_total counter']
+        lines += ['http_requests_total{} {}'.format(
+            _labels(names + ('status',), key), count)
+            for key, count in sorted(statuses.items())]
+        lines += ['# HELP db_queries_total SQL statements run by requests.',
+                  '# TYPE db_queries_total counter']
+        lines += ['db_queries_total{} {}'.format(_labels(names, key), total[0])
+                  for key, total in sorted(queries.items())]
+        lines += ['# HELP db_query_seconds_total Time requests spent in SQL.',
+                  '# TYPE db_query_seconds_total counter']
+        lines += ['db_query_seconds_total{} {}'.format(
+            _labels(names, key), total[1])
+            for key, total in sorted(queries.items())]
+        lines += ['# HELP db_query_storms_total Requests running more than '
+                  '{} queries.'.format(self.query_threshold),
+                  '# TYPE db_query_storms_total counter']
+        lines += ['db_query_storms_total{} {}'.format(_labels(names, key),
+                                                      count)
+                  for key, count in sorted(storms.items())]
+        for source in self.sources:
+            lines.extend(source())
+        return '\n'.join(lines) + '\n'
+
+    def render_response(self):
+        # scrapers send the admin token as a bearer token
+        expected = current_app.config.get('ADMIN_TOKEN')
+        given = request.headers.get('Authorization', '')
+        given = (given[len('Bearer '):] if given.startswith('Bearer ')
+                 else request.headers.get('x-admin-token', ''))
+        if not expected or not hmac.compare_digest(given, expected):
+            return jsonify({'msg': 'Admin token is missing or incorrect'}), 403
+        return Response(self.render_all(),
+                        mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
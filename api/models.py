@@ -1,15 +1,24 @@
 """we_connect/models.py."""
-from flask_sqlalchemy import SQLAlchemy
-from api import db
+import re
+from datetime import datetime
+
+from sqlalchemy.orm import backref
+
+from api import db, geo
+
+WORD = re.compile(r'\w+')
 
 class BaseModel(db.Model):
     """ Class is the base model """
 
+    __abstract__ = True
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
-    date_modified = db.Column(db.DateTime,
-                              onupdate=db.func.current_timestamp())
+    # set here rather than by the database so every backend keeps the
+    # microseconds the (date_created, id) keyset cursors compare against
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    date_modified = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
 
 class User(BaseModel):
@@ -26,10 +35,35 @@ class User(BaseModel):
 
     @staticmethod
     def get_user(username_or_email):
-        """Retrieve a user."""
-        query1 = User.query.filter_by(username=username_or_email).first()
-        query2 = User.query.filter_by(email=username_or_email).first()
-        return query1 or query2
+        """Retrieve a user by username or email in a single query."""
+        if '@' not in username_or_email:
+            # validated emails always carry an @, so only usernames can match
+            return User.get_by_username(username_or_email)
+        return User.query.filter(db.or_(
+            User.username == username_or_email,
+            User.email == username_or_email)).order_by(
+            # a username match wins, as it did with the separate lookups
+            db.case({username_or_email: 0}, value=User.username,
+                    else_=1)).first()
+
+    @staticmethod
+    def get_by_username(username):
+        """Retrieve a user using the unique username index."""
+        return User.query.filter_by(username=username).first()
+
+    @staticmethod
+    def get_by_email(email):
+        """Retrieve a user using the unique email index."""
+        return User.query.filter_by(email=email).first()
+
+    @staticmethod
+    def get_session_token(username):
+        """Retrieve only the logged in token of a user."""
+        row = db.session.query(User.logged_in_token).filter_by(
+            username=username).first()
+        if not row:
+            raise LookupError(username)
+        return row[0]
 
 
 class Business(BaseModel):
@@ -39,8 +73,197 @@ class Business(BaseModel):
     location = db.Column(db.String, nullable=False)
     description = db.Column(db.String, nullable=False)
     business_owner = db.Column(db.String, db.ForeignKey('user.username'))
+    # rating aggregates, kept current by the Review listeners below
+    review_count = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    rating_average = db.Column(db.Float, nullable=False, default=0,
+                               server_default='0')
+    rating_1 = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    rating_2 = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    rating_3 = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    rating_4 = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    rating_5 = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    # optional coordinates, and the grid cell the nearby search scans
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geocell = db.Column(db.BigInteger)
     reviews = db.relationship('Review', backref=backref('review_for',
                 uselist=False), cascade="all, delete-orphan", lazy=True)
+    __table_args__ = (
+        db.Index('ix_business_rating_average', 'rating_average'),
+        db.Index('ix_business_business_owner', 'business_owner'),
+        db.Index('ix_business_category_location', 'category', 'location'),
+        db.Index('ix_business_date_created', 'date_created', 'id'),
+        db.Index('ix_business_geocell', 'geocell'),
+    )
+
+    search_fields = ('name', 'location', 'category')
+
+    @staticmethod
+    def add_ratings(business_id, ratings):
+        """Return an UPDATE folding new ratings into a business's aggregates.
+
+        ratings maps a star value (1-5) to the number of reviews giving it;
+        negative numbers remove reviews. Every column is updated relative
+        to its current value, so concurrent writers never lose counts.
+        """
+        table = Business.__table__
+        count = sum(ratings.values())
+        total = sum(stars * n for stars, n in ratings.items())
+        values = {
+            table.c.review_count: table.c.review_count + count,
+            table.c.rating_sum: table.c.rating_sum + total,
+            table.c.rating_average: db.func.coalesce(
+                (table.c.rating_sum + total) * 1.0 /
+                db.func.nullif(table.c.review_count + count, 0), 0),
+        }
+        for stars, n in ratings.items():
+            column = table.c['rating_{}'.format(stars)]
+            values[column] = column + n
+        return table.update().where(table.c.id == business_id).values(values)
+
+    @staticmethod
+    def add_ratings_many(ratings):
+        """Return an UPDATE and its parameters folding in many ratings.
+
+        ratings maps business ids to what add_ratings takes. Executed
+        together, as one executemany, they update every business at once:
+        db.session.execute(*Business.add_ratings_many(ratings)).
+        """
+        table = Business.__table__
+        count, total = db.bindparam('count'), db.bindparam('total')
+        values = {
+            table.c.review_count: table.c.review_count + count,
+            table.c.rating_sum: table.c.rating_sum + total,
+            table.c.rating_average: db.func.coalesce(
+                (table.c.rating_sum + total) * 1.0 /
+                db.func.nullif(table.c.review_count + count, 0), 0),
+        }
+        for stars in range(1, 6):
+            column = table.c['rating_{}'.format(stars)]
+            values[column] = column + db.bindparam('stars_{}'.format(stars))
+        params = []
+        for business_id, counts in ratings.items():
+            row = {'business': business_id,
+                   'count': sum(counts.values()),
+                   'total': sum(stars * n for stars, n in counts.items())}
+            for stars in range(1, 6):
+                row['stars_{}'.format(stars)] = counts.get(stars, 0)
+            params.append(row)
+        return table.update().where(
+            table.c.id == db.bindparam('business')).values(values), params
+
+    def search_terms(self):
+        """Return the rows indexing this business for search."""
+        return [{'business_id': self.id, 'field': field, 'term': term}
+                for field in self.search_fields
+                for term in set(tokenize(getattr(self, field) or ''))]
+
+    @staticmethod
+    def bulk_insert(businesses):
+        """Insert many new businesses and their search terms at once.
+
+        The ids are reserved up front, so the businesses go in with one
+        statement after that and their search index rows with one more,
+        whatever the batch size. The mapper events do not run, so the grid
+        cells and search terms are written here. Nothing is committed.
+        """
+        if not businesses:
+            return
+        table = Business.__table__
+        for business in businesses:
+            business.geocell = geo.cell(business.latitude, business.longitude)
+        # every row needs the same keys; columns no business sets keep
+        # their defaults
+        keys = [column.key for column in table.columns
+                if column.key != 'id' and any(getattr(business, column.key)
+                                              is not None
+                                              for business in businesses)]
+        rows = [{key: getattr(business, key) for key in keys}
+                for business in businesses]
+        if db.session.get_bind().dialect.name == 'postgresql':
+            ids = [row[0] for row in db.session.execute(
+                db.select([db.func.nextval('business_id_seq')]).select_from(
+                    db.func.generate_series(1, len(rows))))]
+            for row, id_ in zip(rows, ids):
+                row['id'] = id_
+            db.session.execute(table.insert().values(rows))
+        else:
+            # SQLite gives rowids after the largest one, and the first
+            # insert holds the write lock until commit, so the rest can
+            # take the ids that follow it
+            first = db.session.execute(
+                table.insert(), rows[0]).inserted_primary_key[0]
+            ids = list(range(first, first + len(rows)))
+            for row, id_ in zip(rows[1:], ids[1:]):
+                row['id'] = id_
+            if len(rows) > 1:
+                db.session.execute(table.insert(), rows[1:])
+        for business, id_ in zip(businesses, ids):
+            business.id = id_
+        terms = [term for business in businesses
+                 for term in business.search_terms()]
+        if terms:
+            db.session.execute(BusinessTerm.__table__.insert(), terms)
+
+def tokenize(text):
+    """Split text into the lowercase words the search index holds."""
+    return WORD.findall(text.lower())
+
+
+class BusinessTerm(db.Model):
+    """This class represents the search index, one row per business word."""
+
+    business_id = db.Column(db.Integer,
+                            db.ForeignKey('business.id', ondelete='CASCADE'),
+                            primary_key=True)
+    field = db.Column(db.String(16), primary_key=True)
+    term = db.Column(db.String, primary_key=True)
+    __table_args__ = (
+        db.Index('ix_business_term_field_term', 'field', 'term',
+                 postgresql_ops={'term': 'text_pattern_ops'}),
+    )
+
+
+@db.event.listens_for(Business, 'before_insert')
+@db.event.listens_for(Business, 'before_update')
+def locate_business(mapper, connection, business):
+    """Keep the grid cell of a business in step with its coordinates."""
+    business.geocell = geo.cell(business.latitude, business.longitude)
+
+
+@db.event.listens_for(Business, 'after_insert')
+def index_new_business(mapper, connection, business):
+    """Add a new business to the search index."""
+    terms = business.search_terms()
+    if terms:
+        connection.execute(BusinessTerm.__table__.insert(), terms)
+
+
+@db.event.listens_for(Business, 'after_update')
+def reindex_business(mapper, connection, business):
+    """Rebuild the search index rows of an edited business."""
+    state = db.inspect(business)
+    if not any(state.attrs[field].history.has_changes()
+               for field in Business.search_fields):
+        return
+    unindex_business(mapper, connection, business)
+    index_new_business(mapper, connection, business)
+
+
+@db.event.listens_for(Business, 'after_delete')
+def unindex_business(mapper, connection, business):
+    """Remove a business from the search index."""
+    table = BusinessTerm.__table__
+    connection.execute(table.delete().where(
+        table.c.business_id == business.id))
 
 
 class Review(BaseModel):
@@ -50,3 +273,34 @@ class Review(BaseModel):
     body = db.Column(db.String, nullable=False)
     review_owner = db.Column(db.String, db.ForeignKey('user.username'))
     business_id = db.Column(db.Integer, db.ForeignKey('business.id'))
+    __table_args__ = (
+        # the reviews of a business, newest first
+        db.Index('ix_review_business_id_date_created',
+                 'business_id', 'date_created', 'id'),
+        db.Index('ix_review_review_owner', 'review_owner'),
+    )
+
+
+@db.event.listens_for(Review, 'after_insert')
+def count_new_review(mapper, connection, review):
+    """Add a new review to the rating aggregates of its business."""
+    connection.execute(Business.add_ratings(review.business_id,
+                                            {review.rating: 1}))
+
+
+@db.event.listens_for(Review, 'after_delete')
+def uncount_review(mapper, connection, review):
+    """Take a deleted review out of the rating aggregates."""
+    connection.execute(Business.add_ratings(review.business_id,
+                                            {review.rating: -1}))
+
+
+class CacheTag(db.Model):
+    """This class represents the response cache tag versions.
+
+    Kept in the database so an invalidation by any worker, or by a
+    manage.py command, reaches every worker at once.
+    """
+
+    tag = db.Column(db.String, primary_key=True)
+    version = db.Column(db.String(32), nullable=False)
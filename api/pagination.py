@@ -0,0 +1,100 @@
+"""Keyset (cursor) pagination helpers for the list endpoints."""
+import base64
+import binascii
+import json
+import math
+from datetime import datetime
+
+from api import db
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPage(object):
+    """A page of rows plus the cursor that fetches the next one."""
+
+    def __init__(self, items, per_page, next_cursor):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(values):
+    """Return an opaque cursor holding the sort key of a row."""
+    raw = [value.strftime(CURSOR_DATE_FORMAT)
+           if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(
+        json.dumps(raw).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, columns):
+    """Return the sort key held in a cursor, raising ValueError if bad."""
+    try:
+        raw = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('Cursor is invalid')
+    if not isinstance(raw, list) or len(raw) != len(columns):
+        raise ValueError('Cursor is invalid')
+    values = []
+    for column, value in zip(columns, raw):
+        if isinstance(column.type, db.DateTime):
+            value = datetime.strptime(str(value), CURSOR_DATE_FORMAT)
+        elif isinstance(column.type, db.Integer) and (
+                not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError('Cursor is invalid')
+        elif isinstance(column.type, db.Numeric) and (
+                not isinstance(value, (int, float)) or
+                isinstance(value, bool) or not math.isfinite(value)):
+            raise ValueError('Cursor is invalid')
+        elif isinstance(column.type, db.String) and not isinstance(value,
+                                                                   str):
+            raise ValueError('Cursor is invalid')
+        values.append(value)
+    return values
+
+
+def _after(columns, values, descending):
+    """Build the filter selecting rows that sort after the given key."""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [col == value for col, value in zip(columns[:i], values[:i])]
+        beyond = column < values[i] if descending else column > values[i]
+        clauses.append(db.and_(*(equal + [beyond])))
+    return db.or_(*clauses)
+
+
+def keyset_paginate(query, columns, after=None, limit=5, descending=False):
+    """Return the page of query that follows the cursor `after`.
+
+    Rows are ordered by `columns`, which must form a unique key, so every
+    page costs one index range scan however deep it is.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if after:
+        query = query.filter(
+            _after(columns, decode_cursor(after, columns), descending))
+    order = [column.desc() if descending else column.asc()
+             for column in columns]
+    rows = query.order_by(None).order_by(*order).limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(
+            [getattr(last, column.key) for column in columns])
+    return KeysetPage(items, limit, next_cursor)
+
+
+def estimate_count(model):
+    """Return the planner's row estimate for a model's table.
+
+    Falls back to None where no cheap estimate exists (anything but
+    PostgreSQL), so callers can count exactly instead.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    return db.session.execute(
+        db.text('SELECT reltuples::bigint FROM pg_class WHERE relname = :t'),
+        {'t': model.__tablename__}).scalar()
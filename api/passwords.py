@@ -0,0 +1,121 @@
+"""Password hashing offloaded to a bounded pool of worker processes."""
+import os
+import threading
+
+from flask import jsonify
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or a hash takes too long."""
+
+
+class PasswordHasher(object):
+    """Hash and check passwords off the request thread.
+
+    Hashing is CPU bound, so bursts of logins would otherwise pin every
+    request worker. Jobs go to a process pool, and at most queue_size of
+    them may be running or waiting; beyond that callers get HashingBusy
+    (a 503) straight away instead of piling up. With workers=0 hashing
+    runs inline, which is what the tests use.
+    """
+
+    def __init__(self, method='pbkdf2:sha256:150000', salt_length=8,
+                 workers=0, queue_size=32, timeout=10):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._prefix = None
+
+    def init_app(self, app):
+        """Read the hashing settings and register the 503 handler."""
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.salt_length = app.config.get('PASSWORD_SALT_LENGTH',
+                                          self.salt_length)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', self.timeout)
+        self._slots = threading.BoundedSemaphore(
+            app.config.get('PASSWORD_HASH_QUEUE', 32))
+        self._prefix = None
+        self.shutdown()
+        app.register_error_handler(HashingBusy, self._busy)
+
+    def hash(self, password):
+        """Return the hash of password with the configured method."""
+        return self._run(generate_password_hash, password, self.method,
+                         self.salt_length)
+
+    def check(self, pwhash, password):
+        """Return whether password matches pwhash."""
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Return whether pwhash was made with other hashing settings."""
+        if self._prefix is None:
+            # werkzeug spells out defaults such as the iteration count,
+            # so compare against a hash it actually made
+            self._prefix = generate_password_hash(
+                '', self.method, self.salt_length).split('$')[0]
+        parts = pwhash.split('$')
+        return (len(parts) != 3 or parts[0] != self._prefix or
+                len(parts[1]) != self.salt_length)
+
+    def shutdown(self):
+        """Stop the worker processes, if any were started."""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.close()
+            self._pool = None
+
+    @staticmethod
+    def _context():
+        import multiprocessing
+        # forking a server worker whose other threads may hold locks can
+        # deadlock the child, so the pool forks from a fresh forkserver
+        # process instead (or spawns where there is none)
+        methods = multiprocessing.get_all_start_methods()
+        return multiprocessing.get_context(
+            'forkserver' if 'forkserver' in methods else 'spawn')
+
+    def _executor(self):
+        # started on first use, so each forked server worker gets its own
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = self._context().Pool(self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        # imported here, as inline hashing never needs it
+        import multiprocessing
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy
+        release = lambda _: self._slots.release()
+        try:
+            result = self._executor().apply_async(
+                func, args, callback=release, error_callback=release)
+        except Exception:
+            self._slots.release()
+            raise
+        try:
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            raise HashingBusy
+
+    @staticmethod
+    def _busy(error):
+        response = jsonify({'msg': 'Too many sign ins right now, '
+                                   'please try again shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,187 @@
+"""Opt-in stack sampling profiler for slow or randomly chosen requests."""
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import request
+
+
+class Profile(object):
+    """The stacks sampled while one request was handled."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, method, path, started, duration, stacks, reason):
+        self.id = next(self._ids)
+        self.method = method
+        self.path = path
+        self.started = started
+        self.duration = duration
+        self.stacks = stacks
+        self.reason = reason
+
+    def summary(self):
+        """Return what the profile is about, without its stacks."""
+        return {'id': self.id, 'method': self.method, 'path': self.path,
+                'started': self.started,
+                'duration_ms': round(self.duration * 1000, 1),
+                'samples': sum(self.stacks.values()), 'reason': self.reason}
+
+
+class Profiler(object):
+    """Sample the Python stack of requests in flight.
+
+    While enabled, a background thread reads the frames of the threads
+    handling requests every interval seconds and counts each distinct
+    stack. A request's stacks are kept if it was picked at random (one
+    in 1/sample_rate) or ran longer than slow_threshold seconds; the
+    last `keep` profiles are held in a ring buffer. Sampling threads
+    rather than tracing calls keeps the cost flat however deep the
+    handler goes, so every request can be watched for slowness.
+    """
+
+    def __init__(self, interval=0.005, sample_rate=0.0, slow_threshold=None,
+                 keep=50):
+        self.enabled = False
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.profiles = deque(maxlen=keep)
+        self._active = {}
+        self._labels = {}
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the profiler settings and watch the app's requests."""
+        app.extensions['profiler'] = self
+        # a sampler left by an earlier app would watch this one's requests
+        self.stop()
+        self.configure(
+            enabled=app.config.get('PROFILER_ENABLED', self.enabled),
+            interval=app.config.get('PROFILER_INTERVAL', self.interval),
+            sample_rate=app.config.get('PROFILER_SAMPLE_RATE',
+                                       self.sample_rate),
+            slow_threshold=app.config.get('PROFILER_SLOW_THRESHOLD',
+                                          self.slow_threshold),
+            keep=app.config.get('PROFILER_KEEP', self.profiles.maxlen))
+        # hooked even when paused so it can be resumed at runtime
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def configure(self, enabled=None, interval=None, sample_rate=None,
+                  slow_threshold=False, keep=None):
+        """Change the settings of a running profiler.
+
+        Pass slow_threshold=None to keep only randomly picked requests.
+        """
+        if enabled is not None:
+            self.enabled = bool(enabled)
+            if not self.enabled:
+                self.stop()
+        if interval is not None:
+            self.interval = max(0.001, float(interval))
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        if slow_threshold is not False:
+            self.slow_threshold = (None if slow_threshold is None
+                                   else float(slow_threshold))
+        if keep is not None and keep != self.profiles.maxlen:
+            self.profiles = deque(self.profiles, maxlen=int(keep))
+
+    def settings(self):
+        """Return the current settings."""
+        return {'enabled': self.enabled, 'interval': self.interval,
+                'sample_rate': self.sample_rate,
+                'slow_threshold': self.slow_threshold,
+                'keep': self.profiles.maxlen}
+
+    def collapsed(self, profiles):
+        """Return profiles merged into collapsed-stack text.
+
+        Each line is `outer;...;inner count`, the input flamegraph.pl
+        and speedscope expect.
+        """
+        stacks = Counter()
+        for profile in profiles:
+            stacks.update(profile.stacks)
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in stacks.most_common())
+
+    def _start(self):
+        if not self.enabled:
+            return
+        self.start()
+        self._active[threading.get_ident()] = (
+            time.time(), time.perf_counter(), Counter(),
+            random.random() < self.sample_rate)
+
+    def _finish(self, error=None):
+        entry = self._active.pop(threading.get_ident(), None)
+        if entry is None:
+            return
+        started, clock, stacks, picked = entry
+        duration = time.perf_counter() - clock
+        slow = (self.slow_threshold is not None and
+                duration >= self.slow_threshold)
+        if picked or slow:
+            self.profiles.append(Profile(
+                request.method, request.full_path.rstrip('?'), started,
+                duration, stacks, 'slow' if slow else 'sampled'))
+
+    def start(self):
+        """Start the sampling thread of this process unless it runs.
+
+        Called on the first profiled request, so each forked server
+        worker runs its own.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._sample, args=(self._stop,), name='profiler',
+                daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        """Stop the sampling thread of this process, if it runs."""
+        thread = self._thread
+        self._stop.set()
+        if thread is not None and self._pid == os.getpid():
+            thread.join()
+        self._thread = self._pid = None
+
+    def _sample(self, stop):
+        while not stop.wait(self.interval):
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for ident, entry in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    entry[2][self._collapse(frame)] += 1
+
+    def _collapse(self, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = '{}:{}'.format(
+                    os.path.basename(code.co_filename), code.co_name)
+            labels.append(label)
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+
+profiler = Profiler()
@@ -0,0 +1,171 @@
+"""Token bucket rate limits per route class, keyed on user or client IP."""
+import heapq
+import math
+import time
+from collections import Counter
+from functools import wraps
+
+import jwt
+from flask import current_app, jsonify, request
+from werkzeug.utils import import_string
+
+# route class: (requests refilled per second, burst)
+DEFAULT_LIMITS = {
+    'auth': (0.2, 5),
+    'read': (5, 30),
+    'search': (1, 10),
+    'write': (1, 10),
+}
+
+
+class RateLimitBackend(object):
+    """What a store of token buckets must provide.
+
+    LocalBuckets keeps the buckets in the worker, so each worker admits
+    its own share; a shared store (redis, memcached) only needs these
+    methods to enforce one limit across every worker.
+    """
+
+    def consume(self, key, rate, burst, now):
+        """Take a token from bucket key.
+
+        Return 0 when one was available, otherwise the seconds until
+        the next one is.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """Refill every bucket."""
+        raise NotImplementedError
+
+
+class LocalBuckets(RateLimitBackend):
+    """Per-process token buckets that take no lock.
+
+    Each bucket is a (tokens, stamp, full_at) tuple swapped in by a
+    single dict assignment, which the GIL makes atomic. Threads racing
+    on one key can at worst let an extra request through.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def consume(self, key, rate, burst, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            tokens = burst
+        else:
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return (1 - tokens) / rate
+        tokens -= 1
+        self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return 0
+
+    def clear(self):
+        self._buckets = {}
+
+    def _prune(self, now):
+        """Make room for new buckets.
+
+        Buckets that have refilled are dropped, as if never used. When
+        too few have, the least recently used tenth goes as well, rather
+        than every caller's limit being reset at once.
+        """
+        for key, bucket in list(self._buckets.items()):
+            if bucket[2] <= now:
+                self._buckets.pop(key, None)
+        excess = len(self._buckets) - self.max_keys + 1
+        if excess > 0:
+            excess = max(excess, self.max_keys // 10)
+            for key, _ in heapq.nsmallest(
+                    excess, list(self._buckets.items()),
+                    key=lambda item: item[1][1]):
+                self._buckets.pop(key, None)
+
+
+class RateLimiter(object):
+    """Limit requests per route class with a token bucket per caller.
+
+    Callers sending a valid token share a bucket per user, wherever they
+    connect from; everyone else gets one per client IP.
+    """
+
+    def __init__(self, backend=None):
+        self.enabled = True
+        self.limits = dict(DEFAULT_LIMITS)
+        self.backend = backend or LocalBuckets()
+        self.rejected = Counter()
+
+    def init_app(self, app):
+        """Set up the limits and the backend from the app config."""
+        app.extensions['rate_limiter'] = self
+        self.enabled = app.config.get('RATELIMIT_ENABLED', self.enabled)
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(app.config.get('RATELIMITS') or {})
+        backend = app.config.get('RATELIMIT_BACKEND')
+        self.backend = import_string(backend)() if backend else LocalBuckets()
+
+    def limit(self, route_class):
+        """Decorate a view to count its requests against route_class."""
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if self.enabled:
+                    rate, burst = self.limits[route_class]
+                    retry_after = self.backend.consume(
+                        '{}:{}'.format(route_class, self.identity()),
+                        rate, burst, time.time())
+                    if retry_after:
+                        return self._reject(route_class, retry_after)
+                return f(*args, **kwargs)
+            return decorated
+        return decorator
+
+    @staticmethod
+    def identity():
+        """Return user:<username> for a valid token, else ip:<address>.
+
+        The address is the client's as forwarded by the PROXY_HOPS
+        proxies in front of the app.
+        """
+        token = request.headers.get('x-access-token')
+        if token:
+            try:
+                return 'user:' + jwt.decode(
+                    token, current_app.config['SECRET_KEY'])['username']
+            except Exception:
+                pass
+        return 'ip:' + (request.remote_addr or 'unknown')
+
+    def stats(self):
+        """Return the configured limits and rejections per route class."""
+        return {'enabled': bool(self.enabled),
+                'limits': {name: {'rate': rate, 'burst': burst}
+                           for name, (rate, burst) in self.limits.items()},
+                'rejected': dict(self.rejected)}
+
+    def prometheus(self):
+        """Return the rejection counters as Prometheus text lines."""
+        lines = ['# HELP ratelimit_rejected_total Requests turned away with '
+                 '429.', '# TYPE ratelimit_rejected_total counter']
+        lines += ['ratelimit_rejected_total{{route_class="{}"}} {}'.format(
+            name, count) for name, count in sorted(self.rejected.items())]
+        return lines
+
+    def _reject(self, route_class, retry_after):
+        self.rejected[route_class] += 1
+        seconds = int(math.ceil(retry_after))
+        response = jsonify({
+            'msg': 'Too many requests, try again in {} seconds'.format(
+                seconds)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(seconds)
+        return response
+
+
+rate_limiter = RateLimiter()
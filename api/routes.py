@@ -1,19 +0,0 @@
-"""we_connect/routes.py."""
-from flask import jsonify, request
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-from datetime import timedelta
-from functools import wraps
-import jwt
-import re
-
-# local imports
-from api.models import User
-from api.models import Business
-from api.models import Review
-from api.validators import Validator
-from run import app
-
-
-validator = Validator()
-
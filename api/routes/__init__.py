@@ -0,0 +1,8 @@
+"""The blueprints serving the API routes."""
+
+
+def register_blueprints(app):
+    """Register the user, business, review and admin routes on app."""
+    from api.routes import business, diagnostics, export, review, user
+    for module in (user, business, review, diagnostics, export):
+        app.register_blueprint(module.blueprint)
@@ -1,8 +1,99 @@
 """Handle requests made on business routes"""
-import os
-from api import create_app, db
+from flask import Blueprint, current_app, jsonify, request
 
-@app.route('/api/v2/businesses', methods=['POST'])
+from api import db, geo
+from api.features import cached, invalidate, rate_limited
+from api.models import Business
+from api.pagination import keyset_paginate, estimate_count
+from api.routes.index import (check_for_login, check_json, token_required,
+                              validator)
+from api.search import nearby_businesses
+from api.search import search_businesses as search_index
+from api.serializers import (BUSINESS_DETAILS, json_response,
+                             requested_fields, serializer_for)
+
+blueprint = Blueprint('businesses', __name__)
+business_serializer = serializer_for('business')
+
+
+def sort_order():
+    """Return the keyset columns and direction chosen by ?sort=."""
+    if request.args.get('sort') == 'rating':
+        return [Business.rating_average, Business.id], True
+    return [Business.id], False
+
+
+def filter_listing(query):
+    """Apply ?min_rating= and ?sort=rating to a business query."""
+    if 'min_rating' in request.args:
+        query = query.filter(Business.rating_average >= request.args.get(
+            'min_rating', 0, type=float))
+    if request.args.get('sort') == 'rating':
+        columns, _ = sort_order()
+        query = query.order_by(None).order_by(
+            *[column.desc() for column in columns])
+    return query
+
+
+def coordinates(content):
+    """Return the validated (latitude, longitude) of a business, if any.
+
+    Raises ValueError when only one of them is given.
+    """
+    if ('latitude' in content) != ('longitude' in content):
+        raise ValueError('Provide both latitude and longitude')
+    if 'latitude' not in content:
+        return None
+    return (float(str(content['latitude']).strip()),
+            float(str(content['longitude']).strip()))
+
+
+def project(query, fields, columns=()):
+    """Select only the business columns fields and columns need.
+
+    The rows come back as plain tuples the serializer reads like
+    businesses, skipping ORM instance construction and identity map
+    bookkeeping. Write handlers keep loading full Business objects.
+    """
+    return query.with_entities(*business_serializer.columns(
+        Business, fields, [column.key for column in columns]))
+
+
+def keyset_response(query, empty_msg, estimate=False):
+    """Return a cursor page of businesses for ?after=<cursor>&limit=n.
+
+    The total is only computed when asked for with ?total=exact, or
+    ?total=estimate for the planner's estimate where one exists.
+    """
+    limit = request.args.get('limit', 5, type=int)
+    query = filter_listing(query)
+    columns, descending = sort_order()
+    try:
+        fields = requested_fields('business')
+        businesses = keyset_paginate(project(query, fields, columns),
+                                     columns, request.args.get('after'),
+                                     limit, descending)
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
+    if not businesses.items:
+        return jsonify({'msg': empty_msg}), 400
+    message = {'businesses': business_serializer.many(businesses.items,
+                                                      fields),
+               'per_page': businesses.per_page,
+               'next_cursor': businesses.next_cursor}
+    total = request.args.get('total')
+    # the planner estimate only covers the unfiltered table
+    estimate = estimate and 'min_rating' not in request.args
+    if total == 'estimate' and estimate:
+        message['total_results'] = estimate_count(Business)
+    if total in ('exact', 'estimate') and message.get(
+            'total_results') is None:
+        message['total_results'] = query.order_by(None).count()
+    return json_response(message)
+
+
+@blueprint.route('/api/v2/businesses', methods=['POST'])
+@rate_limited('write')
 @check_json
 @token_required
 @check_for_login
@@ -11,26 +102,91 @@ def register_business(current_user, content):
     err_msg = validator.validate(content, 'business_reg')
     if err_msg:
         return jsonify(err_msg), 400
+    try:
+        point = coordinates(content) or (None, None)
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
     new_business = Business(name=content['name'].strip(),
                             category=content['category'].strip(),
                             description=content['description'].strip(),
                             location=content['location'].strip(),
-                            owner=current_user
+                            latitude=point[0], longitude=point[1],
+                            business_owner=current_user.username
                             )
     db.session.add(new_business)
     db.session.commit()
+    invalidate('businesses')
     message = {'msg': "Business id {} created for owner {}".format(
         new_business.id, new_business.business_owner),
-        'details': {'name': new_business.name,
-                    'category': new_business.category,
-                    'description': new_business.description,
-                    'location': new_business.location,
-                    'owner': new_business.business_owner
-                    }}
-    return jsonify(message), 201
+        'details': business_serializer.one(new_business, BUSINESS_DETAILS)}
+    return json_response(message, 201)
+
+
+@blueprint.route('/api/v2/businesses/batch', methods=['POST'])
+@rate_limited('write')
+@check_json
+@token_required
+@check_for_login
+def register_businesses(current_user, content):
+    """Register many businesses for a user in one transaction.
+
+    Takes {"businesses": [...], "mode": "atomic" | "best_effort"}. In
+    atomic mode (the default) one invalid business rejects the batch;
+    best effort creates the valid ones and reports the rest.
+    """
+    items = content.get('businesses') if isinstance(content, dict) else None
+    mode = content.get('mode', 'atomic') if isinstance(content, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'msg': 'Provide a list of businesses'}), 400
+    if mode not in ('atomic', 'best_effort'):
+        return jsonify({'msg': 'Mode must be atomic or best_effort'}), 400
+    max_items = current_app.config.get('BATCH_MAX_ITEMS', 500)
+    if len(items) > max_items:
+        return jsonify({
+            'msg': 'A batch cannot hold more than {} businesses'.format(
+                max_items)}), 400
+    results = []
+    new_businesses = []
+    all_errors = validator.validate_many(items, 'business_reg')
+    for index, (item, errors) in enumerate(zip(items, all_errors)):
+        if not errors:
+            try:
+                point = coordinates(item) or (None, None)
+            except ValueError as err:
+                errors = {'msg': str(err)}
+        if errors:
+            results.append({'index': index, 'status': 'invalid',
+                            'errors': errors})
+            continue
+        results.append({'index': index, 'status': 'created'})
+        new_businesses.append(Business(
+            name=item['name'].strip(),
+            category=item['category'].strip(),
+            description=item['description'].strip(),
+            location=item['location'].strip(),
+            latitude=point[0], longitude=point[1],
+            business_owner=current_user.username))
+    invalid = len(results) - len(new_businesses)
+    if (invalid and mode == 'atomic') or not new_businesses:
+        for result in results:
+            if result['status'] == 'created':
+                result['status'] = 'skipped'
+        return jsonify({'msg': '{} of {} businesses are invalid'.format(
+            invalid, len(results)), 'results': results}), 400
+    Business.bulk_insert(new_businesses)
+    db.session.commit()
+    invalidate('businesses')
+    created = iter(new_businesses)
+    for result in results:
+        if result['status'] == 'created':
+            result['id'] = next(created).id
+    return jsonify({'msg': '{} businesses created for owner {}'.format(
+        len(new_businesses), current_user.username),
+        'results': results}), 201
 
 
-@app.route('/api/v2/businesses/<business_id>', methods=['PUT'])
+@blueprint.route('/api/v2/businesses/<business_id>', methods=['PUT'])
+@rate_limited('write')
 @check_json
 @token_required
 @check_for_login
@@ -39,34 +195,34 @@ def update_business(current_user, content, business_id):
     message = validator.validate(content, 'business_reg')
     if message:
         return jsonify(message), 400
+    try:
+        point = coordinates(content)
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
     to_update = Business.query.filter_by(id=business_id).first()
     if not to_update:
         return jsonify({'msg': 'Business id is incorrect'}), 400
     if not to_update.business_owner == current_user.username:
         return jsonify(
             {'msg': 'You are not allowed to edit this business'}), 403
-    Business.query.filter_by(id=business_id).update(
-        {
-            'name': content['name'].strip(),
-            'category': content['category'].strip(),
-            'description': content['description'].strip(),
-            'location': content['location'].strip(),
-        })
+    to_update.name = content['name'].strip()
+    to_update.category = content['category'].strip()
+    to_update.description = content['description'].strip()
+    to_update.location = content['location'].strip()
+    if point:
+        # left out, the coordinates stay as they were
+        to_update.latitude, to_update.longitude = point
     db.session.commit()
-    updated_bs = Business.query.filter_by(id=business_id).first()
+    invalidate('businesses',
+               'business:{}'.format(business_id))
     message = {'msg': "Business id {} modified for owner {}".format(
-        updated_bs.id, updated_bs.business_owner),
-        'details': {'name': updated_bs.name,
-                    'category': updated_bs.category,
-                    'description': updated_bs.description,
-                    'location': updated_bs.location,
-                    'owner': updated_bs.business_owner,
-                    'id': updated_bs.id
-                    }}
-    return jsonify(message), 201
-
-
-@app.route('/api/v2/businesses/<business_id>', methods=['DELETE'])
+        to_update.id, to_update.business_owner),
+        'details': business_serializer.one(to_update, BUSINESS_DETAILS)}
+    return json_response(message, 201)
+
+
+@blueprint.route('/api/v2/businesses/<business_id>', methods=['DELETE'])
+@rate_limited('write')
 @token_required
 @check_for_login
 def delete_business(current_user, business_id):
@@ -79,45 +235,48 @@ def delete_business(current_user, business_id):
             {'msg': 'You are not allowed to delete this business'}), 403
     db.session.delete(to_delete)
     db.session.commit()
+    invalidate('businesses',
+               'business:{}'.format(business_id))
     message = {'msg': 'Business id {} for owner {} deleted successfully'.
                format(to_delete.id, to_delete.business_owner),
-               'details': {'name': to_delete.name,
-                           'category': to_delete.category,
-                           'description': to_delete.description,
-                           'location': to_delete.location,
-                           'owner': to_delete.business_owner,
-                           'id': to_delete.id
-                           }}
-    return jsonify(message), 200
+               'details': business_serializer.one(to_delete,
+                                                  BUSINESS_DETAILS)}
+    return json_response(message)
 
 
-@app.route('/api/v2/businesses/')
+@blueprint.route('/api/v2/businesses/')
+@rate_limited('read')
+@cached('businesses')
 def get_all_businesses():
     """Retrieve a list of all registered businesses."""
+    if 'after' in request.args:
+        return keyset_response(Business.query, 'No businesses yet',
+                               estimate=True)
     page = 1
     limit = 5
     if 'page' in request.args:
         page = request.args.get('page', 1, type=int)
     if 'limit' in request.args:
         limit = request.args.get('limit', 5, type=int)
-    businesses = Business.query.filter_by().paginate(
+    try:
+        fields = requested_fields('business')
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
+    businesses = filter_listing(project(Business.query, fields)).paginate(
         page, limit, True)
     if not businesses.items:
         return jsonify({'msg': 'No businesses yet'}), 400
-    message = {'businesses': [{'name': business.name,
-                               'category': business.category,
-                               'description': business.description,
-                               'id': business.id,
-                               'location': business.location,
-                               'owner': business.business_owner}
-                              for business in businesses.items],
+    message = {'businesses': business_serializer.many(businesses.items,
+                                                      fields),
                "per_page": businesses.per_page, "page": businesses.page,
                "total_pages": businesses.pages,
                "total_results": businesses.total}
-    return jsonify(message), 200
+    return json_response(message)
 
 
-@app.route('/api/v2/businesses/search', methods=['GET'])
+@blueprint.route('/api/v2/businesses/search', methods=['GET'])
+@rate_limited('search')
+@cached('businesses')
 def search_businesses():
     """Retrieve the list of all businesses."""
     name = ""
@@ -135,44 +294,100 @@ def search_businesses():
         page = request.args.get('page', 1, type=int)
     if 'limit' in request.args:
         limit = request.args.get('limit', 5, type=int)
-    businesses = db.session.query(Business).filter(
-        Business.name.ilike('%{0}%'.format(name)),
-        Business.location.ilike('%{0}%'.format(location)),
-        Business.category.ilike('%{0}%'.format(category))).paginate(
-        page, limit, True)
+    try:
+        fields = requested_fields('business')
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
+    query = search_index(name, location, category)
     if name == "" and location == "" and category == "":
-        businesses = Business.query.filter_by().paginate(
+        if 'after' in request.args:
+            return keyset_response(Business.query, 'No businesses yet',
+                                   estimate=True)
+        businesses = filter_listing(project(Business.query, fields)).paginate(
             page, limit, True)
         if not businesses.items:
             return jsonify({'msg': 'No businesses yet'}), 400
+    elif 'after' in request.args:
+        # a cursor holds the sort key, which relevance is not part of
+        if request.args.get('sort') != 'rating':
+            return jsonify({'msg': 'Search results are ranked by relevance, '
+                                   'page through them with page or pass '
+                                   'sort=rating to use after'}), 400
+        return keyset_response(query, 'No businesses match this search')
+    else:
+        businesses = filter_listing(project(query, fields)).paginate(
+            page, limit, True)
     if not len(list(businesses.items)):
         return jsonify({'msg': 'No businesses match this search'}), 400
-    message = {'businesses': [{'name': business.name,
-                               'category': business.category,
-                               'description': business.description,
-                               'location': business.location,
-                               'id': business.id,
-                               'owner': business.business_owner}
-                              for business in businesses.items],
+    message = {'businesses': business_serializer.many(businesses.items,
+                                                      fields),
                "per_page": businesses.per_page, "page": businesses.page,
                "total_pages": businesses.pages,
                "total_results": businesses.total}
-    return jsonify(message), 200
+    return json_response(message)
+
+
+@blueprint.route('/api/v2/businesses/nearby', methods=['GET'])
+@rate_limited('search')
+@cached('businesses')
+def get_nearby_businesses():
+    """Retrieve the businesses within ?radius= km of ?lat=&lng=.
+
+    The radius defaults to 2 km and the nearest ?limit= (default 20)
+    come first, each with its distance_km.
+    """
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lng', type=float)
+    radius = request.args.get('radius', 2, type=float)
+    limit = request.args.get('limit', 20, type=int)
+    max_radius = current_app.config.get('NEARBY_MAX_RADIUS', 50)
+    max_results = current_app.config.get('NEARBY_MAX_RESULTS', 100)
+    if latitude is None or longitude is None or not geo.valid(latitude,
+                                                             longitude):
+        return jsonify({'msg': 'Provide a valid lat and lng'}), 400
+    if not 0 < radius <= max_radius:
+        return jsonify({'msg': 'Radius must be more than 0 and at most {} '
+                               'km'.format(max_radius)}), 400
+    if not 0 < limit <= max_results:
+        return jsonify({'msg': 'Limit must be between 1 and {}'.format(
+            max_results)}), 400
+    try:
+        fields = requested_fields('business')
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
+    found = nearby_businesses(latitude, longitude, radius, limit)
+    if not found:
+        return jsonify({'msg': 'No businesses within {} km'.format(
+            radius)}), 400
+    rows = {row.id: row for row in project(Business.query.filter(
+        Business.id.in_([business_id for _, business_id in found])),
+        fields, [Business.id])}
+    extract = business_serializer.compile(fields)
+    businesses = []
+    for distance, business_id in found:
+        if business_id not in rows:
+            # deleted since it was found
+            continue
+        business = extract(rows[business_id])
+        business['distance_km'] = round(distance, 3)
+        businesses.append(business)
+    return json_response({'businesses': businesses, 'radius_km': radius,
+                          'total_results': len(businesses)})
 
 
-@app.route('/api/v2/businesses/<business_id>', methods=['GET'])
+@blueprint.route('/api/v2/businesses/<business_id>', methods=['GET'])
+@rate_limited('read')
+@cached('business:{business_id}')
 def get_business(business_id):
     """Retrieve a single business."""
+    try:
+        fields = requested_fields('business')
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
     business = Business.query.filter_by(id=business_id).first()
     if not business:
         return jsonify({'msg': 'Business id is incorrect'}), 400
     message = {'msg': 'Business id {} owned by {} retrieved successfully'.
                format(business.id, business.business_owner),
-               'details': {'name': business.name,
-                           'category': business.category,
-                           'description': business.description,
-                           'location': business.location,
-                           'id': business.id,
-                           'owner': business.business_owner
-                           }}
-    return jsonify(message), 200
+               'details': business_serializer.one(business, fields)}
+    return json_response(message)
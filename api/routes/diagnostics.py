@@ -0,0 +1,114 @@
+"""Handle requests made on diagnostics routes"""
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from api import db
+from api.routes.index import admin_required
+from api.routing import replicas
+
+blueprint = Blueprint('diagnostics', __name__)
+
+
+def not_loaded(setting):
+    """Answer for a subsystem this worker was started without."""
+    return jsonify({'msg': 'Not enabled on this worker, set {}'.format(
+        setting)}), 404
+
+
+def pool_stats(engine):
+    """Return the checkout figures of an engine's connection pool."""
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__, 'status': pool.status()}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    return stats
+
+
+@blueprint.route('/api/v2/diagnostics/pool', methods=['GET'])
+@admin_required
+def get_pool_stats():
+    """Report the live connection pool figures of every database."""
+    message = {'engines': {'default': pool_stats(db.get_engine())}}
+    for bind in current_app.config.get('SQLALCHEMY_BINDS') or {}:
+        message['engines'][bind] = pool_stats(db.get_engine(bind=bind))
+    message['options'] = {
+        key: value for key, value in
+        current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).items()
+        if key != 'connect_args'}
+    return jsonify(message), 200
+
+
+@blueprint.route('/api/v2/diagnostics/replicas', methods=['GET'])
+@admin_required
+def get_replica_status():
+    """Report the lag and health of every read replica."""
+    return jsonify({'replicas': replicas.status()}), 200
+
+
+@blueprint.route('/api/v2/diagnostics/ratelimit', methods=['GET'])
+@admin_required
+def get_rate_limit_stats():
+    """Report the rate limits and how many requests each turned away."""
+    rate_limiter = current_app.extensions.get('rate_limiter')
+    if rate_limiter is None:
+        return not_loaded('RATELIMIT_ENABLED=1')
+    return jsonify(rate_limiter.stats()), 200
+
+
+@blueprint.route('/api/v2/diagnostics/profiler', methods=['GET', 'PUT'])
+@admin_required
+def profiler_settings():
+    """Show or change the profiler settings of this worker.
+
+    PUT takes any of enabled, sample_rate, slow_threshold (null keeps
+    only sampled requests), interval and keep.
+    """
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None:
+        return not_loaded('PROFILER_ENABLED=1')
+    if request.method == 'PUT':
+        content = request.get_json(silent=True)
+        if not isinstance(content, dict):
+            return jsonify({'msg': 'JSON object was not found'}), 400
+        try:
+            profiler.configure(**{
+                key: content[key] for key in ('enabled', 'interval',
+                                              'sample_rate', 'keep')
+                if content.get(key) is not None})
+            if 'slow_threshold' in content:
+                profiler.configure(slow_threshold=content['slow_threshold'])
+        except (TypeError, ValueError):
+            return jsonify({'msg': 'Settings must be numbers'}), 400
+    return jsonify(profiler.settings()), 200
+
+
+@blueprint.route('/api/v2/diagnostics/profiles', methods=['GET'])
+@admin_required
+def get_profiles():
+    """List the profiles kept by this worker, newest first."""
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None:
+        return not_loaded('PROFILER_ENABLED=1')
+    return jsonify({'profiles': [profile.summary() for profile in
+                                 reversed(profiler.profiles)]}), 200
+
+
+@blueprint.route('/api/v2/diagnostics/profiles/collapsed', methods=['GET'])
+@admin_required
+def get_collapsed_profiles():
+    """Return kept profiles as collapsed stacks for a flamegraph.
+
+    ?id= picks one profile and ?path= those whose path starts with it;
+    without either every kept profile is merged.
+    """
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None:
+        return not_loaded('PROFILER_ENABLED=1')
+    profiles = list(profiler.profiles)
+    if 'id' in request.args:
+        profiles = [profile for profile in profiles if profile.id ==
+                    request.args.get('id', type=int)]
+    if 'path' in request.args:
+        profiles = [profile for profile in profiles
+                    if profile.path.startswith(request.args['path'])]
+    return Response(profiler.collapsed(profiles), mimetype='text/plain')
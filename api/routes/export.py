@@ -0,0 +1,28 @@
+"""Handle requests made on export routes"""
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from api.export import FORMATS, export_stream
+from api.routes.index import admin_required
+
+blueprint = Blueprint('export', __name__)
+
+
+@blueprint.route('/api/v2/export/businesses', methods=['GET'])
+@admin_required
+def export_businesses():
+    """Stream every business as ?format=ndjson (default) or csv.
+
+    ?reviews=1 embeds each business's reviews and ?gzip=1 compresses
+    the download.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return jsonify({'msg': 'Format must be ndjson or csv'}), 400
+    with_reviews = request.args.get('reviews') in ('1', 'true')
+    gzip = request.args.get('gzip') in ('1', 'true')
+    filename = 'businesses.' + fmt + ('.gz' if gzip else '')
+    return Response(
+        stream_with_context(export_stream(fmt, with_reviews, gzip)),
+        mimetype='application/gzip' if gzip else FORMATS[fmt],
+        headers={'Content-Disposition':
+                 'attachment; filename={}'.format(filename)})
@@ -1,4 +1,32 @@
 """Handle requests on index"""
+import hmac
+from functools import wraps
+
+import jwt
+from flask import current_app, jsonify, request
+
+from api.models import User
+from api.sessions import session_cache
+from api.validators import Validator
+
+validator = Validator()
+
+
+class SessionUser(object):
+    """The user named by a verified token, loaded only when needed."""
+
+    def __init__(self, username):
+        self.username = username
+        self._user = None
+
+    def __getattr__(self, name):
+        """Load the full user for anything besides the username."""
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = User.get_by_username(self.username)
+        return getattr(self._user, name)
+
 
 def token_required(f):
     """Decorate a function to use a jwt token."""
@@ -11,10 +39,10 @@ def token_required(f):
             return jsonify({
                 'msg': 'Token is missing, login to get a token'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'])
-            current_user = User.get_user(data['username'])
-            if not current_user.logged_in_token:
-                current_user = None
+            data = jwt.decode(token, current_app.config['SECRET_KEY'])
+            current_user = None
+            if session_cache.get(data['username'], User.get_session_token):
+                current_user = SessionUser(data['username'])
         except:
             return jsonify({
                 'msg': 'Token is invalid, login to get another token'}), 401
@@ -22,6 +50,18 @@ def token_required(f):
     return decorated
 
 
+def admin_required(f):
+    """Restrict a route to callers sending the configured ADMIN_TOKEN."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        expected = current_app.config.get('ADMIN_TOKEN')
+        given = request.headers.get('x-admin-token', '')
+        if not expected or not hmac.compare_digest(given, expected):
+            return jsonify({'msg': 'Admin token is missing or incorrect'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+
 def check_for_login(f):
     """Return errors if user logged out."""
     @wraps(f)
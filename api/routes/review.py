@@ -1,9 +1,42 @@
 """Handle requests made on reviews"""
-import os
-from api import create_app, db
+from flask import (Blueprint, Response, current_app, jsonify, request,
+                   stream_with_context)
 
-@app.route('/api/v2/businesses/<business_id>/reviews',
+from api import db
+from api.features import cached, invalidate, rate_limited
+from api.ingest import ingest_reviews
+from api.models import Business, Review
+from api.pagination import keyset_paginate
+from api.routes.index import (check_for_login, check_json, token_required,
+                              validator)
+from api.serializers import (json_backend, json_response, requested_fields,
+                             serializer_for)
+
+blueprint = Blueprint('reviews', __name__)
+REVIEW_ORDER = [Review.date_created, Review.id]
+review_serializer = serializer_for('review')
+
+
+def stream_reviews(business_id, fields):
+    """Yield the reviews of a business as NDJSON lines, newest first.
+
+    Rows come off a server-side cursor in batches, so memory stays flat
+    however many reviews the business has.
+    """
+    extract = review_serializer.compile(fields)
+    dumps = json_backend.dumps
+    reviews = db.session.query(
+        *review_serializer.columns(Review, fields)).filter(
+        Review.business_id == business_id).order_by(
+        *[column.desc() for column in REVIEW_ORDER]).execution_options(
+        stream_results=True).yield_per(500)
+    for review in reviews:
+        yield dumps(extract(review)) + b'\n'
+
+
+@blueprint.route('/api/v2/businesses/<business_id>/reviews',
            methods=['POST'])
+@rate_limited('write')
 @check_json
 @token_required
 @check_for_login
@@ -19,31 +52,84 @@ def add_review_for(current_user, content, business_id):
         return jsonify({'msg': 'Reviewing own business not allowed'}), 400
     review = Review(rating=int(str(content['rating']).strip()),
                     body=content['body'].strip(),
-                    owner=current_user,
+                    name=current_user.username,
+                    review_owner=current_user.username,
                     review_for=to_review)
     db.session.add(review)
     db.session.commit()
+    # the new review changes the business rating shown in every listing
+    invalidate('businesses',
+               'business:{}'.format(business_id))
     message = {'msg': 'Review for business id {} by user {} created'.format(
         review.business_id, review.review_owner),
-        'details': {'rating': review.rating,
-                    'body': review.body}}
-    return jsonify(message), 201
+        'details': review_serializer.one(review, ('rating', 'body'))}
+    return json_response(message, 201)
 
 
-@app.route('/api/v2/businesses/<business_id>/reviews',
+@blueprint.route('/api/v2/businesses/<business_id>/reviews',
            methods=['GET'])
+@rate_limited('read')
+@cached('business:{business_id}')
 def get_reviews_for(business_id):
-    """Retrieve all reviews for a single business."""
+    """Retrieve the reviews for a single business, newest first.
+
+    Pages of ?limit=n (default 20) follow ?after=<next_cursor>, while
+    ?format=ndjson streams every review, one JSON object per line.
+    """
+    try:
+        fields = requested_fields('review')
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
     business = Business.query.filter_by(id=business_id).first()
     if not business:
         return jsonify({'msg': 'Business id is incorrect'}), 400
-    reviews = Review.query.filter_by(business_id=business_id)
-    if not reviews.count():
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(stream_reviews(business.id,
+                                                           fields)),
+                        mimetype='application/x-ndjson')
+    # plain rows of the needed columns, sort key included for the cursor
+    columns = review_serializer.columns(
+        Review, fields, [column.key for column in REVIEW_ORDER])
+    try:
+        reviews = keyset_paginate(
+            Review.query.filter_by(business_id=business.id).with_entities(
+                *columns), REVIEW_ORDER,
+            request.args.get('after'), request.args.get('limit', 20, type=int),
+            descending=True)
+    except ValueError as err:
+        return jsonify({'msg': str(err)}), 400
+    if not reviews.items:
         return jsonify({'msg': 'No reviews for this business'}), 400
-    message = {'reviews': [{'rating': review.rating,
-                            'body': review.body,
-                            'review_by': review.review_owner}
-                           for review in reviews],
+    message = {'reviews': review_serializer.many(reviews.items, fields),
                'business_id': business.id,
-               'business_owner': business.business_owner}
-    return jsonify(message), 200
+               'business_owner': business.business_owner,
+               'per_page': reviews.per_page,
+               'next_cursor': reviews.next_cursor}
+    return json_response(message)
+
+
+@blueprint.route('/api/v2/reviews/batch', methods=['POST'])
+@rate_limited('write')
+@check_json
+@token_required
+@check_for_login
+def add_reviews(current_user, content):
+    """Add many reviews by the current user in bulk.
+
+    Takes {"reviews": [{"business_id": 1, "rating": 4, "body": "..."}]}.
+    Valid reviews are inserted and the rest reported by index.
+    """
+    items = content.get('reviews') if isinstance(content, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'msg': 'Provide a list of reviews'}), 400
+    max_items = current_app.config.get('BATCH_MAX_ITEMS', 500)
+    if len(items) > max_items:
+        return jsonify({
+            'msg': 'A batch cannot hold more than {} reviews'.format(
+                max_items)}), 400
+    report = ingest_reviews(items, reviewer=current_user.username,
+                            chunk_size=max_items, max_errors=max_items)
+    message = report.as_dict()
+    message['msg'] = '{} of {} reviews created'.format(report.inserted,
+                                                       len(items))
+    return jsonify(message), 201 if report.inserted else 400
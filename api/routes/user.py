@@ -1,10 +1,22 @@
 """Handle requests on user routes"""
-import os
-from api import create_app, db
+from datetime import datetime, timedelta
 
-app = create_app(config_name=os.getenv('APP_CONFIGURATION'))
+import jwt
+from flask import Blueprint, current_app, jsonify
 
-@app.route('/api/v2/auth/register', methods=['POST'])
+from api import db
+from api.features import rate_limited
+from api.models import User
+from api.passwords import passwords
+from api.routes.index import (check_for_login, check_json, token_required,
+                              validator)
+from api.serializers import json_response, serializer_for
+from api.sessions import session_cache
+
+blueprint = Blueprint('users', __name__)
+
+@blueprint.route('/api/v2/auth/register', methods=['POST'])
+@rate_limited('auth')
 @check_json
 def create_user(content):
     """Register a user into the API."""
@@ -18,26 +30,20 @@ def create_user(content):
     new_user = User(name=content['name'].strip(),
                     username=content['username'].strip(),
                     email=content['email'].strip(),
-                    password=generate_password_hash(
-                    content['password'].strip()))
+                    password=passwords.hash(content['password'].strip()))
     db.session.add(new_user)
     db.session.commit()
-    created_user = User.get_user(content['email'].strip())
-    print(created_user)
     message = {
-        'details': {
-            'name': created_user.name,
-            'username': created_user.username,
-            'email': created_user.email
-        },
+        'details': serializer_for('user').one(new_user),
         'msg': "User {} created successfully on {}".format(
-            created_user.username,
-            created_user.date_created)
+            new_user.username,
+            new_user.date_created)
     }
-    return jsonify(message), 201
+    return json_response(message, 201)
 
 
-@app.route('/api/v2/auth/login', methods=['POST'])
+@blueprint.route('/api/v2/auth/login', methods=['POST'])
+@rate_limited('auth')
 @check_json
 def login_user(content):
     """Log in a user."""
@@ -54,20 +60,24 @@ def login_user(content):
     if not user:
         return jsonify({
             'msg': 'Email or username provided does not match any user'}), 400
-    if check_password_hash(user.password, content['password']):
+    if passwords.check(user.password, content['password']):
+        if passwords.needs_rehash(user.password):
+            user.password = passwords.hash(content['password'])
         token = jwt.encode({
             'username': user.username,
             'exp': datetime.now() + timedelta(minutes=300)},
-            app.config['SECRET_KEY'])
+            current_app.config['SECRET_KEY'])
         if user.logged_in_token:
             user.logged_in_token = token
             db.session.commit()
+            session_cache.set(user.username, token)
             return jsonify({
                 'user': user.username,
                 'token': token.decode('UTF-8'),
                 'msg': 'Log in successful'}), 200
         user.logged_in_token = token
         db.session.commit()
+        session_cache.set(user.username, token)
         return jsonify({
             'user': user.username,
             'token': token.decode('UTF-8'),
@@ -76,37 +86,32 @@ def login_user(content):
         'msg': 'Wrong email or username/password combination'}), 400
 
 
-@app.route('/api/v2/auth/logout', methods=['POST'])
+@blueprint.route('/api/v2/auth/logout', methods=['POST'])
 @token_required
 def logout(current_user):
     """Log out a user."""
     if not current_user:
         return jsonify({'msg': 'User is not logged in'}), 400
-    current_user.logged_in_token = None
+    User.query.filter_by(username=current_user.username).update(
+        {'logged_in_token': None})
     db.session.commit()
+    session_cache.set(current_user.username, None)
     return jsonify({'msg': 'User log out successfull'}), 200
 
 
-@app.route('/api/v2/auth/reset-password', methods=['POST'])
+@blueprint.route('/api/v2/auth/reset-password', methods=['POST'])
+@rate_limited('auth')
 @check_json
 @token_required
 @check_for_login
 def reset_password(current_user, content):
     """Change a password for a user."""
     to_reset = current_user
-    if 'new_password' not in content:
-        return jsonify({'msg': 'Missing new password'}), 400
-    error = {}
-    if len(str(content['new_password'].strip())) < 6:
-        error['msg'] = 'Password cannot be less than 6 characters'
-    if not re.compile('[0-9]').search(content['new_password'].strip()):
-        error['msg'] = 'Strong password must have at least one number character'
-    if not re.compile('[^\w\s]').search(content['new_password'].strip()):
-        error['msg'] = 'Strong password must have at least one special character'
+    error = validator.validate(content, 'password_reset')
     if error:
         return jsonify(error), 400
     User.query.filter_by(username=current_user.username).update(
-        {'password': generate_password_hash(content['new_password'].strip())})
+        {'password': passwords.hash(content['new_password'].strip())})
     db.session.commit()
     message = {
         'msg': 'Password for {} changed successfully'.format(to_reset.username)
@@ -114,7 +119,8 @@ def reset_password(current_user, content):
     return jsonify(message), 200
 
 
-@app.route('/api/v2/get-reset-token', methods=['POST'])
+@blueprint.route('/api/v2/get-reset-token', methods=['POST'])
+@rate_limited('auth')
 @check_json
 def return_token(content):
     """Return a token to use to change password."""
@@ -126,9 +132,10 @@ def return_token(content):
     token = jwt.encode({
         'username': user.username,
         'exp': datetime.now() + timedelta(minutes=1440)},
-        app.config['SECRET_KEY'])
+        current_app.config['SECRET_KEY'])
     user.logged_in_token = token
     db.session.commit()
+    session_cache.set(user.username, token)
     return jsonify({
         'token': token.decode('UTF-8'),
         'email': user.email,
@@ -0,0 +1,210 @@
+"""Send read-only requests to replica databases."""
+import os
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_COOKIE = 'read_primary_until'
+
+
+class ReplicaSet(object):
+    """The replica binds and whether each is fit to serve reads.
+
+    A replica is skipped for REPLICA_RETRY_AFTER seconds once it fails
+    or lags behind the primary by more than REPLICA_MAX_LAG seconds.
+    Replicas are checked every REPLICA_CHECK_INTERVAL seconds by a
+    background thread of each process, never in a request.
+    """
+
+    def __init__(self):
+        self.binds = []
+        self.max_lag = 5
+        self.retry_after = 30
+        self.check_interval = 10
+        self.sticky_seconds = 5
+        self._down_until = {}
+        self._lag = {}
+        self._start_lock = threading.Lock()
+        self._checker = None
+        self._checker_pid = None
+        self._stop = threading.Event()
+        self._app = None
+        self._db = None
+
+    def init_app(self, app, db):
+        """Pick up the replica binds and register the request hooks."""
+        self.stop()
+        self._app = app
+        self._db = db
+        self.binds = sorted(bind for bind in
+                            app.config.get('SQLALCHEMY_BINDS') or {}
+                            if bind.startswith('replica'))
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', self.max_lag)
+        self.retry_after = app.config.get('REPLICA_RETRY_AFTER',
+                                          self.retry_after)
+        self.check_interval = app.config.get('REPLICA_CHECK_INTERVAL',
+                                             self.check_interval)
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS',
+                                             self.sticky_seconds)
+        app.after_request(self._stick_to_primary)
+
+    def choose(self):
+        """Return a healthy replica bind at random, or None."""
+        if not self.binds:
+            return None
+        if self.check_interval and self._checker_pid != os.getpid():
+            self.start()
+        now = time.time()
+        healthy = [bind for bind in self.binds
+                   if self._down_until.get(bind, 0) <= now]
+        return random.choice(healthy) if healthy else None
+
+    def start(self):
+        """Start checking the replicas in a thread of this process.
+
+        Threads do not survive a fork, so each server worker starts its
+        own on first use.
+        """
+        with self._start_lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._checker = threading.Thread(
+                target=self._run_checks, args=(self._stop,),
+                name='replica-checker', daemon=True)
+            self._checker_pid = os.getpid()
+            self._checker.start()
+
+    def stop(self):
+        """Stop the checking thread of this process, if it runs."""
+        checker = self._checker
+        self._stop.set()
+        if checker is not None and self._checker_pid == os.getpid():
+            checker.join()
+        self._checker = self._checker_pid = None
+
+    def _run_checks(self, stop):
+        while True:
+            self.check()
+            if stop.wait(self.check_interval):
+                return
+
+    def mark_down(self, bind):
+        """Stop reading from a replica for a while."""
+        self._down_until[bind] = time.time() + self.retry_after
+
+    def check(self):
+        """Measure every replica's lag, marking the unfit ones down."""
+        for bind in self.binds:
+            try:
+                lag = self._measure_lag(bind)
+            except Exception:
+                lag = None
+                self.mark_down(bind)
+            self._lag[bind] = lag
+            if lag is not None and lag > self.max_lag:
+                self.mark_down(bind)
+
+    def status(self):
+        """Return the last known lag and availability of each replica."""
+        now = time.time()
+        return {bind: {'lag': self._lag.get(bind),
+                       'healthy': self._down_until.get(bind, 0) <= now}
+                for bind in self.binds}
+
+    def _measure_lag(self, bind):
+        """Return how many seconds a replica trails the primary.
+
+        The time since the last replayed transaction keeps growing while
+        the primary is idle, so it only counts when the replica has
+        received WAL it has not replayed yet.
+        """
+        engine = self._db.get_engine(self._app, bind)
+        with engine.connect() as connection:
+            if engine.dialect.name != 'postgresql':
+                connection.execute('SELECT 1')
+                return 0
+            return connection.execute(
+                'SELECT CASE WHEN pg_last_wal_receive_lsn() = '
+                'pg_last_wal_replay_lsn() THEN 0 ELSE COALESCE(EXTRACT('
+                'EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) '
+                'END').scalar()
+
+    def _stick_to_primary(self, response):
+        """Keep a client on the primary briefly after it wrote."""
+        if (self.binds and request.method not in READ_METHODS
+                and response.status_code < 400):
+            response.set_cookie(
+                PRIMARY_COOKIE, str(time.time() + self.sticky_seconds),
+                max_age=self.sticky_seconds)
+        return response
+
+
+replicas = ReplicaSet()
+
+
+def use_primary(f):
+    """Decorate a view so all its queries go to the primary."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.use_primary = True
+        return f(*args, **kwargs)
+    return decorated
+
+
+def read_bind():
+    """Return the replica bind the current request reads from, or None.
+
+    Only read-only requests use a replica, unless the client asked for
+    the primary (X-Read-Primary header), wrote a moment ago (cookie), or
+    the view is pinned with use_primary.
+    """
+    if not has_request_context() or request.method not in READ_METHODS:
+        return None
+    if g.get('use_primary') or request.headers.get('X-Read-Primary'):
+        return None
+    try:
+        if float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time():
+            return None
+    except ValueError:
+        pass
+    if 'replica_bind' not in g:
+        g.replica_bind = replicas.choose()
+    return g.replica_bind
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the queries of read-only requests to a replica.
+
+    Flushes, and every query after one, go to the primary so a session
+    always reads what it wrote.
+    """
+
+    def __init__(self, db, *args, **kwargs):
+        self.db = db
+        super(RoutingSession, self).__init__(db, *args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and not self.info.get('wrote'):
+            bind = read_bind()
+            if bind:
+                return self.db.get_engine(self.app, bind=bind)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _remember_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose sessions route reads through RoutingSession."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
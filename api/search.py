@@ -0,0 +1,67 @@
+"""Word-prefix and nearby search over businesses, each backed by an index."""
+from api import db, geo
+from api.models import Business, BusinessTerm, tokenize
+
+
+def _prefix(word):
+    """Return a LIKE pattern matching terms that start with word."""
+    return word.replace('_', '\\_') + '%'
+
+
+def search_businesses(name='', location='', category=''):
+    """Return a query of the businesses matching every word given.
+
+    Each word must prefix a word of its field. Businesses are ranked by
+    how many words matched exactly rather than by prefix, so the best
+    matches come first. Every word is resolved through the
+    (field, term) index, so the cost follows the matches rather than
+    the size of the catalogue.
+    """
+    query = db.session.query(Business)
+    rank = []
+    for field, text in (('name', name), ('location', location),
+                        ('category', category)):
+        for word in sorted(set(tokenize(text))):
+            term = db.aliased(BusinessTerm)
+            query = query.join(term, db.and_(
+                term.business_id == Business.id,
+                term.field == field,
+                term.term.like(_prefix(word), escape='\\')))
+            rank.append(db.func.max(
+                db.case({word: 2}, value=term.term, else_=1)))
+    if not rank:
+        # only punctuation was given, which no indexed word can match
+        return query.filter(db.false())
+    return query.group_by(Business.id).order_by(
+        sum(rank[1:], rank[0]).desc(), Business.id)
+
+
+def candidates_near(latitude, longitude, radius_km):
+    """Return a query of (id, latitude, longitude) around a point.
+
+    The rows come from range scans of the grid cells covering the
+    circle, trimmed to its bounding box; some lie outside the circle.
+    """
+    (south, north), spans = geo.bounding_box(latitude, longitude, radius_km)
+    return db.session.query(
+        Business.id, Business.latitude, Business.longitude).filter(
+        db.or_(*[Business.geocell.between(low, high) for low, high in
+                 geo.cell_ranges(latitude, longitude, radius_km)]),
+        Business.latitude.between(south, north),
+        db.or_(*[Business.longitude.between(west, east)
+                 for west, east in spans]))
+
+
+def nearby_businesses(latitude, longitude, radius_km, limit):
+    """Return (distance km, id) of the nearest businesses within radius_km.
+
+    Circles of growing radius are tried in turn until one holds limit
+    businesses, so a dense area only loads the rows close to the point.
+    Distances are computed and sorted in bulk by api.geo.
+    """
+    for radius in geo.search_radii(radius_km):
+        found = geo.nearest(latitude, longitude, radius, candidates_near(
+            latitude, longitude, radius).all(), limit)
+        if len(found) >= limit:
+            break
+    return found
@@ -0,0 +1,362 @@
+"""Generate large synthetic datasets of users, businesses and reviews.
+
+Rows are generated in chunks, each from its own random stream derived
+from the seed, so the same seed and chunk size give the same data
+however the chunks are spread over processes. Chunks are written with
+COPY on PostgreSQL (by a pool of processes) and with executemany
+elsewhere.
+"""
+import csv
+import io
+import itertools
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import sqlalchemy
+from sqlalchemy.pool import NullPool
+
+from api import db, geo
+from api.models import Business, BusinessTerm, Review, User, tokenize
+from api.passwords import passwords
+
+SEED_PASSWORD = 'seed$pass1'
+# generated dates fall in the five years before this, whatever the day
+END_DATE = datetime(2026, 1, 1)
+SPAN_SECONDS = 5 * 365 * 24 * 3600
+# an odd multiplier scrambling ids, so popularity is not ordered by id
+SCRAMBLE = 2654435761
+
+FIRST_NAMES = ['Amina', 'Brian', 'Chebet', 'David', 'Esther', 'Faith',
+               'George', 'Halima', 'Ian', 'Joy', 'Kevin', 'Lilian',
+               'Moses', 'Njeri', 'Otieno', 'Pendo', 'Rose', 'Samuel',
+               'Tabitha', 'Wanjiru']
+LAST_NAMES = ['Achieng', 'Barasa', 'Chege', 'Kamau', 'Kiptoo', 'Mwangi',
+              'Njoroge', 'Odhiambo', 'Omondi', 'Wafula', 'Wambui', 'Were']
+# city: (share of businesses, (latitude, longitude), neighbourhoods)
+CITIES = {
+    'Nairobi': (0.55, (-1.286, 36.817),
+                ['CBD', 'Westlands', 'Kilimani', 'Karen', 'Ruaka',
+                 'Lavington', 'Eastleigh', 'South B', 'Kasarani']),
+    'Mombasa': (0.15, (-4.043, 39.668),
+                ['Nyali', 'Old Town', 'Bamburi', 'Likoni']),
+    'Kisumu': (0.1, (-0.092, 34.768), ['Milimani', 'Kondele', 'Nyalenda']),
+    'Nakuru': (0.1, (-0.303, 36.080), ['Section 58', 'Milimani', 'Lanet']),
+    'Eldoret': (0.1, (0.514, 35.270), ['Langas', 'Kapsoya', 'Elgon View']),
+}
+# spread of businesses around their neighbourhood centre, in degrees
+SCATTER = 0.01
+CATEGORIES = ['shop', 'food', 'health', 'services', 'auto', 'beauty',
+              'hardware', 'education', 'hotel', 'entertainment']
+CATEGORY_NOUNS = {
+    'shop': ['Shop', 'Store', 'Mart'], 'food': ['Cafe', 'Grill', 'Bakery'],
+    'health': ['Clinic', 'Pharmacy', 'Chemist'],
+    'services': ['Agency', 'Services', 'Solutions'],
+    'auto': ['Garage', 'Motors', 'Autospares'],
+    'beauty': ['Salon', 'Spa', 'Barbershop'],
+    'hardware': ['Hardware', 'Supplies', 'Depot'],
+    'education': ['Academy', 'School', 'Institute'],
+    'hotel': ['Hotel', 'Lodge', 'Inn'],
+    'entertainment': ['Lounge', 'Club', 'Arcade']}
+ADJECTIVES = ['Golden', 'Sunrise', 'Baraka', 'Upendo', 'Royal', 'Green',
+              'Neema', 'Safari', 'Jambo', 'Tumaini', 'Star', 'Amani']
+REVIEW_BODIES = {
+    1: ['Terrible service, would not go back', 'Waited forever, rude staff'],
+    2: ['Not great, prices are high', 'Below what I expected'],
+    3: ['Okay for the price', 'Average, nothing special'],
+    4: ['Good place, friendly staff', 'Would come again'],
+    5: ['Excellent, best in town', 'Loved it, highly recommended'],
+}
+
+
+def _neighbourhoods():
+    """Return (location, dominant category, centre) and their weights.
+
+    Neighbourhoods ring their city centre 3 to 10 km out.
+    """
+    locations, weights = [], []
+    for c, (city, (share, (latitude, longitude), areas)) in enumerate(
+            sorted(CITIES.items())):
+        for a, area in enumerate(areas):
+            angle = 2 * math.pi * a / len(areas)
+            distance = 0.03 * (1 + a % 3)
+            locations.append((
+                '{}, {}'.format(area, city),
+                CATEGORIES[(c * 7 + a * 3) % len(CATEGORIES)],
+                (latitude + distance * math.sin(angle),
+                 longitude + distance * math.cos(angle))))
+            weights.append(share / len(areas))
+    return locations, list(itertools.accumulate(weights))
+
+
+LOCATIONS, LOCATION_WEIGHTS = _neighbourhoods()
+
+
+def _stream(seed, kind, chunk):
+    """Return the random stream of one chunk of one kind of row."""
+    return random.Random('{}:{}:{}'.format(seed, kind, chunk))
+
+
+def _date(rng):
+    return END_DATE - timedelta(seconds=rng.randrange(SPAN_SECONDS))
+
+
+def username(user_id):
+    """Return the username of a seeded user (at most 10 characters)."""
+    return 'sd{}'.format(user_id)
+
+
+def owner_of(plan, business_id):
+    """Return the username owning a seeded business.
+
+    A few users own most businesses, as on the real site. It is a pure
+    function of the id, so review chunks can avoid self reviews without
+    looking anything up.
+    """
+    first_user, users = plan['users']
+    fraction = ((business_id * SCRAMBLE) % 4294967296) / 4294967296.0
+    return username(first_user + int(users * fraction ** 3))
+
+
+def generate_users(plan, chunk, start, count):
+    """Yield the rows of count users from id start."""
+    rng = _stream(plan['seed'], 'user', chunk)
+    for user_id in range(start, start + count):
+        yield {'id': user_id,
+               'name': '{} {}'.format(rng.choice(FIRST_NAMES),
+                                      rng.choice(LAST_NAMES)),
+               'username': username(user_id),
+               'email': '{}@seed.example.com'.format(username(user_id)),
+               'password': plan['password'],
+               'date_created': _date(rng)}
+
+
+def generate_businesses(plan, chunk, start, count):
+    """Yield the rows of count businesses from id start.
+
+    Businesses cluster in a few cities, scattered around the centres of
+    their neighbourhoods, and each neighbourhood leans towards one
+    category.
+    """
+    rng = _stream(plan['seed'], 'business', chunk)
+    for business_id in range(start, start + count):
+        location, dominant, (latitude, longitude) = rng.choices(
+            LOCATIONS, cum_weights=LOCATION_WEIGHTS)[0]
+        latitude = round(rng.gauss(latitude, SCATTER), 6)
+        longitude = round(rng.gauss(longitude, SCATTER), 6)
+        category = dominant if rng.random() < 0.5 else rng.choice(CATEGORIES)
+        name = '{} {} {}'.format(rng.choice(ADJECTIVES),
+                                 rng.choice(LAST_NAMES),
+                                 rng.choice(CATEGORY_NOUNS[category]))
+        yield {'id': business_id, 'name': name, 'category': category,
+               'location': location, 'latitude': latitude,
+               'longitude': longitude,
+               'geocell': geo.cell(latitude, longitude),
+               'description': 'A {} business in {}'.format(category,
+                                                           location),
+               'business_owner': owner_of(plan, business_id),
+               'date_created': _date(rng)}
+
+
+def business_terms(business):
+    """Return the search index rows of a generated business."""
+    return [{'business_id': business['id'], 'field': field, 'term': term}
+            for field in Business.search_fields
+            for term in set(tokenize(business[field]))]
+
+
+_popularity = None
+
+
+def _popularity_weights(plan):
+    """Return cumulative Zipf weights over the business popularity ranks."""
+    global _popularity
+    key = (plan['businesses'][1], plan['zipf'])
+    if _popularity is None or _popularity[0] != key:
+        weights = (1.0 / (rank ** plan['zipf'])
+                   for rank in range(1, key[0] + 1))
+        _popularity = (key, list(itertools.accumulate(weights)))
+    return _popularity[1]
+
+
+def generate_reviews(plan, chunk, count):
+    """Yield the rows of count reviews.
+
+    The business of a review follows a Zipf law over popularity ranks,
+    scrambled into ids, so a handful of businesses get most reviews and
+    the long tail gets few. Each business has a steady quality its
+    ratings scatter around.
+    """
+    rng = _stream(plan['seed'], 'review', chunk)
+    first_business, businesses = plan['businesses']
+    first_user, users = plan['users']
+    ranks = rng.choices(range(businesses), cum_weights=_popularity_weights(
+        plan), k=count)
+    for rank in ranks:
+        business_id = first_business + (rank * SCRAMBLE) % businesses
+        reviewer = username(first_user + rng.randrange(users))
+        if reviewer == owner_of(plan, business_id):
+            reviewer = username(first_user + (
+                int(reviewer[2:]) - first_user + 1) % users)
+        quality = 1.5 + 3.5 * ((business_id * 40503) % 1000) / 1000.0
+        rating = min(5, max(1, int(round(rng.gauss(quality, 1.0)))))
+        yield {'name': reviewer, 'rating': rating,
+               'body': rng.choice(REVIEW_BODIES[rating]),
+               'review_owner': reviewer, 'business_id': business_id,
+               'date_created': _date(rng)}
+
+
+def _write(connection, table, rows):
+    """Insert dict rows into table, with COPY where the driver has it."""
+    rows = list(rows)
+    if not rows:
+        return 0
+    if connection.dialect.name != 'postgresql':
+        connection.execute(table.insert(), rows)
+        return len(rows)
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    cursor = connection.connection.cursor()
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        preparer.format_table(table),
+        ', '.join(preparer.quote(column) for column in columns)), buffer)
+    return len(rows)
+
+
+def _run_chunk(job):
+    """Generate and write one chunk on a connection of its own."""
+    plan, kind, chunk, start, count = job
+    engine = sqlalchemy.create_engine(plan['url'], poolclass=NullPool)
+    try:
+        with engine.begin() as connection:
+            if kind == 'user':
+                return _write(connection, User.__table__,
+                              generate_users(plan, chunk, start, count))
+            if kind == 'business':
+                businesses = list(generate_businesses(plan, chunk, start,
+                                                      count))
+                _write(connection, Business.__table__, businesses)
+                _write(connection, BusinessTerm.__table__, [
+                    term for business in businesses
+                    for term in business_terms(business)])
+                return len(businesses)
+            return _write(connection, Review.__table__,
+                          generate_reviews(plan, chunk, count))
+    finally:
+        engine.dispose()
+
+
+def _jobs(plan, kind, total, chunk_size, first=0):
+    """Split total rows of kind into chunk jobs."""
+    return [(plan, kind, chunk, first + start, min(chunk_size, total - start))
+            for chunk, start in enumerate(range(0, total, chunk_size))]
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def recompute_ratings(first_id, last_id):
+    """Rebuild the rating aggregates of businesses first_id..last_id."""
+    business, review = Business.__table__, Review.__table__
+    in_range = business.c.id.between(first_id, last_id)
+    if db.engine.dialect.name == 'postgresql':
+        stars = ', '.join(
+            'COUNT(*) FILTER (WHERE rating = {0}) AS rating_{0}'.format(n)
+            for n in range(1, 6))
+        db.session.execute(db.text(
+            'UPDATE business SET review_count = r.review_count, '
+            'rating_sum = r.rating_sum, '
+            'rating_average = r.rating_sum * 1.0 / r.review_count, ' +
+            ', '.join('rating_{0} = r.rating_{0}'.format(n)
+                      for n in range(1, 6)) +
+            ' FROM (SELECT business_id, COUNT(*) AS review_count, '
+            'SUM(rating) AS rating_sum, ' + stars + ' FROM review '
+            'WHERE business_id BETWEEN :first AND :last '
+            'GROUP BY business_id) AS r WHERE business.id = r.business_id'),
+            {'first': first_id, 'last': last_id})
+    else:
+        def count(*where):
+            return db.select([db.func.count()]).where(db.and_(
+                review.c.business_id == business.c.id, *where)).as_scalar()
+        values = {
+            'review_count': count(),
+            'rating_sum': db.select([db.func.coalesce(
+                db.func.sum(review.c.rating), 0)]).where(
+                review.c.business_id == business.c.id).as_scalar()}
+        for n in range(1, 6):
+            values['rating_{}'.format(n)] = count(review.c.rating == n)
+        db.session.execute(business.update().where(in_range).values(values))
+        db.session.execute(business.update().where(db.and_(
+            in_range, business.c.review_count > 0)).values(
+            rating_average=business.c.rating_sum * 1.0 /
+            business.c.review_count))
+    db.session.commit()
+
+
+def seed_database(url, users, businesses, reviews, seed=42, workers=1,
+                  chunk_size=50000, zipf=1.0, log=print):
+    """Add a synthetic dataset to the database at url.
+
+    Runs inside an app context. Returns rows written and seconds taken
+    per kind of row. Every user's password is SEED_PASSWORD, hashed
+    once up front rather than per user.
+    """
+    if businesses and not users:
+        raise ValueError('Businesses need users to own them')
+    if reviews and (not businesses or users < 2):
+        raise ValueError('Reviews need businesses and two or more users')
+    plan = {'url': url, 'seed': seed, 'zipf': zipf,
+            'users': (_next_id(User), users),
+            'businesses': (_next_id(Business), businesses),
+            'password': passwords.hash(SEED_PASSWORD)}
+    db.session.remove()
+    # forked workers must not share the parent's pooled connections
+    db.engine.dispose()
+    if db.engine.dialect.name != 'postgresql':
+        # one writer at a time is all SQLite and friends take
+        workers = 1
+    report = {}
+    pool = Pool(workers) if workers > 1 else None
+    run = pool.imap_unordered if pool else map
+    try:
+        for kind, total, first in (
+                ('user', users, plan['users'][0]),
+                ('business', businesses, plan['businesses'][0]),
+                ('review', reviews, 0)):
+            started = time.perf_counter()
+            written = 0
+            for rows in run(_run_chunk,
+                            _jobs(plan, kind, total, chunk_size, first)):
+                written += rows
+                log('{}: {}/{}'.format(kind, written, total))
+            report[kind] = {'rows': written, 'seconds': round(
+                time.perf_counter() - started, 2)}
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    started = time.perf_counter()
+    if db.engine.dialect.name == 'postgresql':
+        for model in (User, Business):
+            db.session.execute(db.text(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "(SELECT MAX(id) FROM {1}))".format(
+                    model.__tablename__, db.engine.dialect.identifier_preparer
+                    .format_table(model.__table__))))
+    if reviews:
+        first = plan['businesses'][0]
+        recompute_ratings(first, first + businesses - 1)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    report['aggregates'] = {'seconds': round(time.perf_counter() - started,
+                                             2)}
+    return report
@@ -0,0 +1,206 @@
+"""Serialize models to JSON through precompiled field extractors."""
+import json
+from collections import OrderedDict
+from operator import attrgetter
+
+from flask import Response, request
+from werkzeug.utils import import_string
+
+
+class Computed(object):
+    """A field computed by func from the attributes attrs of an object."""
+
+    def __init__(self, func, *attrs):
+        self.func = func
+        self.attrs = attrs
+
+
+class Serializer(object):
+    """Turn objects into dicts of named fields.
+
+    fields maps an output name to the attribute holding it, or to a
+    Computed field. Each fieldset asked for is compiled once into a
+    tuple of (name, getter) pairs, attrgetters for the plain fields, so
+    serializing a list is one tight loop without per-field lookups.
+    """
+
+    def __init__(self, fields, default=None):
+        self.fields = OrderedDict(fields)
+        self.default = tuple(default or self.fields)
+        self._compiled = {}
+
+    def fieldset(self, requested=None):
+        """Return the field names of a comma separated ?fields= value.
+
+        Raises ValueError naming any field that does not exist.
+        """
+        if not requested:
+            return self.default
+        names = tuple(OrderedDict.fromkeys(
+            name.strip() for name in requested.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise ValueError('Unknown fields: {}'.format(
+                ', '.join(unknown) or requested))
+        return names
+
+    def attrs(self, names=None):
+        """Return the attributes the fields names are read from."""
+        attrs = []
+        for name in names or self.default:
+            field = self.fields[name]
+            for attr in (field.attrs if isinstance(field, Computed)
+                         else (field,)):
+                if attr not in attrs:
+                    attrs.append(attr)
+        return attrs
+
+    def columns(self, model, names=None, extra=()):
+        """Return the model columns to select for the fields names.
+
+        extra names further attributes the caller needs on each row,
+        such as the sort key of a keyset page.
+        """
+        attrs = self.attrs(names)
+        attrs.extend(attr for attr in extra if attr not in attrs)
+        return [getattr(model, attr) for attr in attrs]
+
+    def compile(self, names=None):
+        """Return the function serializing one object to the fields names."""
+        names = tuple(names or self.default)
+        extract = self._compiled.get(names)
+        if extract is None:
+            getters = []
+            for name in names:
+                field = self.fields[name]
+                getters.append((name, field.func if isinstance(
+                    field, Computed) else attrgetter(field)))
+            getters = tuple(getters)
+
+            def extract(obj):
+                values = {}
+                for name, get in getters:
+                    values[name] = get(obj)
+                return values
+            self._compiled[names] = extract
+        return extract
+
+    def one(self, obj, names=None):
+        """Serialize one object."""
+        return self.compile(names)(obj)
+
+    def many(self, objs, names=None):
+        """Serialize every object of an iterable."""
+        extract = self.compile(names)
+        return [extract(obj) for obj in objs]
+
+
+def rating_summary(business):
+    """Return the review count, average and star histogram of a business."""
+    return {'count': business.review_count or 0,
+            'average': round(business.rating_average or 0, 2),
+            'histogram': {'1': business.rating_1 or 0,
+                          '2': business.rating_2 or 0,
+                          '3': business.rating_3 or 0,
+                          '4': business.rating_4 or 0,
+                          '5': business.rating_5 or 0}}
+
+
+# keyed by model name so the app factory can import this module
+SERIALIZERS = {
+    'user': Serializer([('name', 'name'),
+                      ('username', 'username'),
+                      ('email', 'email')]),
+    'business': Serializer([
+        ('name', 'name'),
+        ('category', 'category'),
+        ('description', 'description'),
+        ('id', 'id'),
+        ('location', 'location'),
+        ('latitude', 'latitude'),
+        ('longitude', 'longitude'),
+        ('owner', 'business_owner'),
+        ('rating', Computed(rating_summary, 'review_count', 'rating_average',
+                            'rating_1', 'rating_2', 'rating_3', 'rating_4',
+                            'rating_5'))]),
+    'review': Serializer([('rating', 'rating'),
+                        ('body', 'body'),
+                        ('review_by', 'review_owner'),
+                        ('business_id', 'business_id')],
+                       default=['rating', 'body', 'review_by']),
+}
+# what write endpoints echo back, before any review is counted
+BUSINESS_DETAILS = ('name', 'category', 'description', 'location',
+                    'latitude', 'longitude', 'owner', 'id')
+
+
+def serializer_for(model):
+    """Return the serializer registered for a model class or its name."""
+    if not isinstance(model, str):
+        model = model.__name__
+    return SERIALIZERS[model.lower()]
+
+
+def requested_fields(model):
+    """Return the fieldset the current request asks for with ?fields=."""
+    return serializer_for(model).fieldset(request.args.get('fields'))
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _ujson_dumps():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj).encode('utf-8')
+    return dumps
+
+
+def _orjson_dumps():
+    import orjson
+    return orjson.dumps
+
+
+class JSONBackend(object):
+    """The encoder turning payloads into JSON bytes.
+
+    'auto' takes orjson, then ujson, when installed and falls back to
+    the standard library; a dotted path names any other dumps function.
+    """
+
+    ENCODERS = OrderedDict([('orjson', _orjson_dumps),
+                            ('ujson', _ujson_dumps),
+                            ('json', lambda: _stdlib_dumps)])
+
+    def __init__(self):
+        self.name = 'json'
+        self.dumps = _stdlib_dumps
+
+    def init_app(self, app):
+        """Pick the encoder named by JSON_BACKEND."""
+        self.use(app.config.get('JSON_BACKEND', 'auto'))
+
+    def use(self, name):
+        """Switch to the encoder name, raising ImportError if missing."""
+        if name == 'auto':
+            for candidate in self.ENCODERS:
+                try:
+                    return self.use(candidate)
+                except ImportError:
+                    continue
+        if name in self.ENCODERS:
+            self.dumps = self.ENCODERS[name]()
+        else:
+            self.dumps = import_string(name)
+        self.name = name
+
+
+json_backend = JSONBackend()
+
+
+def json_response(payload, status=200):
+    """Return payload encoded by the JSON backend as a response."""
+    return Response(json_backend.dumps(payload), status=status,
+                    mimetype='application/json')
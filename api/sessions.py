@@ -0,0 +1,68 @@
+"""Per-worker cache of live login sessions used by token_required."""
+import threading
+import time
+
+
+class SessionCache(object):
+    """Map usernames to their current logged_in_token with TTL eviction.
+
+    Each worker keeps its own copy, so a logout handled by another worker
+    is only seen here once the entry expires. Keep the TTL short.
+    """
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the cache settings from the app config."""
+        self.ttl = app.config.get('SESSION_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('SESSION_CACHE_MAX_ENTRIES',
+                                          self.max_entries)
+        self.clear()
+
+    def get(self, username, loader):
+        """Return the session token for username, calling loader on a miss.
+
+        Errors raised by the loader propagate and nothing is cached.
+        """
+        entry = self._entries.get(username)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        token = loader(username)
+        self.set(username, token)
+        return token
+
+    def set(self, username, token):
+        """Record the session token a write has just committed."""
+        if not self.ttl:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict(now)
+            self._entries[username] = (token, now + self.ttl)
+
+    def invalidate(self, username):
+        """Forget the cached session of a user."""
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        """Forget every cached session."""
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self, now):
+        """Drop expired entries, then the oldest ones if still full."""
+        for username, (_, expires) in list(self._entries.items()):
+            if expires <= now:
+                del self._entries[username]
+        overflow = len(self._entries) - self.max_entries + 1
+        for username in list(self._entries)[:max(overflow, 0)]:
+            del self._entries[username]
+
+
+session_cache = SessionCache()
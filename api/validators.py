@@ -1,74 +1,381 @@
+"""Declarative request schemas compiled into single-pass validators."""
+import math
 import re
 
+HAS_NUMBERS = re.compile('[0-9]')
+HAS_SPECIAL = re.compile(r'[^\w\s]')
+
+
+def _as_int(text):
+    """Return text as an int, or None when it is not a whole number."""
+    try:
+        return int(text.strip())
+    except ValueError:
+        return None
+
+
+def _as_float(text):
+    """Return text as a finite float, or None when it is not one."""
+    try:
+        value = float(text.strip())
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+class Check(object):
+    """A failure condition on a request value.
+
+    fails is called with the value as text or, for checks made with a
+    convert function such as _as_int, with what that returns for it.
+    The keyword arguments describe what the check lets through, such as
+    longest=255 or low=1, so that a field whose checks all describe
+    themselves tests valid values in one go.
+    """
+
+    def __init__(self, fails, msg, key=None, convert=None, **allows):
+        self.fails = fails
+        self.msg = msg
+        self.key = key
+        self.convert = convert
+        self.allows = allows
+
+
+def not_empty(prop):
+    """Fail on blank values."""
+    return Check(lambda t: t.strip() == '', f'Empty {prop} is not allowed',
+                 nonblank=True)
+
+
+def max_length(limit, msg, key=None):
+    """Fail on values longer than limit."""
+    return Check(lambda t: len(t) > limit, msg, key, longest=limit)
+
+
+def min_length(limit, msg):
+    """Fail on values shorter than limit."""
+    return Check(lambda t: len(t) < limit, msg, shortest=limit)
+
+
+def matches(pattern, msg):
+    """Fail on values the pattern finds nothing in."""
+    search = pattern.search
+    return Check(lambda t: not search(t), msg, search=search)
+
+
+def is_email(msg):
+    """Fail on values that cannot be an email address."""
+    return Check(lambda t: '@' not in t or '.' not in t, msg, contains='@.')
+
+
+def is_int(msg):
+    """Fail on values that are not whole numbers."""
+    return Check(lambda n: n is None, msg, convert=_as_int, number=True)
+
+
+def int_above(limit, msg):
+    """Fail on whole numbers above limit."""
+    return Check(lambda n: n is not None and n > limit, msg, convert=_as_int,
+                 high=limit)
+
+
+def int_below(limit, msg):
+    """Fail on whole numbers below limit."""
+    return Check(lambda n: n is not None and n < limit, msg, convert=_as_int,
+                 low=limit)
+
+
+def is_number(msg):
+    """Fail on values that are not finite numbers."""
+    return Check(lambda x: x is None, msg, convert=_as_float, number=True)
+
+
+def number_between(low, high, msg):
+    """Fail on numbers outside low..high."""
+    return Check(lambda x: x is not None and not low <= x <= high, msg,
+                 convert=_as_float, low=low, high=high)
+
+
+MISSING = object()
+TEXT_ALLOWS = {'nonblank', 'shortest', 'longest', 'search', 'contains'}
+NUMBER_ALLOWS = {'nonblank', 'number', 'low', 'high'}
+
+
+class Field(object):
+    """A request property and its checks, in increasing precedence.
+
+    When several checks reporting under the same key fail, the last one
+    listed wins. Checks report under '<prop> error' unless they name
+    their own key. With strip the checks see the value without
+    surrounding whitespace. An optional field may be left out.
+    """
+
+    def __init__(self, prop, *checks, key=None, required=None, strip=False,
+                 optional=False):
+        self.prop = prop
+        self.key = key or prop + ' error'
+        self.required = required or f"Please provide {prop}"
+        self.strip = strip
+        self.optional = optional
+        self.checks = checks
+
+    def compile(self):
+        """Return a function adding the errors of a value to a message.
+
+        When every check describes what it lets through, the function
+        first tests the value against all of them at once and returns
+        when it passes, which is what valid requests do. Otherwise, and
+        for values that fail, the checks of each key are tried highest
+        precedence first and stop at the first failure.
+        """
+        explain = self._explain()
+        converters, allows = self._allows()
+        if converters == {None} and set(allows) <= TEXT_ALLOWS:
+            return self._fuse_text(allows, explain)
+        if (converters and len(converters - {None}) == 1 and
+                'number' in allows and set(allows) <= NUMBER_ALLOWS):
+            return self._fuse_number(allows, (converters - {None}).pop(),
+                                     explain)
+
+        def check_value(value, message):
+            explain(value if value.__class__ is str else str(value), message)
+        return check_value
+
+    def bounds(self):
+        """Return (shortest, longest) if those say whether text passes.
+
+        That is when the checks only ask for non-blank text between two
+        lengths, so a caller can test string values inline. Otherwise
+        return None.
+        """
+        converters, allows = self._allows()
+        if (converters != {None} or self.strip or not allows.get('nonblank')
+                or not set(allows) <= {'nonblank', 'shortest', 'longest'}):
+            return None
+        return (max(allows.get('shortest', [0])),
+                min(allows.get('longest', [float('inf')])))
+
+    def _allows(self):
+        """Return the convert functions and the allows of the checks.
+
+        The convert functions are None when a check does not describe
+        what it lets through.
+        """
+        allows = {}
+        converters = set()
+        for check in self.checks:
+            if not check.allows:
+                return None, {}
+            converters.add(check.convert)
+            for name, value in check.allows.items():
+                allows.setdefault(name, []).append(value)
+        return converters, allows
+
+    def _fuse_text(self, allows, explain):
+        strip = self.strip
+        nonblank = bool(allows.get('nonblank'))
+        shortest = max(allows.get('shortest', [0]))
+        longest = min(allows.get('longest', [float('inf')]))
+        if strip and nonblank:
+            # stripped text is blank only when it is empty
+            shortest, nonblank = max(shortest, 1), False
+        searches = tuple(allows.get('search', ()))
+        contains = ''.join(allows.get('contains', ()))
+        if not searches and not contains:
+            def check_text(value, message):
+                text = value if value.__class__ is str else str(value)
+                if strip:
+                    text = text.strip()
+                if not (shortest <= len(text) <= longest and
+                        (not nonblank or text.strip())):
+                    explain(text, message)
+            return check_text
+
+        def check_text(value, message):
+            text = value if value.__class__ is str else str(value)
+            if strip:
+                text = text.strip()
+            if shortest <= len(text) <= longest and (
+                    not nonblank or text.strip()):
+                for char in contains:
+                    if char not in text:
+                        break
+                else:
+                    for search in searches:
+                        if not search(text):
+                            break
+                    else:
+                        return
+            explain(text, message)
+        return check_text
+
+    def _fuse_number(self, allows, convert, explain):
+        strip = self.strip
+        low = max(allows.get('low', [float('-inf')]))
+        high = min(allows.get('high', [float('inf')]))
+        # a whole number can skip the text round trip, which only gives
+        # it back unless it is too large to be within finite bounds
+        bounded = 'low' in allows and 'high' in allows
+
+        def check_number(value, message):
+            if value.__class__ is int and bounded and low <= value <= high:
+                return
+            text = value if value.__class__ is str else str(value)
+            if strip:
+                text = text.strip()
+            number = convert(text)
+            if number is None or not low <= number <= high:
+                explain(text, message)
+        return check_number
+
+    def _explain(self):
+        """Return a function adding the errors of a text to a message.
+
+        Each convert function the checks use runs only once.
+        """
+        key, strip = self.key, self.strip
+        converters = []
+        by_key = {}
+        for check in self.checks:
+            if check.convert and check.convert not in converters:
+                converters.append(check.convert)
+            by_key.setdefault(check.key or key, []).append(check)
+        # (key, ((position, fails, msg), ...)) where position picks the
+        # text (0) or a converted value out of the values list
+        groups = tuple((check_key, tuple(
+            (converters.index(check.convert) + 1 if check.convert else 0,
+             check.fails, check.msg) for check in reversed(checks)))
+            for check_key, checks in by_key.items())
+
+        def explain(text, message):
+            if strip:
+                text = text.strip()
+            values = [text]
+            for convert in converters:
+                values.append(convert(text))
+            for check_key, checks in groups:
+                for position, fails, msg in checks:
+                    if fails(values[position]):
+                        message[check_key] = msg
+                        break
+        return explain
+
+
+class Schema(object):
+    """Fields compiled once into a flat tuple of checking functions.
+
+    Validating an object is then a single pass over its fields, with
+    no per-request setup. Required fields that only bound the length
+    of non-blank text are tested first, inline; when they all pass only
+    the other fields remain to be checked.
+    """
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self.checks = tuple(
+            (field.prop, field.key,
+             None if field.optional else field.required, field.compile())
+            for field in fields)
+        plain = [field for field in fields
+                 if not field.optional and field.bounds()]
+        self.plain = tuple((field.prop,) + field.bounds() for field in plain)
+        self.rest = tuple(check for field, check in zip(fields, self.checks)
+                          if field not in plain)
+        self.rest_required = tuple(check for check in self.rest if check[2])
+
+    def validate(self, obj):
+        """Return the errors of obj, or None."""
+        # decoded JSON objects are plain dicts, which skip isinstance
+        if obj.__class__ is not dict and not isinstance(obj, dict):
+            return {'msg': 'Request body must be a JSON object'}
+        get = obj.get
+        # with no keys beyond the plain fields, the others are missing
+        checks = (self.rest if len(obj) > len(self.plain)
+                  else self.rest_required)
+        for prop, shortest, longest in self.plain:
+            value = get(prop)
+            if not (value.__class__ is str and
+                    shortest <= len(value) <= longest and value.strip()):
+                checks = self.checks
+                break
+        message = {}
+        for prop, key, required, check in checks:
+            value = get(prop, MISSING)
+            if value is not MISSING:
+                check(value, message)
+            elif required:
+                message[key] = required
+        return message or None
+
+SCHEMAS = {
+    'user_reg': Schema(
+        Field('email', not_empty('email'),
+              is_email('Email is invalid'),
+              max_length(255, 'Email cannot be more than 255 characters')),
+        Field('username', not_empty('username'),
+              max_length(10, 'Username cannot be more than 10 characters')),
+        Field('name', not_empty('name'),
+              max_length(255, 'Name cannot be more than 255 characters')),
+        Field('password', not_empty('password'),
+              min_length(6, 'Password cannot be less than 6 characters'),
+              matches(HAS_SPECIAL, 'Strong password must have at least '
+                                   'one special character'),
+              matches(HAS_NUMBERS, 'Strong password must have at least '
+                                   'one number character'),
+              max_length(255, 'Password cannot be more than 255 characters')),
+    ),
+    'business_reg': Schema(
+        Field('name', not_empty('name'),
+              max_length(255, 'Name must be less than 255 characters')),
+        Field('description', not_empty('description'),
+              max_length(255, 'Description must be less than 255 '
+                              'characters')),
+        Field('location', not_empty('location'),
+              max_length(255, 'Location string must be less than 255 '
+                              'characters')),
+        Field('category', not_empty('category')),
+        Field('latitude', is_number('Latitude must be a number'),
+              number_between(-90, 90, 'Latitude must be between -90 and 90'),
+              optional=True),
+        Field('longitude', is_number('Longitude must be a number'),
+              number_between(-180, 180,
+                             'Longitude must be between -180 and 180'),
+              optional=True),
+    ),
+    'review_reg': Schema(
+        Field('rating', not_empty('rating'),
+              is_int('Rating must be a value'),
+              int_above(5, 'Rating must be less than 5'),
+              int_below(1, 'Rating must be at least 1')),
+        Field('body', not_empty('body'),
+              max_length(255, 'Review must be less than 255 characters',
+                         key='review error')),
+    ),
+    'password_reset': Schema(
+        Field('new_password',
+              min_length(6, 'Password cannot be less than 6 characters'),
+              matches(HAS_NUMBERS, 'Strong password must have at least '
+                                   'one number character'),
+              matches(HAS_SPECIAL, 'Strong password must have at least '
+                                   'one special character'),
+              key='msg', required='Missing new password', strip=True),
+    ),
+}
+
 
 class Validator:
-    def __init__(self):
-        self.user_props = ['email', 'username', 'name', 'password']
-        self.review_props = ['rating', 'body']
-        self.business_props = ['name', 'description', 'location', 'category']
-        self.has_numbers = re.compile('[0-9]')
-        self.has_special = re.compile('[^\w\s]')
+    def __init__(self, schemas=None):
+        self.schemas = schemas or SCHEMAS
+        self._validate = {con: schema.validate
+                          for con, schema in self.schemas.items()}
 
     def validate(self, obj, con):
-        if con == 'user_reg':
-            message = {}
-            for prop in self.user_props:
-                if prop not in obj:
-                    message[prop+' error'] = f"Please provide {prop}"
-            for prop in self.user_props:
-                if prop in obj and str(obj[prop]).strip() == "":
-                    message[prop+' error'] = f'Empty {prop} is not allowed'
-            if 'name' in obj and len(str(obj['name'])) > 255:
-                message['name error'] = 'Name cannot be more than 255 characters'
-            if 'email' in obj and '@' not in str(obj['email']):
-                message['email error'] = 'Email is invalid'
-            if 'email' in obj and '.' not in str(obj['email']):
-                message['email error'] = 'Email is invalid'
-            if 'password' in obj and len(str(obj['password'])) < 6:
-                message['password error'] = 'Password cannot be less than 6 characters'
-            if 'password' in obj and not self.has_special.search(obj['password']):
-                message['password error'] = 'Strong password must have at least one special character'
-            if 'password' in obj and not self.has_numbers.search(obj['password']):
-                message['password error'] = 'Strong password must have at least one number character'
-            if 'password' in obj and len(str(obj['password'])) > 255:
-                message['password error'] = 'Password cannot be more than 255 characters'
-            if 'email' in obj and len(str(obj['email'])) > 255:
-                message['email error'] = 'Email cannot be more than 255 characters'
-            if 'username' in obj and len(str(obj['username'])) > 10:
-                message['username error'] = 'Username cannot be more than 10 characters'
-            if message:
-                return message
-
-        if con == 'business_reg':
-            message = {}
-            for prop in self.business_props:
-                if prop not in obj:
-                    message[prop+' error'] = f"Please provide {prop}"
-            for prop in self.business_props:
-                if prop in obj and str(obj[prop]).strip() == "":
-                    message[prop+' error'] = f'Empty {prop} is not allowed'
-            if "name" in obj and len(str(obj['name'])) > 255:
-                message['name error'] = 'Name must be less than 255 characters'
-            if 'description' in obj and len(str(obj['description'])) > 255:
-                message['description error'] = 'Description must be less than 255 characters'
-            if 'location' in obj and len(str(obj['location'])) > 255:
-                message['location error'] = 'Location string must be less than 255 characters'
-            if message:
-                return message
-
-        if con == 'review_reg':
-            message = {}
-            for prop in self.review_props:
-                if prop not in obj:
-                    message[prop+' error'] = f"Please provide {prop}"
-            for prop in self.review_props:
-                if prop in obj and str(obj[prop]).strip() == "":
-                    message[prop + ' error'] = f'Empty {prop} is not allowed'
-            if 'rating' in obj and not isinstance(int(obj['rating']), int):
-                message['rating error'] = 'Rating must be a value'
-            if 'body' in obj and len(str(obj['body'])) > 255:
-                message['review error'] = 'Review must be less than 255 characters'
-            if 'rating' in obj and int(obj['rating']) > 5:
-                message['rating error'] = 'Rating must be less than 5'
-            if message:
-                return message
+        """Return the errors of obj against schema con, or None."""
+        return self._validate[con](obj)
+
+    def validate_many(self, objs, con):
+        """Return the errors of each object of a list, None where valid."""
+        validate = self.schemas[con].validate
+        return [validate(obj) if isinstance(obj, dict)
+                else {'item error': 'Item must be a JSON object'}
+                for obj in objs]
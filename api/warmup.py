@@ -0,0 +1,75 @@
+"""Get an app ready for traffic before a server worker accepts any.
+
+prepare() does the work every worker would otherwise repeat, so it runs
+once in a preloading server's master and is shared by the forks.
+warm_up() opens what cannot cross a fork: database connections, the
+password hashing processes and the per-worker caches.
+"""
+import time
+
+from sqlalchemy import orm
+
+from api.passwords import passwords
+from api.serializers import SERIALIZERS, json_backend
+
+
+def engines(app, db):
+    """Return the engines of the primary database and of every bind."""
+    binds = [None] + sorted(app.config.get('SQLALCHEMY_BINDS') or {})
+    return [db.get_engine(app, bind) for bind in binds]
+
+
+def dispose_engines(app, db):
+    """Drop pooled connections inherited from the parent process.
+
+    A connection shared by two processes interleaves their traffic on
+    one socket, so a forked worker must open its own.
+    """
+    for engine in engines(app, db):
+        engine.dispose()
+
+
+def prepare():
+    """Do the import time work shared by every worker.
+
+    Returns the seconds it took.
+    """
+    started = time.perf_counter()
+    orm.configure_mappers()
+    for serializer in SERIALIZERS.values():
+        serializer.compile()
+    json_backend.dumps({'ready': True})
+    return time.perf_counter() - started
+
+
+def warm_up(app, db, connections=1, paths=()):
+    """Open connections and fill the caches of this process.
+
+    Checks out `connections` connections of each engine at once so the
+    pool holds them, starts the password hashing processes and requests
+    each of paths, which are then left out of the metrics. Returns the
+    seconds each step took.
+    """
+    timings = {}
+    started = time.perf_counter()
+    with app.app_context():
+        for engine in engines(app, db):
+            opened = [engine.connect() for _ in range(max(1, connections))]
+            for connection in opened:
+                connection.execute('SELECT 1')
+                connection.close()
+    timings['connections'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    passwords.needs_rehash(passwords.hash('warm up'))
+    timings['passwords'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    client = app.test_client()
+    for path in paths:
+        client.get(path)
+    metrics = app.extensions.get('metrics')
+    if paths and metrics is not None:
+        metrics.reset()
+    timings['requests'] = time.perf_counter() - started
+    return timings
@@ -0,0 +1,79 @@
+"""Compare the serializer registry with the dicts the routes used to build.
+
+Run with `python -m benchmarks.bench_serialization`.
+"""
+import json
+import timeit
+from types import SimpleNamespace
+
+from api.serializers import JSONBackend, serializer_for
+
+SIZES = (1000, 10000)
+
+
+def make_businesses(count):
+    """Return count objects shaped like Business rows."""
+    return [SimpleNamespace(
+        id=i, name='Business {}'.format(i), category='shop',
+        description='The best prices in town', location='Near TRM',
+        business_owner='owner{}'.format(i % 50), review_count=i % 7,
+        rating_average=3.5, rating_1=0, rating_2=1, rating_3=2, rating_4=2,
+        rating_5=i % 3, latitude=-1.28 + i % 100 * 1e-4,
+        longitude=36.82 + i % 100 * 1e-4) for i in range(count)]
+
+
+def legacy_details(business):
+    """The per-route dict building the serializer replaced."""
+    return {'name': business.name,
+            'category': business.category,
+            'description': business.description,
+            'id': business.id,
+            'location': business.location,
+            'owner': business.business_owner,
+            'rating': {'count': business.review_count or 0,
+                       'average': round(business.rating_average or 0, 2),
+                       'histogram': {str(stars): getattr(
+                           business, 'rating_{}'.format(stars)) or 0
+                           for stars in range(1, 6)}}}
+
+
+def legacy(businesses):
+    """Encode the way jsonify does, which sorts keys by default."""
+    return json.dumps({'businesses': [legacy_details(business)
+                                      for business in businesses]},
+                      separators=(',', ':'), sort_keys=True)
+
+
+def bench(number=5):
+    """Return milliseconds per list for each size and encoder."""
+    serializer = serializer_for('business')
+    backends = []
+    for name in JSONBackend.ENCODERS:
+        backend = JSONBackend()
+        try:
+            backend.use(name)
+        except ImportError:
+            continue
+        backends.append(backend)
+    results = {}
+    for size in SIZES:
+        businesses = make_businesses(size)
+        seconds = timeit.timeit(lambda: legacy(businesses), number=number)
+        results['legacy x{}'.format(size)] = seconds / number * 1e3
+        for backend in backends:
+            seconds = timeit.timeit(lambda: backend.dumps(
+                {'businesses': serializer.many(businesses)}), number=number)
+            results['{} x{}'.format(backend.name, size)] = (
+                seconds / number * 1e3)
+        stdlib = backends[-1]
+        seconds = timeit.timeit(lambda: stdlib.dumps(
+            {'businesses': serializer.many(businesses, ('name', 'location'))}),
+            number=number)
+        results['json fields=name,location x{}'.format(size)] = (
+            seconds / number * 1e3)
+    return results
+
+
+if __name__ == '__main__':
+    for name, millis in sorted(bench().items()):
+        print('{:<32} {:>10.2f} ms'.format(name, millis))
@@ -0,0 +1,38 @@
+"""Micro-benchmarks of the hot helpers behind the routes."""
+import timeit
+
+from api.models import User
+from api.serializers import serializer_for
+from api.validators import Validator
+from benchmarks.bench_serialization import make_businesses
+from benchmarks.bench_validator import SAMPLES
+
+
+def _micros(func, number):
+    """Return the best microseconds per call over three runs."""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def run(app, usernames, number=2000):
+    """Return microseconds per call of each micro-benchmark.
+
+    usernames are existing users for the User.get_user lookups.
+    """
+    results = {}
+    validator = Validator()
+    for con, sample in sorted(SAMPLES.items()):
+        results['validator.{}'.format(con)] = _micros(
+            lambda: validator.validate(sample, con), number)
+    serializer = serializer_for('business')
+    businesses = make_businesses(1000)
+    results['serialize.business x1000'] = _micros(
+        lambda: serializer.many(businesses), max(1, number // 200))
+    if usernames:
+        with app.app_context():
+            lookups = max(1, number // 10)
+            results['User.get_user(username)'] = _micros(
+                lambda: User.get_user(usernames[0]), lookups)
+            results['User.get_user(email)'] = _micros(
+                lambda: User.get_user(usernames[0] + '@example.com'),
+                lookups)
+    return {name: {'us': round(value, 3)} for name, value in results.items()}
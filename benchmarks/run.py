@@ -0,0 +1,153 @@
+"""Run the load scenarios and micro-benchmarks and check for regressions.
+
+    python -m benchmarks.run --requests 500 -o results.json
+    python -m benchmarks.run --baseline baseline.json --threshold 0.2
+
+The app runs in-process under the testing configuration against
+--database (a throwaway SQLite file by default, or a local PostgreSQL
+URL). Results are written as JSON; with --baseline every latency that
+grew, or throughput that fell, by more than --threshold is reported
+and the exit status is 1. The cold start time of the app is tracked
+alongside (see benchmarks.startup).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+
+def parse_args(argv=None):
+    from benchmarks.scenarios import SCENARIOS
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database', help='database URL to benchmark on '
+                        '(default: a temporary SQLite file)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated scenarios to run')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=50,
+                        help='untimed requests per scenario first')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--businesses', type=int, default=1000)
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the response cache on')
+    parser.add_argument('--real-hashing', action='store_true',
+                        help='hash passwords with the production method '
+                        'instead of the cheap testing one')
+    parser.add_argument('--no-micro', dest='micro', action='store_false',
+                        help='skip the micro-benchmarks')
+    parser.add_argument('--no-startup', dest='startup', action='store_false',
+                        help='skip timing the cold start of the app')
+    parser.add_argument('-o', '--output', help='write the results here')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative slowdown (default 0.2)')
+    return parser.parse_args(argv)
+
+
+def flatten(results):
+    """Return {metric: (value, higher_is_better)} for comparison."""
+    metrics = {}
+    for name, scenario in results.get('scenarios', {}).items():
+        metrics['{} rps'.format(name)] = (scenario['rps'], True)
+        for route, figures in scenario['routes'].items():
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                metrics['{} {} {}'.format(name, route, key)] = (
+                    figures[key], False)
+    for name, figures in results.get('micro', {}).items():
+        metrics['micro {} us'.format(name)] = (figures['us'], False)
+    if 'startup' in results:
+        metrics['startup seconds'] = (results['startup']['seconds'], False)
+    return metrics
+
+
+def compare(results, baseline, threshold):
+    """Return (metric, baseline, current, change) for each regression."""
+    current = flatten(results)
+    regressions = []
+    for metric, (before, higher_is_better) in sorted(
+            flatten(baseline).items()):
+        if metric not in current or not before:
+            continue
+        after = current[metric][0]
+        change = (after - before) / before
+        if (-change if higher_is_better else change) > threshold:
+            regressions.append((metric, before, after, change))
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    database = args.database or 'sqlite:///{}'.format(
+        os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db'))
+    # the config reads these when first imported
+    os.environ['DATABASE_URL'] = database
+    os.environ['APP_CONFIGURATION'] = 'testing'
+    os.environ.setdefault('APP_SECRET', 'benchmark-secret')
+
+    from api import create_app
+    from api.instance.config import Config
+    from api.models import db
+    from api.passwords import passwords
+    from benchmarks import micro, startup
+    from benchmarks.scenarios import SCENARIOS, Session, populate
+
+    app = create_app('testing', RESPONSE_CACHE_TTL=60 if args.cache else 0)
+    if args.real_hashing:
+        passwords.method = Config.PASSWORD_HASH_METHOD
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    session = Session(app.test_client(), seed=args.seed)
+    populate(session, args.users, args.businesses, args.reviews)
+
+    results = {'meta': {'database': database.split('@')[-1],
+                        'python': platform.python_version(),
+                        'seed': args.seed, 'requests': args.requests,
+                        'users': args.users,
+                        'businesses': args.businesses,
+                        'reviews': args.reviews,
+                        'cache': args.cache,
+                        'real_hashing': args.real_hashing,
+                        'created': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'scenarios': {}}
+    for name in args.scenarios.split(','):
+        scenario = SCENARIOS[name.strip()]
+        scenario(session, args.warmup)
+        session.reset()
+        started = time.perf_counter()
+        scenario(session, args.requests)
+        results['scenarios'][name.strip()] = session.report(
+            time.perf_counter() - started)
+        session.reset()
+    if args.micro:
+        results['micro'] = micro.run(
+            app, [user['username'] for user in session.users])
+    if args.startup:
+        results['startup'] = startup.run()
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  args.threshold)
+        for metric, before, after, change in regressions:
+            print('REGRESSION {}: {} -> {} ({:+.0%})'.format(
+                metric, before, after, change), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Load scenarios replayed against the app through its test client.
+
+Each scenario takes a Session and a request count and issues that many
+requests the way one kind of traffic would. Every request is timed and
+filed under its route pattern, so the report reads per route.
+"""
+import math
+import random
+import time
+from collections import defaultdict
+
+from flask import json
+
+WORDS = ['keroro', 'maziwa', 'butchery', 'shop', 'salon', 'garage',
+         'bakery', 'pharmacy', 'cafe', 'hardware', 'books', 'tailor',
+         'grocer', 'florist', 'studio', 'clinic']
+CATEGORIES = ['shop', 'food', 'health', 'services', 'auto', 'beauty']
+LOCATIONS = ['Near TRM', 'Kilimani', 'Westlands', 'CBD', 'Karen', 'Ruaka',
+             'Thika Road', 'Lavington']
+# (south, north, west, east) of the area the businesses are spread over
+AREA = (-1.40, -1.17, 36.65, 37.00)
+PASSWORD = '123$usr'
+JSON = {'content-type': 'application/json'}
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class Session(object):
+    """A test client that times every request by route."""
+
+    def __init__(self, client, seed=0):
+        self.client = client
+        self.random = random.Random(seed)
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.users = []
+        self.tokens = {}
+        self.business_ids = []
+
+    def request(self, route, method, url, body=None, token=None):
+        """Send a request, recording its latency under route."""
+        headers = dict(JSON)
+        if token:
+            headers['x-access-token'] = token
+        data = json.dumps(body) if body is not None else None
+        started = time.perf_counter()
+        response = self.client.open(url, method=method, data=data,
+                                    headers=headers)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        label = '{} {}'.format(method, route)
+        self.timings[label].append(elapsed)
+        self.statuses[label][response.status_code] += 1
+        return response
+
+    def report(self, seconds):
+        """Return latency percentiles and throughput per route."""
+        routes = {}
+        total = 0
+        for label, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            total += len(timings)
+            routes[label] = {
+                'count': len(timings),
+                'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+                'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+                'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+                'statuses': {str(status): count for status, count in
+                             sorted(self.statuses[label].items())}}
+        return {'requests': total, 'seconds': round(seconds, 3),
+                'rps': round(total / seconds, 1) if seconds else None,
+                'routes': routes}
+
+    def reset(self):
+        """Forget the timings recorded so far."""
+        self.timings.clear()
+        self.statuses.clear()
+
+
+def business_name(rng, i):
+    return '{} {} {}'.format(rng.choice(WORDS).title(),
+                             rng.choice(WORDS).title(), i)
+
+
+def populate(session, users=20, businesses=1000, reviews=5000):
+    """Create users, businesses and reviews through the API.
+
+    The first user owns every business and the others review them, so
+    the data goes through the same validation and indexing as real
+    traffic. The same seed always builds the same data.
+    """
+    rng = session.random
+    for i in range(users):
+        user = {'name': 'Bench User {}'.format(i),
+                'username': 'bench{}'.format(i),
+                'email': 'bench{}@example.com'.format(i),
+                'password': PASSWORD}
+        session.client.post('/api/v2/auth/register', data=json.dumps(user),
+                            headers=JSON)
+        response = session.client.post(
+            '/api/v2/auth/login', headers=JSON, data=json.dumps(
+                {'username': user['username'], 'password': PASSWORD}))
+        session.users.append(user)
+        session.tokens[user['username']] = json.loads(
+            response.data)['token']
+    owner = session.tokens[session.users[0]['username']]
+    for start in range(0, businesses, 500):
+        batch = [{'name': business_name(rng, i),
+                  'category': rng.choice(CATEGORIES),
+                  'description': 'Bench business {}'.format(i),
+                  'location': rng.choice(LOCATIONS),
+                  'latitude': round(rng.uniform(*AREA[:2]), 6),
+                  'longitude': round(rng.uniform(*AREA[2:]), 6)}
+                 for i in range(start, min(start + 500, businesses))]
+        response = session.client.post(
+            '/api/v2/businesses/batch', data=json.dumps(
+                {'businesses': batch}),
+            headers=dict(JSON, **{'x-access-token': owner}))
+        session.business_ids.extend(
+            result['id'] for result in json.loads(response.data)['results'])
+    reviewers = [session.tokens[user['username']]
+                 for user in session.users[1:]]
+    for start in range(0, reviews, 500):
+        batch = [{'business_id': rng.choice(session.business_ids),
+                  'rating': rng.randint(1, 5),
+                  'body': 'Bench review {}'.format(i)}
+                 for i in range(start, min(start + 500, reviews))]
+        session.client.post(
+            '/api/v2/reviews/batch', data=json.dumps({'reviews': batch}),
+            headers=dict(JSON, **{'x-access-token': rng.choice(reviewers)}))
+
+
+def browse(session, requests):
+    """Page through listings, open businesses and read their reviews."""
+    rng = session.random
+    cursor = ''
+    for i in range(requests):
+        kind = i % 4
+        if kind == 0:
+            session.request('/api/v2/businesses/', 'GET',
+                            '/api/v2/businesses/?page={}&limit=20'.format(
+                                rng.randint(1, 20)))
+        elif kind == 1:
+            response = session.request(
+                '/api/v2/businesses/?after=', 'GET',
+                '/api/v2/businesses/?limit=20&after={}'.format(cursor))
+            cursor = json.loads(response.data).get('next_cursor') or ''
+        elif kind == 2:
+            session.request('/api/v2/businesses/<id>', 'GET',
+                            '/api/v2/businesses/{}'.format(
+                                rng.choice(session.business_ids)))
+        else:
+            session.request('/api/v2/businesses/<id>/reviews', 'GET',
+                            '/api/v2/businesses/{}/reviews'.format(
+                                rng.choice(session.business_ids)))
+
+
+def search(session, requests):
+    """Search by name prefixes, sometimes narrowed by place or category."""
+    rng = session.random
+    for _ in range(requests):
+        url = '/api/v2/businesses/search?q={}'.format(
+            rng.choice(WORDS)[:rng.randint(2, 6)])
+        if rng.random() < 0.3:
+            url += '&location={}'.format(rng.choice(LOCATIONS))
+        if rng.random() < 0.3:
+            url += '&category={}'.format(rng.choice(CATEGORIES))
+        session.request('/api/v2/businesses/search', 'GET', url)
+
+
+def nearby(session, requests):
+    """Look for businesses around random points of the area."""
+    rng = session.random
+    for _ in range(requests):
+        session.request(
+            '/api/v2/businesses/nearby', 'GET',
+            '/api/v2/businesses/nearby?lat={}&lng={}&radius={}'.format(
+                round(rng.uniform(*AREA[:2]), 5),
+                round(rng.uniform(*AREA[2:]), 5),
+                rng.choice([0.5, 2, 5])))
+
+
+def review_burst(session, requests):
+    """Post reviews from many users as fast as possible."""
+    rng = session.random
+    reviewers = [user['username'] for user in session.users[1:]]
+    for i in range(requests):
+        session.request(
+            '/api/v2/businesses/<id>/reviews', 'POST',
+            '/api/v2/businesses/{}/reviews'.format(
+                rng.choice(session.business_ids)),
+            {'rating': rng.randint(1, 5), 'body': 'Burst review {}'.format(i)},
+            token=session.tokens[rng.choice(reviewers)])
+
+
+def login_storm(session, requests):
+    """Log users in over and over, by username and by email."""
+    rng = session.random
+    for _ in range(requests):
+        user = rng.choice(session.users)
+        key = rng.choice(['username', 'email'])
+        session.request('/api/v2/auth/login', 'POST', '/api/v2/auth/login',
+                        {key: user[key], 'password': PASSWORD})
+
+
+SCENARIOS = {
+    'browse': browse,
+    'search': search,
+    'nearby': nearby,
+    'review-burst': review_burst,
+    'login-storm': login_storm,
+}
@@ -0,0 +1,77 @@
+"""Measure how long a fresh process takes to build the app.
+
+    python -m benchmarks.startup --repeat 5
+
+Each run starts a new interpreter that imports run.py, which builds the
+app once, the way a freshly scaled server worker does. The wall time is
+measured inside that interpreter; on Python 3.7+ its `-X importtime`
+lines also give the import time of every module, summed per top level
+package.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+SCRIPT = ('import sys, time\n'
+          'before = set(sys.modules)\n'
+          'started = time.perf_counter()\n'
+          'from run import app\n'
+          'print(time.perf_counter() - started, '
+          'len(set(sys.modules) - before))\n')
+
+
+def parse_importtime(stderr):
+    """Return {module: self microseconds} from -X importtime output."""
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(1))
+    return modules
+
+
+def measure():
+    """Start one interpreter; return (seconds, module count, imports)."""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT], cwd=ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    seconds, count = process.stdout.split()[-2:]
+    return float(seconds), int(count), parse_importtime(process.stderr)
+
+
+def run(repeat=5, top=10):
+    """Return the fastest of repeat cold starts and where its time went."""
+    seconds, count, modules = min(measure() for _ in range(repeat))
+    packages = {}
+    for module, micros in modules.items():
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + micros
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:top]
+    return {'seconds': round(seconds, 4), 'modules': count,
+            'packages_ms': {package: round(micros / 1000, 1) for
+                            package, micros in sorted(
+                                packages.items(), key=lambda item: -item[1])
+                            [:top]},
+            'slowest_ms': [[module, round(micros / 1000, 1)]
+                           for module, micros in slowest]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10,
+                        help='packages and modules to list')
+    args = parser.parse_args(argv)
+    # the configuration autoscaled workers start with
+    os.environ.setdefault('APP_CONFIGURATION', 'production')
+    print(json.dumps(run(args.repeat, args.top), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""gunicorn settings, taken from the Config of APP_CONFIGURATION.
+
+    gunicorn -c gunicorn_config.py run:app
+
+With SERVER_PRELOAD the app is imported and prepared once in the master
+and forked into the workers, which then drop the inherited database
+connections, open their own and warm up before accepting traffic. Each
+worker logs how long it took to become ready.
+"""
+import os
+import time
+
+from api.instance.config import app_config
+
+STARTED = time.time()
+config = app_config[os.getenv('APP_CONFIGURATION')]
+
+workers = config.SERVER_WORKERS
+worker_class = config.SERVER_WORKER_CLASS
+threads = config.SERVER_THREADS
+timeout = config.SERVER_TIMEOUT
+preload_app = config.SERVER_PRELOAD
+
+
+def _app():
+    from api.models import db
+    from run import app
+    return app, db
+
+
+def on_starting(server):
+    if config.METRICS_ENABLED:
+        from api.metrics import clear_snapshots
+        clear_snapshots(config.METRICS_DIR)
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from api.warmup import prepare
+        _app()
+        server.log.info('App preloaded in %.0f ms, prepared in %.0f ms',
+                        (time.time() - STARTED) * 1000, prepare() * 1000)
+
+
+def pre_fork(server, worker):
+    worker.spawned_at = time.time()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.time()
+    if server.cfg.preload_app:
+        from api.warmup import dispose_engines
+        dispose_engines(*_app())
+
+
+def post_worker_init(worker):
+    from api.warmup import prepare, warm_up
+    loaded = time.time()
+    app, db = _app()
+    prepared = 0 if worker.cfg.preload_app else prepare()
+    timings = warm_up(app, db, connections=config.SERVER_THREADS,
+                      paths=config.WARMUP_PATHS)
+    worker.log.info(
+        'Worker %s ready in %.0f ms: fork %.0f, load %.0f, prepare %.0f, '
+        'connections %.0f, passwords %.0f, requests %.0f',
+        worker.pid, (time.time() - worker.spawned_at) * 1000,
+        (worker.forked_at - worker.spawned_at) * 1000,
+        (loaded - worker.forked_at) * 1000, prepared * 1000,
+        timings['connections'] * 1000, timings['passwords'] * 1000,
+        timings['requests'] * 1000)
@@ -1,8 +1,11 @@
-"""Handle migrations."""
+"""Handle migrations and bulk data jobs."""
+import json
 import os
+import sys
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from api import db, create_app
+from api.features import invalidate
 
 app = create_app(config_name=os.getenv('APP_CONFIGURATION'))
 
@@ -11,5 +14,58 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('path', help='CSV or NDJSON file of reviews')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=1000, help='reviews inserted per transaction')
+def import_reviews(path, chunk_size):
+    """Import reviews holding business_id, rating, body, review_owner."""
+    from api.ingest import ingest_reviews, read_reviews
+    report = ingest_reviews(read_reviews(path), chunk_size=chunk_size)
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+@manager.option('-f', '--format', dest='fmt', default='ndjson',
+                choices=['ndjson', 'csv'])
+@manager.option('-o', '--output', dest='output', default='-',
+                help='file to write, - for stdout')
+@manager.option('-r', '--reviews', dest='reviews', action='store_true',
+                help='embed the reviews of each business')
+@manager.option('-z', '--gzip', dest='gzip', action='store_true')
+def export(fmt, output, reviews, gzip):
+    """Export every business as NDJSON or CSV."""
+    from api.export import export_stream
+    target = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    try:
+        for block in export_stream(fmt, reviews, gzip):
+            target.write(block)
+    finally:
+        if target is not sys.stdout.buffer:
+            target.close()
+
+
+@manager.option('-u', '--users', dest='users', type=int, default=1000)
+@manager.option('-b', '--businesses', dest='businesses', type=int,
+                default=10000)
+@manager.option('-r', '--reviews', dest='reviews', type=int, default=100000)
+@manager.option('-s', '--seed', dest='random_seed', type=int, default=42,
+                help='the same seed gives the same data')
+@manager.option('-w', '--workers', dest='workers', type=int,
+                default=os.cpu_count(),
+                help='processes writing chunks (PostgreSQL only)')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=50000, help='rows generated per transaction')
+@manager.option('-z', '--zipf', dest='zipf', type=float, default=1.0,
+                help='skew of reviews towards popular businesses')
+def seed(users, businesses, reviews, random_seed, workers, chunk_size, zipf):
+    """Add a synthetic dataset of users, businesses and reviews."""
+    from api.seed import seed_database
+    report = seed_database(
+        app.config['SQLALCHEMY_DATABASE_URI'], users, businesses, reviews,
+        seed=random_seed, workers=workers, chunk_size=chunk_size, zipf=zipf,
+        log=lambda line: print(line, file=sys.stderr))
+    invalidate('businesses')
+    print(json.dumps(report, indent=2))
+
+
 if __name__ == '__main__':
     manager.run()
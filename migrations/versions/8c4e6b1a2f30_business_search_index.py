@@ -0,0 +1,52 @@
+"""business search index
+
+Revision ID: 8c4e6b1a2f30
+Revises: 3a1f0c2d9b7e
+Create Date: 2026-10-18 10:02:47.530921
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e6b1a2f30'
+down_revision = '3a1f0c2d9b7e'
+branch_labels = None
+depends_on = None
+
+SEARCH_FIELDS = ('name', 'location', 'category')
+
+
+def upgrade():
+    business_term = op.create_table('business_term',
+    sa.Column('business_id', sa.Integer(), nullable=False),
+    sa.Column('field', sa.String(length=16), nullable=False),
+    sa.Column('term', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['business_id'], ['business.id'],
+                            ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('business_id', 'field', 'term')
+    )
+    op.create_index('ix_business_term_field_term', 'business_term',
+                    ['field', 'term'], unique=False,
+                    postgresql_ops={'term': 'text_pattern_ops'})
+
+    # index the businesses that already exist
+    business = sa.table('business', sa.column('id'),
+                        *[sa.column(field) for field in SEARCH_FIELDS])
+    connection = op.get_bind()
+    rows = []
+    for row in connection.execute(sa.select([business])):
+        for field in SEARCH_FIELDS:
+            for term in set(re.findall(r'\w+', (row[field] or '').lower())):
+                rows.append({'business_id': row['id'], 'field': field,
+                             'term': term})
+    if rows:
+        op.bulk_insert(business_term, rows)
+
+
+def downgrade():
+    op.drop_index('ix_business_term_field_term', table_name='business_term')
+    op.drop_table('business_term')
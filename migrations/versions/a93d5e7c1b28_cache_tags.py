@@ -0,0 +1,28 @@
+"""cache tags
+
+Revision ID: a93d5e7c1b28
+Revises: f41d2a9c7e03
+Create Date: 2026-10-18 10:12:40.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93d5e7c1b28'
+down_revision = 'f41d2a9c7e03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_tag',
+    sa.Column('tag', sa.String(), nullable=False),
+    sa.Column('version', sa.String(length=32), nullable=False),
+    sa.PrimaryKeyConstraint('tag')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_tag')
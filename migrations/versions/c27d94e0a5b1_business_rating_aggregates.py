@@ -0,0 +1,52 @@
+"""business rating aggregates
+
+Revision ID: c27d94e0a5b1
+Revises: 8c4e6b1a2f30
+Create Date: 2026-10-18 11:26:13.902644
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c27d94e0a5b1'
+down_revision = '8c4e6b1a2f30'
+branch_labels = None
+depends_on = None
+
+COUNT_COLUMNS = ['review_count', 'rating_sum'] + [
+    'rating_{}'.format(stars) for stars in range(1, 6)]
+
+
+def upgrade():
+    for name in COUNT_COLUMNS:
+        op.add_column('business', sa.Column(name, sa.Integer(),
+                                            nullable=False,
+                                            server_default='0'))
+    op.add_column('business', sa.Column('rating_average', sa.Float(),
+                                        nullable=False, server_default='0'))
+    op.create_index('ix_business_rating_average', 'business',
+                    ['rating_average'], unique=False)
+
+    # fold in the reviews that already exist
+    stars_sql = ', '.join(
+        'rating_{0} = (SELECT COUNT(*) FROM review WHERE '
+        'review.business_id = business.id AND review.rating = {0})'.format(
+            stars) for stars in range(1, 6))
+    op.execute(
+        'UPDATE business SET '
+        'review_count = (SELECT COUNT(*) FROM review '
+        'WHERE review.business_id = business.id), '
+        'rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM review '
+        'WHERE review.business_id = business.id), ' + stars_sql)
+    op.execute(
+        'UPDATE business SET rating_average = rating_sum * 1.0 / review_count '
+        'WHERE review_count > 0')
+
+
+def downgrade():
+    op.drop_index('ix_business_rating_average', table_name='business')
+    op.drop_column('business', 'rating_average')
+    for name in reversed(COUNT_COLUMNS):
+        op.drop_column('business', name)
@@ -0,0 +1,37 @@
+"""hot lookup indexes
+
+Revision ID: e5b83f17c6d2
+Revises: c27d94e0a5b1
+Create Date: 2026-10-18 12:41:55.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b83f17c6d2'
+down_revision = 'c27d94e0a5b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_business_business_owner', 'business',
+                    ['business_owner'], unique=False)
+    op.create_index('ix_business_category_location', 'business',
+                    ['category', 'location'], unique=False)
+    op.create_index('ix_business_date_created', 'business',
+                    ['date_created', 'id'], unique=False)
+    op.create_index('ix_review_business_id_date_created', 'review',
+                    ['business_id', 'date_created', 'id'], unique=False)
+    op.create_index('ix_review_review_owner', 'review',
+                    ['review_owner'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_review_review_owner', table_name='review')
+    op.drop_index('ix_review_business_id_date_created', table_name='review')
+    op.drop_index('ix_business_date_created', table_name='business')
+    op.drop_index('ix_business_category_location', table_name='business')
+    op.drop_index('ix_business_business_owner', table_name='business')
@@ -0,0 +1,34 @@
+"""business coordinates
+
+Revision ID: f41d2a9c7e03
+Revises: e5b83f17c6d2
+Create Date: 2026-10-18 16:05:12.480913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f41d2a9c7e03'
+down_revision = 'e5b83f17c6d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('business', sa.Column('latitude', sa.Float(),
+                                        nullable=True))
+    op.add_column('business', sa.Column('longitude', sa.Float(),
+                                        nullable=True))
+    op.add_column('business', sa.Column('geocell', sa.BigInteger(),
+                                        nullable=True))
+    op.create_index('ix_business_geocell', 'business', ['geocell'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_business_geocell', table_name='business')
+    op.drop_column('business', 'geocell')
+    op.drop_column('business', 'longitude')
+    op.drop_column('business', 'latitude')
@@ -1,9 +1,17 @@
 """Contain tests for the user endpoints."""
 from flask import json
+import gzip
+import time
 import unittest
+from sqlalchemy import event
 # local imports
-from api.models import db
-from api.routes import app
+from api import create_app
+from api.cache import DatabaseTags, ResponseCache, response_cache
+from api.models import Business, Review, db
+from api.pagination import encode_cursor
+from run import app
+
+cached_app = create_app('testing', RESPONSE_CACHE_TTL=60)
 
 
 class BusinessRoutesTestCase(unittest.TestCase):
@@ -68,6 +76,30 @@ class BusinessRoutesTestCase(unittest.TestCase):
         self.assertEqual(self.response.status_code, 401)
         self.assertIn("Token is missing", str(self.response.data))
 
+    def test_business_and_review_with_a_list_body(self):
+        """JSON bodies that are not objects are validation errors."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        for url in ('/api/v2/businesses', '/api/v2/businesses/1/reviews'):
+            self.response = self.client.post(url,
+                                             data=json.dumps([1]),
+                                             headers={
+                                                 'content-type':
+                                                     'application/json',
+                                                 'x-access-token': self.token
+                                             })
+            self.assertEqual(self.response.status_code, 400)
+            self.assertIn("must be a JSON object", str(self.response.data))
+
     def test_register_business_with_correct_token_and_data(self):
         """Register a business with all input required."""
         self.client.post('/api/v2/auth/register',
@@ -129,6 +161,94 @@ class BusinessRoutesTestCase(unittest.TestCase):
         self.assertEqual(self.response.status_code, 401)
         self.assertIn("Token is invalid", str(self.response.data))
 
+    def test_register_businesses_in_a_batch(self):
+        """Register a batch atomically, then with best effort."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        batch = {"businesses": [self.test_bs, self.wrong_test_bs]}
+        self.response = self.client.post('/api/v2/businesses/batch',
+                                         data=json.dumps(batch),
+                                         headers={
+                                             'content-type':
+                                             'application/json',
+                                             'x-access-token': self.token
+                                         })
+        self.assertEqual(self.response.status_code, 400)
+        results = json.loads(self.response.data)['results']
+        self.assertEqual([result['status'] for result in results],
+                         ['skipped', 'invalid'])
+        batch['mode'] = 'best_effort'
+        self.response = self.client.post('/api/v2/businesses/batch',
+                                         data=json.dumps(batch),
+                                         headers={
+                                             'content-type':
+                                             'application/json',
+                                             'x-access-token': self.token
+                                         })
+        self.assertEqual(self.response.status_code, 201)
+        results = json.loads(self.response.data)['results']
+        self.assertEqual(results[0]['status'], 'created')
+        self.assertIn("Empty name is not allowed", str(self.response.data))
+        self.response = self.client.get('/api/v2/businesses/search?q=keroro')
+        self.assertEqual(len(json.loads(self.response.data)['businesses']), 1)
+
+    def test_batch_queries_do_not_grow_with_the_batch(self):
+        """Register batches of 2 and 20 in the same number of queries."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            counts, ids = [], []
+            for size in (2, 20):
+                del statements[:]
+                batch = {"businesses": [
+                    dict(self.test_bs, name='Shop {}'.format(i))
+                    for i in range(size)]}
+                self.response = self.client.post(
+                    '/api/v2/businesses/batch', data=json.dumps(batch),
+                    headers={
+                        'content-type': 'application/json',
+                        'x-access-token': self.token
+                    })
+                self.assertEqual(self.response.status_code, 201)
+                counts.append(len(statements))
+                ids.extend(result['id'] for result in
+                           json.loads(self.response.data)['results'])
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(ids, list(range(ids[0], ids[0] + 22)))
+        self.response = self.client.get(
+            '/api/v2/businesses/{}'.format(ids[-1]))
+        self.assertIn('Shop 19', str(self.response.data))
+        self.response = self.client.get(
+            '/api/v2/businesses/search?q=shop&total=exact')
+        self.assertEqual(json.loads(self.response.data)['total_results'], 22)
+
     def test_try_to_update_a_bs_with_non_existing_business_id(self):
         """Try to update a bs with token and all the details."""
         self.client.post('/api/v2/auth/register',
@@ -314,6 +434,159 @@ class BusinessRoutesTestCase(unittest.TestCase):
         self.assertEqual(self.response.status_code, 200)
         self.assertEqual(len(json.loads(self.response.data)['businesses']), 2)
 
+    def test_retrieving_businesses_with_a_cursor(self):
+        """Walk the business list page by page using next_cursor."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        for bs in (self.test_bs, self.another_test_bs):
+            self.client.post('/api/v2/businesses',
+                             data=json.dumps(bs),
+                             headers={
+                                 'content-type': 'application/json',
+                                 'x-access-token': self.token
+                             })
+        self.response = self.client.get(
+            '/api/v2/businesses/?after=&limit=1&total=exact')
+        self.assertEqual(self.response.status_code, 200)
+        page = json.loads(self.response.data)
+        self.assertEqual(page['businesses'][0]['name'], 'Keroro Shop')
+        self.assertEqual(page['total_results'], 2)
+        self.response = self.client.get(
+            '/api/v2/businesses/?limit=1&after=' + page['next_cursor'])
+        page = json.loads(self.response.data)
+        self.assertEqual(page['businesses'][0]['name'], 'Maziwa Butchery')
+        self.assertIsNone(page['next_cursor'])
+        self.assertNotIn('total_results', page)
+
+    def test_searching_businesses_with_a_cursor(self):
+        """Ranked searches refuse a cursor unless sorted by rating."""
+        self.response = self.client.get(
+            '/api/v2/businesses/search?q=shop&after=')
+        self.assertEqual(self.response.status_code, 400)
+        self.assertIn("ranked by relevance", str(self.response.data))
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.test_bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.response = self.client.get(
+            '/api/v2/businesses/search?q=shop&sort=rating&after=')
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(json.loads(self.response.data)['businesses'][0][
+            'name'], 'Keroro Shop')
+
+    def test_retrieving_businesses_with_a_bad_cursor(self):
+        """A cursor that was not issued by the API is rejected."""
+        self.response = self.client.get('/api/v2/businesses/?after=nonsense')
+        self.assertEqual(self.response.status_code, 400)
+        self.assertIn("Cursor is invalid", str(self.response.data))
+
+    def test_retrieving_businesses_with_a_tampered_rating_cursor(self):
+        """Sort keys of the wrong type in a cursor are rejected."""
+        for key in (['x', 1], [True, 1], [float('nan'), 1], [4.5, 'x']):
+            cursor = encode_cursor(key)
+            self.response = self.client.get(
+                '/api/v2/businesses/?sort=rating&after=' + cursor)
+            self.assertEqual(self.response.status_code, 400)
+            self.assertIn("Cursor is invalid", str(self.response.data))
+
+    def test_retrieving_only_some_fields_of_businesses(self):
+        """?fields= trims every business down to the fields named."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.test_bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.response = self.client.get(
+            '/api/v2/businesses/?fields=name,location')
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(json.loads(self.response.data)['businesses'],
+                         [{'name': 'Keroro Shop', 'location': 'Near TRM'}])
+        self.response = self.client.get('/api/v2/businesses/1?fields=rating')
+        self.assertEqual(json.loads(self.response.data)['details'],
+                         {'rating': {'count': 0, 'average': 0,
+                                     'histogram': {'1': 0, '2': 0, '3': 0,
+                                                   '4': 0, '5': 0}}})
+        self.response = self.client.get(
+            '/api/v2/businesses/?fields=name,secret')
+        self.assertEqual(self.response.status_code, 400)
+        self.assertIn("Unknown fields: secret", str(self.response.data))
+
+    def test_listings_select_only_the_requested_columns(self):
+        """Lists read projected rows holding just what ?fields= needs."""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context,
+                   executemany):
+            # the select list of each query, on one line
+            statements.append(' '.join(statement.split()).split(' FROM ')[0])
+        with self.app.app_context():
+            for name in ('Keroro Shop', 'Maziwa Shop'):
+                db.session.add(Business(name=name, category='shop',
+                                        description='x', location='Near TRM'))
+            db.session.add(Review(rating=4, body='Fine', name='fan',
+                                  business_id=1))
+            db.session.commit()
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute', record)
+        for url in ('/api/v2/businesses/?fields=name,location',
+                    '/api/v2/businesses/?after=&fields=name,location',
+                    '/api/v2/businesses/search?q=shop&fields=name,location'):
+            del statements[:]
+            self.response = self.client.get(url)
+            self.assertEqual(self.response.status_code, 200)
+            for business in json.loads(self.response.data)['businesses']:
+                self.assertEqual(sorted(business), ['location', 'name'])
+            selected = [statement for statement in statements
+                        if 'business.name' in statement]
+            self.assertEqual(len(selected), 1, url)
+            self.assertNotIn('business.description', selected[0])
+            self.assertNotIn('business.rating_sum', selected[0])
+        del statements[:]
+        self.response = self.client.get(
+            '/api/v2/businesses/1/reviews?fields=rating')
+        self.assertEqual(json.loads(self.response.data)['reviews'],
+                         [{'rating': 4}])
+        selected = [statement for statement in statements
+                    if 'review.rating' in statement]
+        self.assertEqual(len(selected), 1)
+        self.assertNotIn('review.body', selected[0])
+        self.assertNotIn('review.review_owner', selected[0])
+
     def test_search_businesses(self):
         """Retrieve a list of registered businesses through search."""
         self.client.post('/api/v2/auth/register',
@@ -344,6 +617,240 @@ class BusinessRoutesTestCase(unittest.TestCase):
         self.assertEqual(self.response.status_code, 200)
         self.assertEqual(len(json.loads(self.response.data)['businesses']), 1)
 
+    def test_search_businesses_by_word_prefix(self):
+        """Search matches word prefixes and follows business edits."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.test_bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.response = self.client.get('/api/v2/businesses/search?q=kero')
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(len(json.loads(self.response.data)['businesses']), 1)
+        self.client.put('/api/v2/businesses/1',
+                        data=json.dumps(self.test_update_bs),
+                        headers={
+                            'content-type': 'application/json',
+                            'x-access-token': self.token
+                        })
+        self.response = self.client.get('/api/v2/businesses/search?q=kero')
+        self.assertEqual(self.response.status_code, 400)
+        self.assertIn("No businesses match this search",
+                      str(self.response.data))
+        self.response = self.client.get(
+            '/api/v2/businesses/search?q=updated&category=super')
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(len(json.loads(self.response.data)['businesses']), 1)
+
+    def test_cached_business_is_revalidated_and_invalidated(self):
+        """Cached responses carry an ETag and are dropped on updates."""
+        self.client = cached_app.test_client()
+        self.addCleanup(response_cache.clear)
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.test_bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.response = self.client.get('/api/v2/businesses/1')
+        etag = self.response.headers['ETag']
+        self.response = self.client.get('/api/v2/businesses/1',
+                                        headers={'If-None-Match': etag})
+        self.assertEqual(self.response.status_code, 304)
+        self.client.put('/api/v2/businesses/1',
+                        data=json.dumps(self.test_update_bs),
+                        headers={
+                            'content-type': 'application/json',
+                            'x-access-token': self.token
+                        })
+        self.response = self.client.get('/api/v2/businesses/1',
+                                        headers={'If-None-Match': etag})
+        self.assertEqual(self.response.status_code, 200)
+        self.assertIn("Ultimate value for money", str(self.response.data))
+
+    def test_invalidation_by_another_process_reaches_this_one(self):
+        """Tag versions are shared, so workers see them within their TTL."""
+        self.client = cached_app.test_client()
+        self.addCleanup(response_cache.clear)
+        self.addCleanup(setattr, response_cache, 'tags', response_cache.tags)
+        response_cache.tags = DatabaseTags(ttl=0.2)
+        with self.app.app_context():
+            for name in ('Keroro Shop', 'Added Elsewhere'):
+                db.session.add(Business(name=name, category='shop',
+                                        description='x', location='y'))
+                db.session.commit()
+                self.response = self.client.get('/api/v2/businesses/')
+        # the second business was added behind the cache's back
+        self.assertNotIn('Added Elsewhere', str(self.response.data))
+        # what manage.py or another worker does after its own write
+        other = ResponseCache(tags=DatabaseTags())
+        with self.app.app_context():
+            other.invalidate('businesses')
+        self.response = self.client.get('/api/v2/businesses/')
+        self.assertNotIn('Added Elsewhere', str(self.response.data))
+        time.sleep(0.25)  # this worker's copy of the version expires
+        self.response = self.client.get('/api/v2/businesses/')
+        self.assertIn('Added Elsewhere', str(self.response.data))
+
+    def test_cached_reads_never_write_and_304s_run_no_query(self):
+        """Only invalidations write tag versions; hits need no database."""
+        self.client = cached_app.test_client()
+        self.addCleanup(response_cache.clear)
+        self.addCleanup(setattr, response_cache, 'tags', response_cache.tags)
+        response_cache.tags = DatabaseTags(ttl=60)
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        with self.app.app_context():
+            db.session.add(Business(name='Keroro Shop', category='shop',
+                                    description='x', location='y'))
+            db.session.commit()
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            self.response = self.client.get('/api/v2/businesses/1')
+            self.assertEqual(self.response.status_code, 200)
+            self.assertFalse([statement for statement in statements
+                              if 'cache_tag' in statement and
+                              not statement.startswith('SELECT')])
+            del statements[:]
+            self.response = self.client.get(
+                '/api/v2/businesses/1',
+                headers={'If-None-Match': self.response.headers['ETag']})
+            self.assertEqual(self.response.status_code, 304)
+            self.assertEqual(statements, [])
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+
+    def test_export_businesses(self):
+        """Export the businesses as NDJSON and as gzipped CSV."""
+        self.app.config['ADMIN_TOKEN'] = 'test-admin-token'
+        self.addCleanup(self.app.config.pop, 'ADMIN_TOKEN')
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.test_bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.response = self.client.get('/api/v2/export/businesses')
+        self.assertEqual(self.response.status_code, 403)
+        self.response = self.client.get(
+            '/api/v2/export/businesses?reviews=1',
+            headers={'x-admin-token': 'test-admin-token'})
+        self.assertEqual(self.response.status_code, 200)
+        record = json.loads(self.response.data.decode('utf-8'))
+        self.assertEqual(record['name'], 'Keroro Shop')
+        self.assertEqual(record['reviews'], [])
+        self.response = self.client.get(
+            '/api/v2/export/businesses?format=csv&gzip=1',
+            headers={'x-admin-token': 'test-admin-token'})
+        lines = gzip.decompress(self.response.data).decode(
+            'utf-8').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Keroro Shop', lines[1])
+
+    def test_retrieve_nearby_businesses(self):
+        """Businesses within the radius come back nearest first."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        for bs, point in ((self.test_bs, (-1.2921, 36.8219)),
+                          (self.another_test_bs, (-1.2833, 36.8167)),
+                          (self.test_update_bs, None)):
+            if point:
+                bs = dict(bs, latitude=point[0], longitude=point[1])
+            self.client.post('/api/v2/businesses',
+                             data=json.dumps(bs),
+                             headers={
+                                 'content-type': 'application/json',
+                                 'x-access-token': self.token
+                             })
+        self.response = self.client.get(
+            '/api/v2/businesses/nearby?lat=-1.2920&lng=36.8220&radius=2')
+        self.assertEqual(self.response.status_code, 200)
+        businesses = json.loads(self.response.data)['businesses']
+        self.assertEqual([business['name'] for business in businesses],
+                         ['Keroro Shop', 'Maziwa Butchery'])
+        self.assertLess(businesses[0]['distance_km'], 0.1)
+        self.response = self.client.get(
+            '/api/v2/businesses/nearby?lat=-1.2920&lng=36.8220&radius=0.5')
+        self.assertEqual(
+            len(json.loads(self.response.data)['businesses']), 1)
+        self.response = self.client.get(
+            '/api/v2/businesses/nearby?lat=-4.04&lng=39.67')
+        self.assertEqual(self.response.status_code, 400)
+        self.response = self.client.get('/api/v2/businesses/nearby?lat=91')
+        self.assertEqual(self.response.status_code, 400)
+
+    def test_register_business_with_half_a_location(self):
+        """Coordinates are validated and must come in pairs."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        for extra, error in (({'latitude': -1.29}, 'Provide both'),
+                             ({'latitude': 'x', 'longitude': 36.8},
+                              'Latitude must be a number')):
+            self.response = self.client.post(
+                '/api/v2/businesses', data=json.dumps(dict(self.test_bs,
+                                                           **extra)),
+                headers={
+                    'content-type': 'application/json',
+                    'x-access-token': self.token
+                })
+            self.assertEqual(self.response.status_code, 400)
+            self.assertIn(error, str(self.response.data))
+
     def tearDown(self):
         """Tear down all initialized variables."""
         with self.app.app_context():
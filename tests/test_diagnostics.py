@@ -0,0 +1,78 @@
+"""Contain tests for the diagnostics routes."""
+from flask import json
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+# local imports
+from api.models import db
+from api.routes.diagnostics import pool_stats
+from run import app
+
+
+class DiagnosticsTestCase(unittest.TestCase):
+    """This class represents the diagnostics test case."""
+
+    def setUp(self):
+        """Set the admin token."""
+        self.app = app
+        self.client = self.app.test_client()
+        self.admin = {'x-admin-token': 'secret'}
+        self.app.config['ADMIN_TOKEN'] = 'secret'
+        self.addCleanup(self.app.config.pop, 'ADMIN_TOKEN')
+        with self.app.app_context():
+            db.create_all()
+
+    def test_pool_status_is_served(self):
+        """Admins see the pool of every database and its options."""
+        self.response = self.client.get('/api/v2/diagnostics/pool',
+                                        headers=self.admin)
+        self.assertEqual(self.response.status_code, 200)
+        message = json.loads(self.response.data)
+        default = message['engines']['default']
+        self.assertEqual(default['pool'],
+                         type(db.get_engine(self.app).pool).__name__)
+        self.assertIn('status', default)
+        self.assertNotIn('connect_args', message['options'])
+
+    def test_pool_status_is_admin_only(self):
+        """Callers without the right admin token are refused."""
+        self.response = self.client.get('/api/v2/diagnostics/pool')
+        self.assertEqual(self.response.status_code, 403)
+        self.response = self.client.get('/api/v2/diagnostics/pool',
+                                        headers={'x-admin-token': 'wrong'})
+        self.assertEqual(self.response.status_code, 403)
+        self.assertIn('Admin token is missing or incorrect',
+                      str(self.response.data))
+
+    def test_pool_stats_count_checkouts(self):
+        """A queue pool reports the connections checked out of it."""
+        engine = create_engine('sqlite://', poolclass=QueuePool,
+                               pool_size=2, max_overflow=1)
+        self.addCleanup(engine.dispose)
+        with engine.connect():
+            stats = pool_stats(engine)
+        self.assertEqual(stats['pool'], 'QueuePool')
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['checkedout'], 1)
+        self.assertEqual(pool_stats(engine)['checkedout'], 0)
+
+    def test_subsystems_left_off_say_how_to_enable_them(self):
+        """The testing app loads neither the rate limiter nor the profiler."""
+        for path, setting in (('ratelimit', 'RATELIMIT_ENABLED=1'),
+                              ('profiler', 'PROFILER_ENABLED=1'),
+                              ('profiles', 'PROFILER_ENABLED=1')):
+            self.response = self.client.get(
+                '/api/v2/diagnostics/' + path, headers=self.admin)
+            self.assertEqual(self.response.status_code, 404)
+            self.assertIn(setting, str(self.response.data))
+
+    def tearDown(self):
+        """Drop all tables."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
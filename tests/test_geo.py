@@ -0,0 +1,46 @@
+"""Contain tests for the grid cells and distances of the nearby search."""
+import math
+import random
+import unittest
+# local imports
+from api import geo
+
+
+class GeoTestCase(unittest.TestCase):
+    """This class represents the geo test case."""
+
+    def test_cell_ranges_cover_the_circle(self):
+        """Every point within the radius falls in one of the ranges."""
+        rng = random.Random(0)
+        for _ in range(300):
+            latitude, longitude = rng.uniform(-89, 89), rng.uniform(-180, 180)
+            radius = rng.choice([0.1, 2, 50, 500])
+            ranges = geo.cell_ranges(latitude, longitude, radius)
+            self.assertLessEqual(len(ranges), geo.MAX_CELLS)
+            for _ in range(10):
+                # a random point at most radius km away
+                angle = rng.uniform(0, 2 * math.pi)
+                arc = radius * rng.random() / geo.EARTH_RADIUS_KM
+                lat1 = math.radians(latitude)
+                lat2 = math.asin(math.sin(lat1) * math.cos(arc) +
+                                 math.cos(lat1) * math.sin(arc) *
+                                 math.cos(angle))
+                lng2 = math.radians(longitude) + math.atan2(
+                    math.sin(angle) * math.sin(arc) * math.cos(lat1),
+                    math.cos(arc) - math.sin(lat1) * math.sin(lat2))
+                cell = geo.cell(math.degrees(lat2),
+                                (math.degrees(lng2) + 540) % 360 - 180)
+                self.assertTrue(any(low <= cell <= high
+                                    for low, high in ranges))
+
+    def test_nearest_points_first(self):
+        """Points are kept within the radius and sorted by distance."""
+        points = [(1, -1.30, 36.82), (2, -1.29, 36.82), (3, -1.50, 36.82)]
+        found = geo.nearest(-1.29, 36.82, 5, points, 10)
+        self.assertEqual([business_id for _, business_id in found], [2, 1])
+        self.assertAlmostEqual(found[1][0], 1.112, places=2)
+        self.assertEqual(len(geo.nearest(-1.29, 36.82, 5, points, 1)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Contain tests for the request and SQL metrics."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.exc import OperationalError
+# local imports
+from api import metrics as metrics_module
+from api.metrics import metrics
+from api.models import db
+from run import app
+
+
+class MetricsTestCase(unittest.TestCase):
+    """This class represents the metrics test case."""
+
+    def setUp(self):
+        """Start from empty metrics."""
+        self.app = app
+        self.client = self.app.test_client()
+        self.admin_token = self.app.config.get('ADMIN_TOKEN')
+        self.app.config['ADMIN_TOKEN'] = 'admin-secret'
+        self.headers = {'Authorization': 'Bearer admin-secret'}
+        with self.app.app_context():
+            db.create_all()
+        metrics.reset()
+
+    def test_requests_and_queries_are_counted(self):
+        """A listing shows up with its status and SQL statements."""
+        self.client.get('/api/v2/businesses/')
+        self.response = self.client.get('/metrics', headers=self.headers)
+        self.assertEqual(self.response.status_code, 200)
+        text = self.response.data.decode('utf-8')
+        self.assertIn('http_requests_total{route="/api/v2/businesses/",'
+                      'method="GET",status="400"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{'
+                      'route="/api/v2/businesses/",method="GET"} 1', text)
+        self.assertRegex(text, r'db_queries_total\{route="/api/v2/businesses'
+                               r'/",method="GET"\} [1-9]')
+
+    def test_query_storms_are_flagged(self):
+        """Requests over the query threshold are counted as storms."""
+        threshold = metrics.query_threshold
+        metrics.query_threshold = 0
+        try:
+            with self.assertLogs('api.metrics', 'WARNING'):
+                self.client.get('/api/v2/businesses/')
+        finally:
+            metrics.query_threshold = threshold
+        self.assertIn('db_query_storms_total{route="/api/v2/businesses/",'
+                      'method="GET"} 1', metrics.render())
+
+    def test_metrics_need_the_admin_token(self):
+        """Scrapes without the admin token are refused."""
+        self.response = self.client.get('/metrics')
+        self.assertEqual(self.response.status_code, 403)
+        self.response = self.client.get(
+            '/metrics', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(self.response.status_code, 403)
+        self.response = self.client.get(
+            '/metrics', headers={'x-admin-token': 'admin-secret'})
+        self.assertEqual(self.response.status_code, 200)
+
+    def test_failed_statements_are_unstacked(self):
+        """A statement that fails does not leave its start time behind."""
+        metrics_module._local.sql = sql = [0, 0.0]
+        try:
+            with self.app.app_context():
+                with db.engine.connect() as conn:
+                    with self.assertRaises(OperationalError):
+                        conn.execute('SELECT * FROM no_such_table')
+                    self.assertEqual(conn.info['metrics_started'], [])
+        finally:
+            metrics_module._local.sql = None
+        self.assertEqual(sql[0], 1)
+
+    def test_workers_are_summed(self):
+        """Figures written by every worker are served added up."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(setattr, metrics, 'directory', None)
+        metrics.directory = directory
+        self.client.get('/api/v2/businesses/')
+        # another worker of the same server served the same route twice
+        with open(os.path.join(directory, 'metrics-1.prom'), 'w') as other:
+            other.write(
+                '# HELP http_requests_total Responses by status.\n'
+                '# TYPE http_requests_total counter\n'
+                'http_requests_total{route="/api/v2/businesses/",'
+                'method="GET",status="400"} 2\n')
+        text = self.client.get('/metrics',
+                               headers=self.headers).data.decode('utf-8')
+        self.assertIn('http_requests_total{route="/api/v2/businesses/",'
+                      'method="GET",status="400"} 3', text)
+        self.assertEqual(text.count('# HELP http_requests_total'), 1)
+        self.assertIn('db_queries_total', text)
+
+    def tearDown(self):
+        """Drop all tables."""
+        self.app.config['ADMIN_TOKEN'] = self.admin_token
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
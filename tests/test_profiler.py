@@ -0,0 +1,81 @@
+"""Contain tests for the request profiler."""
+from flask import json
+import unittest
+# local imports
+from api import create_app
+from api.models import db
+from api.profiler import profiler
+
+app = create_app('testing', PROFILER_ENABLED=True)
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """This class represents the profiler test case."""
+
+    def setUp(self):
+        """Keep a profile of every request."""
+        self.app = app
+        self.client = self.app.test_client()
+        self.admin = {'x-admin-token': 'secret'}
+        self.app.config['ADMIN_TOKEN'] = 'secret'
+        self.addCleanup(self.app.config.pop, 'ADMIN_TOKEN')
+        self.settings = profiler.settings()
+        profiler.profiles.clear()
+        profiler.configure(enabled=True, sample_rate=1.0)
+        with self.app.app_context():
+            db.create_all()
+
+    def test_profiles_are_kept_and_served(self):
+        """A sampled request is listed and served as collapsed stacks."""
+        self.client.get('/api/v2/businesses/search?q=shop')
+        self.response = self.client.get('/api/v2/diagnostics/profiles',
+                                        headers=self.admin)
+        self.assertEqual(self.response.status_code, 200)
+        profiles = json.loads(self.response.data)['profiles']
+        self.assertEqual(profiles[0]['path'],
+                         '/api/v2/businesses/search?q=shop')
+        self.assertEqual(profiles[0]['reason'], 'sampled')
+        self.response = self.client.get(
+            '/api/v2/diagnostics/profiles/collapsed?id={}'.format(
+                profiles[0]['id']), headers=self.admin)
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(self.response.mimetype, 'text/plain')
+
+    def test_profiler_can_be_reconfigured_at_runtime(self):
+        """Admins change the settings without restarting the worker."""
+        self.response = self.client.put(
+            '/api/v2/diagnostics/profiler',
+            data=json.dumps({'sample_rate': 0, 'slow_threshold': 2}),
+            headers=dict(self.admin, **{'content-type': 'application/json'}))
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(json.loads(self.response.data)['slow_threshold'], 2)
+        # the PUT itself was picked under the old sample rate
+        profiler.profiles.clear()
+        self.client.get('/api/v2/businesses/')
+        self.assertEqual(len(profiler.profiles), 0)
+
+    def test_sampler_stops_when_disabled(self):
+        """Turning the profiler off joins its sampling thread."""
+        self.client.get('/api/v2/businesses/')
+        sampler = profiler._thread
+        self.assertTrue(sampler.is_alive())
+        profiler.configure(enabled=False)
+        self.assertFalse(sampler.is_alive())
+        self.assertIsNone(profiler._thread)
+        profiler.configure(enabled=True)
+        self.client.get('/api/v2/businesses/')
+        self.assertTrue(profiler._thread.is_alive())
+        self.assertIsNot(profiler._thread, sampler)
+
+    def test_profiles_are_admin_only(self):
+        """Callers without the admin token are refused."""
+        self.response = self.client.get('/api/v2/diagnostics/profiles')
+        self.assertEqual(self.response.status_code, 403)
+
+    def tearDown(self):
+        """Put the profiler back the way the app configured it."""
+        profiler.configure(**self.settings)
+        profiler.profiles.clear()
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,65 @@
+"""Contain checks that the hot route queries use indexes."""
+import re
+import unittest
+# local imports
+from api.models import db, Business, Review, User
+from run import app
+from api.search import search_businesses
+
+# SQLite reports full table reads as "SCAN <table>" ("SCAN TABLE" before 3.36)
+SQLITE_SCAN = re.compile(r'^SCAN (TABLE )?(?P<table>\w+)(?! USING)')
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """This class checks no hot query falls back to a sequential scan."""
+
+    def setUp(self):
+        """Create the tables so the planner sees the indexes."""
+        self.app = app
+        with self.app.app_context():
+            db.create_all()
+
+    def hot_queries(self):
+        """Return the queries the read and write routes run per request."""
+        return {
+            'user by username': User.query.filter_by(username='test1'),
+            'user by email': User.query.filter_by(email='t@testing.com'),
+            'business by id': Business.query.filter_by(id=1),
+            'businesses by owner': Business.query.filter_by(
+                business_owner='test1'),
+            'businesses by category and location': Business.query.filter_by(
+                category='shop', location='Near TRM'),
+            'business search': search_businesses('keroro', 'near', 'shop'),
+            'reviews of a business': Review.query.filter_by(
+                business_id=1).order_by(Review.date_created.desc(),
+                                        Review.id.desc()).limit(21),
+            'reviews by owner': Review.query.filter_by(review_owner='test1'),
+        }
+
+    def explain(self, query):
+        """Return the plan lines of a query on the test database."""
+        engine = db.engine
+        sql = str(query.statement.compile(
+            dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+        if engine.dialect.name == 'sqlite':
+            rows = db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql))
+            return [row[-1] for row in rows]
+        # make any sequential scan show up even on tiny test tables
+        db.session.execute(db.text('SET enable_seqscan = off'))
+        return [row[0] for row in db.session.execute(
+            db.text('EXPLAIN ' + sql))]
+
+    def test_hot_queries_use_indexes(self):
+        """Every hot query is answered through an index."""
+        with self.app.app_context():
+            for name, query in self.hot_queries().items():
+                plan = self.explain(query)
+                scans = [line for line in plan if 'Seq Scan' in line or
+                         SQLITE_SCAN.match(line.strip())]
+                self.assertEqual(scans, [], '{} scans: {}'.format(name, plan))
+
+    def tearDown(self):
+        """Tear down all initialized variables."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
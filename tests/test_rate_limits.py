@@ -0,0 +1,90 @@
+"""Contain tests for the per user and per IP rate limits."""
+import unittest
+from werkzeug.middleware.proxy_fix import ProxyFix
+# local imports
+from api import create_app
+from api.models import db
+from api.ratelimit import LocalBuckets, rate_limiter
+
+app = create_app('testing', RATELIMIT_ENABLED=True)
+
+
+class RateLimitTestCase(unittest.TestCase):
+    """This class represents the rate limit test case."""
+
+    def setUp(self):
+        """Allow two searches at once and no refill."""
+        self.app = app
+        self.client = self.app.test_client()
+        self.limits = rate_limiter.limits
+        rate_limiter.limits = dict(self.limits, search=(0.001, 2))
+        rate_limiter.backend = LocalBuckets()
+        rate_limiter.rejected.clear()
+        with self.app.app_context():
+            db.create_all()
+
+    def test_bursts_beyond_the_limit_get_429(self):
+        """The third search in a row is turned away with Retry-After."""
+        for _ in range(2):
+            self.response = self.client.get('/api/v2/businesses/search')
+            self.assertNotEqual(self.response.status_code, 429)
+        self.response = self.client.get('/api/v2/businesses/search')
+        self.assertEqual(self.response.status_code, 429)
+        self.assertGreater(int(self.response.headers['Retry-After']), 0)
+        self.assertEqual(rate_limiter.stats()['rejected'], {'search': 1})
+
+    def test_clients_have_separate_buckets(self):
+        """Another client IP still gets through."""
+        for _ in range(3):
+            self.client.get('/api/v2/businesses/search')
+        self.response = self.client.get(
+            '/api/v2/businesses/search',
+            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertNotEqual(self.response.status_code, 429)
+
+    def test_buckets_refill(self):
+        """A drained bucket admits again once a token has refilled."""
+        buckets = LocalBuckets()
+        self.assertEqual(buckets.consume('k', 1, 1, 100.0), 0)
+        self.assertAlmostEqual(buckets.consume('k', 1, 1, 100.5), 0.5)
+        self.assertEqual(buckets.consume('k', 1, 1, 101.5), 0)
+
+    def test_clients_behind_a_proxy_have_separate_buckets(self):
+        """The forwarded client IP keys the bucket, not the proxy's."""
+        wsgi_app = self.app.wsgi_app
+        self.app.wsgi_app = ProxyFix(wsgi_app, x_for=1)
+        try:
+            for _ in range(3):
+                self.client.get('/api/v2/businesses/search',
+                                headers={'X-Forwarded-For': '10.0.0.2'})
+            self.response = self.client.get(
+                '/api/v2/businesses/search',
+                headers={'X-Forwarded-For': '10.0.0.3'})
+            self.assertNotEqual(self.response.status_code, 429)
+            self.response = self.client.get(
+                '/api/v2/businesses/search',
+                headers={'X-Forwarded-For': '10.0.0.3, 10.0.0.2'})
+            self.assertEqual(self.response.status_code, 429)
+        finally:
+            self.app.wsgi_app = wsgi_app
+
+    def test_full_buckets_evict_the_least_recently_used(self):
+        """Making room keeps the buckets still being spent."""
+        buckets = LocalBuckets(max_keys=10)
+        for i in range(10):
+            buckets.consume(i, 0.01, 5, 100.0 + i)
+        buckets.consume(0, 0.01, 5, 110.0)
+        buckets.consume('new', 0.01, 5, 110.0)
+        self.assertNotIn(1, buckets._buckets)
+        self.assertIn(0, buckets._buckets)
+        self.assertIn(9, buckets._buckets)
+        self.assertEqual(len(buckets._buckets), 10)
+
+    def tearDown(self):
+        """Put the limiter back the way the app configured it."""
+        rate_limiter.enabled = self.app.config['RATELIMIT_ENABLED']
+        rate_limiter.limits = self.limits
+        rate_limiter.backend = LocalBuckets()
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,145 @@
+"""Contain tests for routing reads to replicas."""
+import os
+import tempfile
+import time
+import unittest
+from flask import json
+# local imports
+from api.models import Business, db
+from api.routing import PRIMARY_COOKIE, read_bind, replicas
+from run import app
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class represents the replica routing test case."""
+
+    def setUp(self):
+        """Pretend one replica is configured."""
+        self.app = app
+        self.binds = replicas.binds
+        self.check_interval = replicas.check_interval
+        replicas.binds = ['replica_0']
+        replicas.check_interval = 0
+
+    def test_reads_go_to_a_replica(self):
+        """A GET request reads from the replica."""
+        with self.app.test_request_context('/api/v2/businesses/'):
+            self.assertEqual(read_bind(), 'replica_0')
+
+    def test_writes_go_to_the_primary(self):
+        """A POST request stays on the primary."""
+        with self.app.test_request_context('/api/v2/businesses',
+                                           method='POST'):
+            self.assertIsNone(read_bind())
+
+    def test_clients_can_ask_for_the_primary(self):
+        """The X-Read-Primary header pins a read to the primary."""
+        with self.app.test_request_context(
+                '/api/v2/businesses/', headers={'X-Read-Primary': '1'}):
+            self.assertIsNone(read_bind())
+
+    def test_recent_writers_read_from_the_primary(self):
+        """The cookie set after a write keeps reads on the primary."""
+        cookie = '{}={}'.format(PRIMARY_COOKIE, time.time() + 5)
+        with self.app.test_request_context(
+                '/api/v2/businesses/', headers={'Cookie': cookie}):
+            self.assertIsNone(read_bind())
+
+    def test_unhealthy_replicas_are_skipped(self):
+        """A replica marked down is not read from."""
+        replicas.mark_down('replica_0')
+        with self.app.test_request_context('/api/v2/businesses/'):
+            self.assertIsNone(read_bind())
+
+    def test_checks_run_in_a_background_thread(self):
+        """Replicas are checked off the request path and can be stopped."""
+        replicas.check_interval = 60
+        try:
+            with self.app.test_request_context('/api/v2/businesses/'):
+                read_bind()
+            checker = replicas._checker
+            self.assertTrue(checker.is_alive())
+        finally:
+            replicas.stop()
+        self.assertFalse(checker.is_alive())
+
+    def tearDown(self):
+        """Restore the replica settings."""
+        replicas.stop()
+        replicas.binds = self.binds
+        replicas.check_interval = self.check_interval
+        replicas._down_until.clear()
+
+
+class ReplicaDatabaseTestCase(unittest.TestCase):
+    """Route against a second SQLite file standing in for a replica."""
+
+    def setUp(self):
+        """Give the app a replica holding different rows."""
+        self.app = app
+        self.client = self.app.test_client()
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app_binds = self.app.config.get('SQLALCHEMY_BINDS')
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            'replica_0': 'sqlite:///' + self.path}
+        self.binds = replicas.binds
+        self.check_interval = replicas.check_interval
+        replicas.binds = ['replica_0']
+        replicas.check_interval = 0
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(Business(name='Primary Shop', category='shop',
+                                    description='x', location='y'))
+            db.session.commit()
+            self.replica = db.get_engine(self.app, 'replica_0')
+            db.metadata.create_all(self.replica)
+            self.replica.execute(Business.__table__.insert(), {
+                'name': 'Replica Shop', 'category': 'shop',
+                'description': 'x', 'location': 'y'})
+
+    def names(self):
+        response = self.client.get('/api/v2/businesses/')
+        return [business['name'] for business in
+                json.loads(response.data)['businesses']]
+
+    def test_reads_come_from_the_replica_file(self):
+        """GET requests read the replica, unless asked for the primary."""
+        self.assertEqual(self.names(), ['Replica Shop'])
+        response = self.client.get('/api/v2/businesses/',
+                                   headers={'X-Read-Primary': '1'})
+        self.assertIn('Primary Shop', str(response.data))
+
+    def test_writes_and_flushed_sessions_use_the_primary(self):
+        """Writes land on the primary, as do reads after a flush."""
+        with self.app.test_request_context('/api/v2/businesses/'):
+            self.assertEqual(Business.query.count(), 1)
+            db.session.add(Business(name='Flushed Shop', category='shop',
+                                    description='x', location='y'))
+            db.session.flush()
+            self.assertEqual(
+                sorted(business.name for business in Business.query),
+                ['Flushed Shop', 'Primary Shop'])
+            db.session.commit()
+            db.session.remove()
+        self.assertEqual(self.replica.execute(
+            'SELECT name FROM business').fetchall(), [('Replica Shop',)])
+        with self.app.app_context():
+            primary = db.get_engine(self.app)
+            self.assertEqual(
+                sorted(name for name, in primary.execute(
+                    'SELECT name FROM business')),
+                ['Flushed Shop', 'Primary Shop'])
+
+    def tearDown(self):
+        """Drop the replica and restore the settings."""
+        replicas.binds = self.binds
+        replicas.check_interval = self.check_interval
+        replicas._down_until.clear()
+        self.replica.dispose()
+        self.app.extensions['sqlalchemy'].connectors.pop('replica_0', None)
+        self.app.config['SQLALCHEMY_BINDS'] = self.app_binds
+        os.remove(self.path)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
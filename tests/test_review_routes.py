@@ -1,9 +1,11 @@
 """Contain tests for the user endpoints."""
 from flask import json
 import unittest
+from sqlalchemy import event
 # local imports
-from api.models import db
-from api.routes import app
+from api.ingest import ingest_reviews
+from api.models import Business, User, db
+from run import app
 
 
 class ReviewRoutesTestCase(unittest.TestCase):
@@ -200,6 +202,206 @@ class ReviewRoutesTestCase(unittest.TestCase):
         self.assertEqual(self.response.status_code, 200)
         self.assertEqual(len(json.loads(self.response.data)['reviews']), 2)
 
+    def test_retrieve_reviews_by_page_and_as_a_stream(self):
+        """Page through reviews with a cursor, then stream them."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.another_user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.another_login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        for body in ("First visit", "Second visit"):
+            self.client.post('/api/v2/businesses/1/reviews',
+                             data=json.dumps({"rating": 4, "body": body}),
+                             headers={
+                                 'content-type': 'application/json',
+                                 'x-access-token': self.token
+                             })
+        self.response = self.client.get('/api/v2/businesses/1/reviews?limit=1')
+        page = json.loads(self.response.data)
+        self.assertEqual(page['reviews'][0]['body'], "Second visit")
+        self.response = self.client.get(
+            '/api/v2/businesses/1/reviews?limit=1&after=' +
+            page['next_cursor'])
+        page = json.loads(self.response.data)
+        self.assertEqual(page['reviews'][0]['body'], "First visit")
+        self.assertIsNone(page['next_cursor'])
+        self.response = self.client.get(
+            '/api/v2/businesses/1/reviews?format=ndjson')
+        self.assertEqual(self.response.status_code, 200)
+        lines = self.response.data.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['body'] for line in lines],
+                         ["Second visit", "First visit"])
+
+    def test_create_reviews_in_a_batch(self):
+        """Valid batch reviews are created, own business reviews are not."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.another_user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.another_login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.another_bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        batch = {"reviews": [
+            {"business_id": 1, "rating": 5, "body": "Great"},
+            {"business_id": 1, "rating": 3, "body": "Fine"},
+            {"business_id": 2, "rating": 5, "body": "My own shop"},
+            {"business_id": 1, "rating": 9, "body": "Too good"}]}
+        self.response = self.client.post('/api/v2/reviews/batch',
+                                         data=json.dumps(batch),
+                                         headers={
+                                             'content-type':
+                                             'application/json',
+                                             'x-access-token': self.token
+                                         })
+        self.assertEqual(self.response.status_code, 201)
+        report = json.loads(self.response.data)
+        self.assertEqual(report['inserted'], 2)
+        self.assertEqual([error['index'] for error in report['errors']],
+                         [3, 2])
+        self.assertIn("Reviewing own business not allowed",
+                      str(self.response.data))
+        self.response = self.client.get('/api/v2/businesses/1')
+        rating = json.loads(self.response.data)['details']['rating']
+        self.assertEqual(rating['count'], 2)
+        self.assertEqual(rating['average'], 4)
+
+    def test_ingest_updates_every_rating_in_one_statement(self):
+        """A chunk folds its ratings into all its businesses at once."""
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        with self.app.app_context():
+            db.session.add_all(
+                [User(name='owner', username='owner', email='o@x.com',
+                      password='x'),
+                 User(name='fan', username='fan', email='f@x.com',
+                      password='x')] +
+                [Business(name='Shop {}'.format(i), category='shop',
+                          description='x', location='y',
+                          business_owner='owner') for i in range(3)])
+            db.session.commit()
+            rows = [{'business_id': 1 + i % 3, 'rating': 1 + i % 5,
+                     'body': 'Visit {}'.format(i), 'review_owner': 'fan'}
+                    for i in range(30)]
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                report = ingest_reviews(rows, chunk_size=15)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            self.assertEqual(report.inserted, 30)
+            updates = [statement for statement in statements
+                       if statement.startswith('UPDATE business')]
+            self.assertEqual(len(updates), 2)  # one per chunk
+            for business in Business.query.all():
+                ratings = [1 + i % 5 for i in range(30)
+                           if 1 + i % 3 == business.id]
+                self.assertEqual(business.review_count, 10)
+                self.assertEqual(business.rating_sum, sum(ratings))
+                self.assertEqual(business.rating_average, sum(ratings) / 10)
+                self.assertEqual(
+                    [business.rating_1, business.rating_2, business.rating_3,
+                     business.rating_4, business.rating_5],
+                    [ratings.count(stars) for stars in range(1, 6)])
+
+    def test_reviews_update_the_business_rating(self):
+        """Adding reviews keeps the rating aggregates of a business."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.client.post('/api/v2/businesses',
+                         data=json.dumps(self.bs),
+                         headers={
+                             'content-type': 'application/json',
+                             'x-access-token': self.token
+                         })
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.another_user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.another_login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        for rating in (4, 5):
+            self.client.post('/api/v2/businesses/1/reviews',
+                             data=json.dumps({"rating": rating,
+                                              "body": "Good place"}),
+                             headers={
+                                 'content-type': 'application/json',
+                                 'x-access-token': self.token
+                             })
+        self.response = self.client.get('/api/v2/businesses/1')
+        rating = json.loads(self.response.data)['details']['rating']
+        self.assertEqual(rating['count'], 2)
+        self.assertEqual(rating['average'], 4.5)
+        self.assertEqual(rating['histogram']['4'], 1)
+        self.response = self.client.get(
+            '/api/v2/businesses/search?sort=rating&min_rating=4')
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(len(json.loads(self.response.data)['businesses']), 1)
+
     def tearDown(self):
         """Tear down all initialized variables."""
         with self.app.app_context():
@@ -0,0 +1,68 @@
+"""Contain tests for the synthetic dataset generator."""
+import unittest
+# local imports
+from api.models import Business, BusinessTerm, Review, User, db
+from run import app
+from api.seed import generate_reviews, seed_database
+
+
+class SeedTestCase(unittest.TestCase):
+    """This class represents the seed test case."""
+
+    def setUp(self):
+        """Seed a small dataset."""
+        self.app = app
+        with self.app.app_context():
+            db.create_all()
+            self.report = seed_database(
+                self.app.config['SQLALCHEMY_DATABASE_URI'], 5, 20, 200,
+                seed=7, chunk_size=8, log=lambda line: None)
+
+    def test_rows_are_written(self):
+        """Every requested row is written and indexed for search."""
+        self.assertEqual(self.report['user']['rows'], 5)
+        self.assertEqual(self.report['review']['rows'], 200)
+        with self.app.app_context():
+            self.assertEqual(User.query.count(), 5)
+            self.assertEqual(Business.query.count(), 20)
+            self.assertEqual(Review.query.count(), 200)
+            self.assertTrue(BusinessTerm.query.count())
+            self.assertFalse(Review.query.join(Business).filter(
+                Review.review_owner == Business.business_owner).count())
+
+    def test_ratings_are_aggregated(self):
+        """The rating aggregates match the reviews written."""
+        with self.app.app_context():
+            for business in Business.query:
+                ratings = [review.rating for review in
+                           Review.query.filter_by(business_id=business.id)]
+                self.assertEqual(business.review_count, len(ratings))
+                self.assertEqual(business.rating_sum, sum(ratings))
+                self.assertEqual(business.rating_5, ratings.count(5))
+
+    def test_seeded_users_can_log_in(self):
+        """Seeded users share one known password."""
+        response = self.app.test_client().post(
+            '/api/v2/auth/login', content_type='application/json',
+            data='{"username": "sd1", "password": "seed$pass1"}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_same_seed_same_data(self):
+        """Generation only depends on the seed and the chunk."""
+        plan = {'seed': 7, 'zipf': 1.0, 'users': (1, 5),
+                'businesses': (1, 20)}
+        self.assertEqual(list(generate_reviews(plan, 3, 50)),
+                         list(generate_reviews(plan, 3, 50)))
+        self.assertNotEqual(list(generate_reviews(plan, 3, 50)),
+                            list(generate_reviews(plan, 4, 50)))
+
+    def tearDown(self):
+        """Tear down all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""Contain tests for what a fresh process loads to build the app."""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTIONAL = ['api.cache', 'api.metrics', 'api.profiler', 'api.ratelimit',
+            'multiprocessing']
+SCRIPT = ('import json, sys\n'
+          'from api import create_app\n'
+          'create_app("testing", **json.loads(sys.argv[1]))\n'
+          'print(json.dumps(sorted(sys.modules)))\n')
+
+
+def loaded_modules(**settings):
+    """Build a testing app in a new interpreter; return its modules."""
+    env = dict(os.environ, APP_CONFIGURATION='testing')
+    process = subprocess.run(
+        [sys.executable, '-c', SCRIPT, json.dumps(settings)], cwd=ROOT,
+        env=env, stdout=subprocess.PIPE, check=True)
+    return set(json.loads(process.stdout.decode('utf-8')))
+
+
+class StartupTestCase(unittest.TestCase):
+    """This class represents the cold start test case."""
+
+    def test_subsystems_turned_off_are_not_imported(self):
+        """A worker without them never loads the optional subsystems."""
+        modules = loaded_modules(
+            RESPONSE_CACHE_TTL=0, RATELIMIT_ENABLED=False,
+            METRICS_ENABLED=False, PROFILER_ENABLED=False,
+            PASSWORD_HASH_WORKERS=0)
+        self.assertFalse(modules & set(OPTIONAL))
+
+    def test_subsystems_turned_on_are_imported(self):
+        """The same check sees them once their settings enable them."""
+        modules = loaded_modules(
+            RESPONSE_CACHE_TTL=60, RATELIMIT_ENABLED=True,
+            METRICS_ENABLED=True, PROFILER_ENABLED=True)
+        self.assertTrue(set(OPTIONAL[:-1]) <= modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,11 @@
 """Contain tests for the user endpoints."""
 from flask import json
+import threading
 import unittest
 # local imports
-from api.models import db
-from api.routes import app
+from api.models import User, db
+from api.passwords import PasswordHasher, passwords
+from run import app
 
 
 class UserRoutesTestCase(unittest.TestCase):
@@ -55,6 +57,16 @@ class UserRoutesTestCase(unittest.TestCase):
         self.assertEqual(self.response.status_code, 201)
         self.assertIn("My Test Name", str(self.response.data))
 
+    def test_register_user_with_a_list_body(self):
+        """A JSON body that is not an object is a validation error."""
+        self.response = self.client.post('/api/v2/auth/register',
+                                         data=json.dumps([1]),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.assertEqual(self.response.status_code, 400)
+        self.assertIn("must be a JSON object", str(self.response.data))
+
     def test_register_user_with_existing_email_returns_error_msg(self):
         """Test user registration with all info provided."""
         self.client.post('/api/v2/auth/register',
@@ -100,6 +112,55 @@ class UserRoutesTestCase(unittest.TestCase):
         self.assertEqual(self.response.status_code, 200)
         self.assertIn("Log in successful", str(self.response.data))
 
+    def test_login_user_with_email(self):
+        """Test user login using an email instead of a username."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.test_user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps({
+                                             "email": "test1@testing.com",
+                                             "password": "123$usr"}),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.assertEqual(self.response.status_code, 200)
+        self.assertIn("Log in successful", str(self.response.data))
+
+    def test_login_user_with_a_username_in_email(self):
+        """The email key matches a username too, as it always has."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.test_user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps({
+                                             "email": "test1",
+                                             "password": "123$usr"}),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.assertEqual(self.response.status_code, 200)
+        self.assertIn("Log in successful", str(self.response.data))
+
+    def test_register_user_with_an_email_taken_as_a_username(self):
+        """An email equal to someone's username is refused."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(dict(self.test_user,
+                                              username="a@b.co")),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post(
+            '/api/v2/auth/register',
+            data=json.dumps(dict(self.test_user2, email="a@b.co")),
+            headers={'content-type': 'application/json'})
+        self.assertEqual(self.response.status_code, 400)
+        self.assertIn("Email already registered!", str(self.response.data))
+
     def test_login_user_with_non_existent_email(self):
         """Try to login with no user created."""
         self.response = self.client.post('/api/v2/auth/login',
@@ -127,6 +188,76 @@ class UserRoutesTestCase(unittest.TestCase):
         self.assertIn("Wrong email or username/password combination",
                       str(self.response.data))
 
+    def test_logout_revokes_the_token(self):
+        """Test a token stops working once its user logs out."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.test_user),
+                         headers={
+                             'content-type': 'application/json'
+                         })
+        self.response = self.client.post('/api/v2/auth/login',
+                                         data=json.dumps(self.test_login),
+                                         headers={
+                                             'content-type': 'application/json'
+                                         })
+        self.token = json.loads(self.response.data)['token']  # grab the token
+        self.response = self.client.post('/api/v2/auth/logout',
+                                         headers={
+                                             'x-access-token': self.token
+                                         })
+        self.assertEqual(self.response.status_code, 200)
+        self.response = self.client.post('/api/v2/auth/logout',
+                                         headers={
+                                             'x-access-token': self.token
+                                         })
+        self.assertEqual(self.response.status_code, 400)
+        self.assertIn("User is not logged in", str(self.response.data))
+
+    def test_login_rehashes_a_password_made_with_old_settings(self):
+        """A login upgrades a hash made with another hashing method."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.test_user),
+                         headers={'content-type': 'application/json'})
+        method = passwords.method
+        passwords.method, passwords._prefix = 'pbkdf2:sha256:2', None
+        try:
+            self.response = self.client.post(
+                '/api/v2/auth/login', data=json.dumps(self.test_login),
+                headers={'content-type': 'application/json'})
+            self.assertEqual(self.response.status_code, 200)
+            with self.app.app_context():
+                self.assertTrue(User.get_by_username('test1').password.
+                                startswith('pbkdf2:sha256:2$'))
+        finally:
+            passwords.method, passwords._prefix = method, None
+
+    def test_login_is_turned_away_when_hashing_is_saturated(self):
+        """A full hashing queue answers 503 instead of queueing logins."""
+        self.client.post('/api/v2/auth/register',
+                         data=json.dumps(self.test_user),
+                         headers={'content-type': 'application/json'})
+        workers, slots = passwords.workers, passwords._slots
+        passwords.workers = 1
+        passwords._slots = threading.BoundedSemaphore(1)
+        passwords._slots.acquire()
+        try:
+            self.response = self.client.post(
+                '/api/v2/auth/login', data=json.dumps(self.test_login),
+                headers={'content-type': 'application/json'})
+            self.assertEqual(self.response.status_code, 503)
+            self.assertEqual(self.response.headers['Retry-After'], '1')
+        finally:
+            passwords.workers, passwords._slots = workers, slots
+
+    def test_hashing_runs_in_processes_not_forked_from_this_one(self):
+        """Pool processes come from a forkserver, so no lock is inherited."""
+        hasher = PasswordHasher('pbkdf2:sha256:1', workers=1)
+        self.addCleanup(hasher.shutdown)
+        pwhash = hasher.hash('123$usr')
+        self.assertTrue(hasher.check(pwhash, '123$usr'))
+        self.assertFalse(hasher.check(pwhash, '123$usx'))
+        self.assertEqual(hasher._pool._ctx.get_start_method(), 'forkserver')
+
     def test_reset_password_with_correct_token(self):
         """Test password change with a token passed into the headers."""
         self.client.post('/api/v2/auth/register',
@@ -0,0 +1,39 @@
+"""Contain tests for getting a worker ready for traffic."""
+import unittest
+# local imports
+from api.metrics import metrics
+from api.models import db
+from run import app
+from api.warmup import dispose_engines, prepare, warm_up
+
+
+class WarmUpTestCase(unittest.TestCase):
+    """This class represents the warm up test case."""
+
+    def setUp(self):
+        """Start from empty metrics."""
+        self.app = app
+        with self.app.app_context():
+            db.create_all()
+        metrics.reset()
+
+    def test_warm_up_is_timed(self):
+        """Warm up times each step and leaves no metrics behind."""
+        dispose_engines(self.app, db)
+        prepare()
+        timings = warm_up(self.app, db, connections=2,
+                          paths=['/api/v2/businesses/?limit=20'])
+        self.assertEqual(sorted(timings),
+                         ['connections', 'passwords', 'requests'])
+        self.assertEqual(metrics.latency, {})
+
+    def tearDown(self):
+        """Tear down all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    unittest.main()